@@ -1,10 +1,16 @@
+import asyncio
 import os
+import time
 import uuid
 from pathlib import Path
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response
 from dotenv import load_dotenv
 
 from .models.schemas import TaskStatus, UploadResponse
@@ -12,16 +18,27 @@ from .services.gemini_processor import process_audio_task, task_store
 from .services.mindmap_generator import generate_mindmap_from_content_blocks
 import os
 from .routers import document_qa
-from .routes import invoice_manager, icon_generator, poster_generator
+from .routes import invoice_manager, invoice_legacy, icon_generator, poster_generator
 from .services.token_service import get_token_service
-import traceback
+from .services.usage_ledger import get_usage_ledger, usage_context
+from .services.metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .services.metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_PROGRESS
+from .services.structured_logging import setup_logging, get_logger
+from starlette.routing import Match
 
 # 載入環境變數
 load_dotenv()
 
+# 設定非阻塞的結構化日誌
+setup_logging()
+logger = get_logger(__name__)
+
 # 建立 FastAPI 應用程式實例
 app = FastAPI(title="AI Smart Meeting Notes Assistant API")
 
+# 啟動時建立的背景補算工作；保留參照，關閉時取消並等待結束
+_background_tasks: List[asyncio.Task] = []
+
 # 應用啟動事件：載入已存在的筆記
 @app.on_event("startup")
 async def startup_event():
@@ -29,9 +46,48 @@ async def startup_event():
     try:
         from .services.gemini_processor import reload_task_store
         reload_task_store()
-        print("✅ 已載入現有筆記到任務存儲")
+        logger.info("已載入現有筆記到任務存儲")
+    except Exception as e:
+        logger.error("載入現有筆記失敗: %s", e)
+    
+    # 建立發票資料表並補上新欄位與索引（背景工作依賴新欄位，須先完成）
+    from .services.invoice_database import engine as invoice_engine, init_database
+    await asyncio.to_thread(init_database, invoice_engine)
+    # 複製舊版獨立發票後端的上傳圖片並改寫路徑（補算雜湊與縮圖前完成）
+    try:
+        await asyncio.to_thread(invoice_manager.migrate_legacy_uploads)
     except Exception as e:
-        print(f"❌ 載入現有筆記失敗: {e}")
+        logger.error("遷移舊版發票圖片失敗: %s", e)
+    
+    # 在背景為舊發票補算圖片雜湊，供重複上傳偵測使用
+    _background_tasks.append(asyncio.create_task(invoice_manager.backfill_hashes()))
+    # 為舊發票補產生縮圖（在進程池中逐筆進行）
+    _background_tasks.append(asyncio.create_task(invoice_manager.backfill_thumbnails()))
+
+# 應用關閉事件：寫入尚未持久化的元數據
+@app.on_event("shutdown")
+async def shutdown_event():
+    """應用關閉時將防抖中的元數據快照寫入磁碟"""
+    from .services.metadata_store import flush_all_stores
+    # 先停止背景補算，再關閉它們使用的進程池與資料庫引擎
+    for task in _background_tasks:
+        task.cancel()
+    for result in await asyncio.gather(*_background_tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error("背景補算失敗: %s", result)
+    _background_tasks.clear()
+    await invoice_manager.ocr_queue.stop()
+    from .services.image_preprocessor import get_image_preprocessor
+    from .services.thumbnail_service import get_thumbnail_service
+    from .services.pdf_loader import shutdown_pdf_executor
+    get_image_preprocessor().shutdown()
+    get_thumbnail_service().shutdown()
+    shutdown_pdf_executor()
+    from .services.invoice_database import async_engine
+    await async_engine.dispose()
+    flush_all_stores()
+    token_service.flush()
+    get_usage_ledger().flush()
 
 # 設定 CORS 中介軟體，允許前端連接
 app.add_middleware(
@@ -40,16 +96,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+def _resolve_route(request: Request) -> str:
+    """取得請求對應的路由模板，避免以實際路徑（含 ID）作為標籤"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, 'path', "unmatched")
+    return "unmatched"
+
+# 請求中介軟體：記錄每個路由的延遲，並將本次請求中的 LLM 用量記到對應的路由
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    route = _resolve_route(request)
+    status = 500
+    started = time.perf_counter()
+    HTTP_REQUESTS_IN_PROGRESS.inc(method=request.method, route=route)
+    try:
+        with usage_context(endpoint=f"{request.method} {route}"):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUESTS_IN_PROGRESS.dec(method=request.method, route=route)
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, method=request.method, route=route, status=str(status)
+        )
+
 # 包含路由器
 app.include_router(document_qa.router)
 app.include_router(invoice_manager.router)
+# 原 AI Invoice Manager 後端的 API 路徑，共用同一個發票服務
+app.include_router(invoice_legacy.router)
 app.include_router(icon_generator.router)
 app.include_router(poster_generator.router)
 
+class CachedStaticFiles(StaticFiles):
+    """上傳檔名含時間戳與隨機碼、不會被覆寫，允許瀏覽器長期快取（ETag 由 StaticFiles 產生）"""
+    
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", "public, max-age=86400")
+        return response
+
 # 靜態文件服務
-app.mount("/uploads", StaticFiles(directory="./invoice_uploads"), name="uploads")
+app.mount("/uploads", CachedStaticFiles(directory="./invoice_uploads"), name="uploads")
 
 # 初始化 Token 服務
 token_service = get_token_service()
@@ -63,19 +156,59 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 async def root():
     return {"status": "ok"}
 
+# Prometheus 指標
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """以 Prometheus 文字格式輸出指標"""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 # Token 統計 API
 @app.get("/api/token-stats")
 async def get_token_stats(service: str = None):
     """獲取 Token 使用統計"""
     try:
+        # 讀取統計會取檔案鎖並解析日誌，在執行緒中進行避免阻塞事件循環
         if service:
-            stats = token_service.get_service_stats(service)
+            stats = await asyncio.to_thread(token_service.get_service_stats, service)
         else:
-            stats = token_service.get_all_stats()
+            stats = await asyncio.to_thread(token_service.get_all_stats)
         return stats
     except Exception as e:
         return {"error": str(e), "total_tokens": 0, "total_cost": 0.0}
 
+# Token 時間序列統計 API
+@app.get("/api/token-stats/timeseries")
+async def get_token_timeseries(
+    granularity: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    service: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    group_by: str = "service"
+):
+    """按分鐘/小時/天查詢 Token 用量，可依服務或端點分組"""
+    try:
+        return await asyncio.to_thread(
+            get_usage_ledger().query,
+            granularity=granularity,
+            start=start.timestamp() if start else None,
+            end=end.timestamp() if end else None,
+            service=service,
+            endpoint=endpoint,
+            group_by=group_by
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# 單一任務 Token 統計 API
+@app.get("/api/token-stats/tasks/{task_id}")
+async def get_task_token_stats(task_id: str):
+    """獲取單一任務的 Token 用量"""
+    usage = await asyncio.to_thread(get_usage_ledger().get_task_usage, task_id)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="Task usage not found")
+    return usage
+
 # 重新載入筆記 API
 @app.post("/api/v1/reload-notes")
 async def reload_notes():
@@ -134,12 +267,10 @@ async def get_notes_list():
         
         from .services.notes_manager import get_all_notes
         notes = get_all_notes()
-        print(f"獲取到 {len(notes)} 個筆記")
+        logger.debug("Listed notes", extra={"count": len(notes)})
         return {"notes": notes}
     except Exception as e:
-        print(f"獲取筆記列表錯誤: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("獲取筆記列表錯誤: %s", e)
         return {"notes": []}
 
 # GET 端點：搜尋筆記
@@ -151,7 +282,7 @@ async def search_notes(q: str = "", tags: str = "", color: str = "", favorite: b
         results = notes_manager.search_notes(q, tags.split(',') if tags else [], color, favorite)
         return {"notes": results}
     except Exception as e:
-        print(f"搜尋筆記錯誤: {e}")
+        logger.error("搜尋筆記錯誤: %s", e)
         return {"notes": []}
 
 # GET 端點：獲取所有標籤
@@ -172,19 +303,18 @@ async def get_all_tags():
         
         return {"tags": list(all_tags)}
     except Exception as e:
-        print(f"獲取標籤錯誤: {e}")
+        logger.error("獲取標籤錯誤: %s", e)
         return {"tags": []}
 
 # GET 端點：查詢任務狀態和結果
 @app.get("/api/v1/notes/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
     """查詢任務狀態和結果"""
-    print(f"查詢任務: {task_id}")
-    print(f"當前 task_store 中的 task_id: {list(task_store.keys())}")
+    # 前端會輪詢此端點，只記錄取樣後的 DEBUG 日誌
+    logger.debug("Task status poll", extra={"task_id": task_id, "task_store_size": len(task_store), "sample_rate": 0.1})
     
     # 首先檢查 task_store
     if task_id in task_store:
-        print(f"在 task_store 中找到任務: {task_id}")
         task_data = task_store[task_id]
         return TaskStatus(
             task_id=task_id,
@@ -197,16 +327,13 @@ async def get_task_status(task_id: str):
     # 如果 task_store 中沒有，嘗試從 notes_manager 中獲取
     try:
         from .services.notes_manager import notes_manager
-        print(f"嘗試從 notes_manager 獲取任務: {task_id}")
-        
         # 檢查是否在筆記索引中
         if task_id in notes_manager.notes_index:
-            print(f"在 notes_manager 索引中找到任務: {task_id}")
             note_info = notes_manager.notes_index[task_id]
             full_note = notes_manager.get_note(task_id)
             
             if full_note:
-                print(f"成功讀取筆記文件: {task_id}")
+                logger.info("Reloaded note into task store", extra={"task_id": task_id})
                 # 重新載入到 task_store 以便後續使用
                 task_store[task_id] = {
                     "status": "completed",
@@ -223,15 +350,11 @@ async def get_task_status(task_id: str):
                     error=None
                 )
             else:
-                print(f"無法讀取筆記文件: {task_id}")
-        else:
-            print(f"在 notes_manager 索引中未找到任務: {task_id}")
+                logger.warning("無法讀取筆記文件", extra={"task_id": task_id})
     except Exception as e:
-        print(f"從筆記管理器獲取任務失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("從筆記管理器獲取任務失敗: %s", e)
     
-    print(f"任務未找到: {task_id}")
+    logger.info("Task not found", extra={"task_id": task_id})
     raise HTTPException(status_code=404, detail="Task not found")
 
 # PUT 端點：編輯筆記標題
@@ -252,7 +375,7 @@ async def update_note_title(task_id: str, title_data: dict):
         else:
             return {"status": "error", "message": "更新標題失敗"}
     except Exception as e:
-        print(f"更新標題錯誤: {e}")
+        logger.error("更新標題錯誤: %s", e, extra={"task_id": task_id})
         return {"status": "error", "message": str(e)}
 
 # PUT 端點：更新筆記屬性
@@ -268,7 +391,7 @@ async def update_note_properties(task_id: str, properties: dict):
         else:
             return {"status": "error", "message": "更新屬性失敗"}
     except Exception as e:
-        print(f"更新屬性錯誤: {e}")
+        logger.error("更新屬性錯誤: %s", e, extra={"task_id": task_id})
         return {"status": "error", "message": str(e)}
 
 # DELETE 端點：刪除筆記
@@ -295,7 +418,7 @@ async def delete_note(task_id: str):
         else:
             return {"status": "error", "message": "刪除筆記時發生錯誤"}
     except Exception as e:
-        print(f"刪除筆記錯誤: {e}")
+        logger.exception("刪除筆記錯誤: %s", e)
         return {"status": "error", "message": str(e)}
 
 # POST 端點：生成心智圖
@@ -323,7 +446,7 @@ async def generate_mindmap(task_id: str):
             else:
                 raise HTTPException(status_code=404, detail="Task not found")
         except Exception as e:
-            print(f"從筆記管理器獲取任務失敗: {e}")
+            logger.warning("從筆記管理器獲取任務失敗: %s", e, extra={"task_id": task_id})
             raise HTTPException(status_code=404, detail="Task not found")
     
     task_data = task_store[task_id]
@@ -345,11 +468,11 @@ async def generate_mindmap(task_id: str):
                 {"type": "callout", "content": {"icon": "📝", "style": "info", "text": getattr(result, 'summary', '無摘要')}}
             ]
         
-        print(f"開始生成心智圖，內容區塊數量: {len(content_blocks)}")
+        logger.info("開始生成心智圖", extra={"task_id": task_id, "content_blocks": len(content_blocks)})
         
         mindmap = await generate_mindmap_from_content_blocks(content_blocks)
         
-        print(f"心智圖生成成功")
+        logger.info("心智圖生成成功", extra={"task_id": task_id})
         
         # 更新任務結果
         if hasattr(mindmap, 'dict'):
@@ -370,15 +493,14 @@ async def generate_mindmap(task_id: str):
         try:
             from .services.notes_manager import notes_manager
             notes_manager.update_note_mindmap(task_id, mindmap_dict)
-            print(f"心智圖已保存到持久化存儲: {task_id}")
+            logger.debug("心智圖已保存到持久化存儲", extra={"task_id": task_id})
         except Exception as save_error:
-            print(f"保存心智圖到持久化存儲失敗: {save_error}")
+            logger.warning("保存心智圖到持久化存儲失敗: %s", save_error, extra={"task_id": task_id})
         
         return {"status": "success", "mindmap": mindmap_dict}
     except Exception as e:
         error_msg = f"Mindmap generation error: {str(e)}"
-        print(error_msg)
-        traceback.print_exc()
+        logger.exception(error_msg, extra={"task_id": task_id})
         
         # 返回預設心智圖而不是拋出錯誤
         default_mindmap = {
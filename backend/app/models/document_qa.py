@@ -22,6 +22,7 @@ class QuestionRequest(BaseModel):
     question: str
     document_ids: Optional[List[str]] = None
     session_id: Optional[str] = None
+    include_timings: bool = False  # 回傳各階段耗時（毫秒）
 
 class SourceInfo(BaseModel):
     """來源信息模型"""
@@ -51,11 +52,13 @@ class QuestionResponse(BaseModel):
     sources: List[SourceInfo]  # 保留原有格式兼容性
     source_documents: Optional[List[SourceDocument]] = []  # 新增優化的來源預覽
     timestamp: datetime
+    timings: Optional[Dict[str, float]] = None  # 各階段耗時（毫秒），僅在 include_timings 時提供
 
 class SummaryRequest(BaseModel):
     """摘要請求模型"""
     document_ids: Optional[List[str]] = None
     session_id: Optional[str] = None
+    mode: str = "cached"  # "cached": 使用文檔摘要快取, "full": 完整 map-reduce 摘要
 
 class SummaryResponse(BaseModel):
     """摘要回應模型"""
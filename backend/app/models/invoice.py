@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from pydantic import BaseModel
@@ -23,8 +23,35 @@ class Invoice(Base):
     status = Column(String(20), default="pending")
     image_path = Column(String(500))
     ocr_text = Column(Text)
+    image_hash = Column(String(16), index=True)  # 圖片 dHash，版面相似的候選重複
+    content_hash = Column(String(64), index=True)  # 圖片檔案 SHA-256，內容完全相同才視為重複上傳
+    thumbnail_url = Column(String(200))  # 內容雜湊命名的縮圖網址（列表用）
+    preview_url = Column(String(200))    # 內容雜湊命名的預覽圖網址（詳情用）
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (
+        # 列表：依類別/狀態篩選並依建立時間排序
+        Index("ix_invoices_created_id", "created_at", "id"),
+        Index("ix_invoices_category_created", "category", "created_at", "id"),
+        Index("ix_invoices_status_created", "status", "created_at", "id"),
+        # 統計：類別分組加總只需掃描此覆蓋索引，不必讀取含 OCR 文字的資料列
+        Index("ix_invoices_category_amount", "category", "total_amount"),
+    )
+
+class InvoiceAggregate(Base):
+    """發票統計彙總（依類別、月份、商家），隨發票新增/修改/刪除增量維護"""
+    __tablename__ = "invoice_aggregates"
+    
+    dimension = Column(String(20), primary_key=True)  # category / month / vendor
+    key = Column(String(200), primary_key=True)        # 類別名稱、YYYY-MM 或商家名稱（空值為空字串）
+    count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0.0)
+    tax_amount = Column(Float, nullable=False, default=0.0)
+    
+    __table_args__ = (
+        Index("ix_invoice_aggregates_dimension_amount", "dimension", "total_amount"),
+    )
 
 class InvoiceCreate(BaseModel):
     """建立發票的請求模型"""
@@ -50,8 +77,12 @@ class InvoiceResponse(BaseModel):
     category: Optional[str]
     status: str
     image_path: Optional[str]
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
     created_at: datetime
     updated_at: datetime
+    duplicate_of_id: Optional[int] = None  # 與既有發票圖片相同時，指向既有發票（未重新 OCR）
+    suspected_duplicate_of_id: Optional[int] = None  # 圖片相似且 OCR 欄位相符，可能重複，由使用者確認
     
     class Config:
         from_attributes = True
@@ -60,4 +91,39 @@ class InvoiceStats(BaseModel):
     """發票統計模型"""
     total_invoices: int
     total_amount: float
-    category_stats: List[dict]
\ No newline at end of file
+    category_stats: List[dict]
+
+class InvoiceTimeBucket(BaseModel):
+    """時間區間統計"""
+    period: str
+    count: int
+    total_amount: float
+    tax_amount: float
+
+class InvoiceVendorStats(BaseModel):
+    """商家統計"""
+    vendor_name: Optional[str]
+    count: int
+    total_amount: float
+    tax_amount: float
+
+class InvoiceJob(BaseModel):
+    """發票 OCR 工作狀態"""
+    job_id: str
+    batch_id: Optional[str] = None
+    filename: Optional[str] = None
+    status: str
+    invoice_id: Optional[int] = None
+    duplicate: Optional[bool] = None
+    duplicate_of_id: Optional[int] = None
+    suspected_duplicate_of_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    completed_at: Optional[str] = None
+
+class BatchUploadResponse(BaseModel):
+    """批次上傳回應模型"""
+    batch_id: str
+    jobs: List[InvoiceJob]
+    rejected: List[dict] = []
@@ -8,6 +8,7 @@ class TokenUsage(BaseModel):
     output_tokens: int = 0
     audio_input_tokens: Optional[int] = None  # 音頻輸入 token
     image_count: Optional[int] = None  # 圖片生成數量
+    latency_ms: Optional[float] = None  # 模型呼叫延遲（毫秒）
     
 class CostCalculation(BaseModel):
     """費用計算模型"""
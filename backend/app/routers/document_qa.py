@@ -3,9 +3,9 @@ from typing import List
 from ..models.document_qa import DocumentInfo, QuestionRequest, QuestionResponse, SummaryRequest, SummaryResponse, QuizRequest, QuizResponse, QuizQuestion
 
 from ..services.rag_service import RAGService
-import logging
+from ..services.structured_logging import get_logger
 
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
 
 router = APIRouter(prefix="/api/document-qa", tags=["document-qa"])
 
@@ -21,14 +21,15 @@ def get_rag_service():
 rag_service = get_rag_service()
 
 @router.post("/upload", response_model=DocumentInfo)
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(file: UploadFile = File(...), background: bool = False):
+    """上傳文件；background=true 時立即返回，索引在背景進行"""
     try:
         allowed_types = ["text/plain", "application/pdf"]
         if file.content_type not in allowed_types:
             raise HTTPException(status_code=400, detail="不支援的文件格式")
         
         content = await file.read()
-        doc_id = await rag_service.add_document(content, file.filename, file.content_type)
+        doc_id = await rag_service.add_document(content, file.filename, file.content_type, wait=not background)
         doc_info = rag_service.get_document_info(doc_id)
         
         return DocumentInfo(
@@ -40,9 +41,7 @@ async def upload_document(file: UploadFile = File(...)):
             status=doc_info["status"]
         )
     except Exception as e:
-        print(f"Upload error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=f"文件上傳失敗: {str(e)}")
 
 @router.get("/documents", response_model=List[DocumentInfo])
@@ -77,7 +76,11 @@ async def delete_document(doc_id: str):
 async def ask_question(request: QuestionRequest):
     try:
         # 暫時跳過去識別化處理，直接使用原始問題
-        result = await rag_service.query_documents(request.question, session_id=request.session_id)
+        result = await rag_service.query_documents(
+            request.question,
+            session_id=request.session_id,
+            include_timings=request.include_timings
+        )
         
         return {
             "id": result["id"],
@@ -85,7 +88,8 @@ async def ask_question(request: QuestionRequest):
             "answer": result["answer"],
             "sources": result.get("sources", []),
             "source_documents": result.get("source_documents", []),
-            "timestamp": result.get("timestamp", "2024-01-01T00:00:00")
+            "timestamp": result.get("timestamp", "2024-01-01T00:00:00"),
+            "timings": result.get("timings")
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"問答失敗: {str(e)}")
@@ -159,23 +163,21 @@ async def get_session_documents(session_id: str):
 @router.post("/summary", response_model=SummaryResponse)
 async def generate_summary(request: SummaryRequest):
     try:
-        print(f"Summary request: session_id={request.session_id}, document_ids={request.document_ids}")
-        result = await rag_service.generate_summary(session_id=request.session_id)
+        logger.debug(f"Summary request: session_id={request.session_id}, document_ids={request.document_ids}")
+        result = await rag_service.generate_summary(session_id=request.session_id, mode=request.mode)
         return SummaryResponse(
             summary=result["summary"],
             key_points=result["key_points"],
             timestamp=result.get("timestamp", "2024-01-01T00:00:00")
         )
     except Exception as e:
-        print(f"Summary generation error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Summary generation error: {e}")
         raise HTTPException(status_code=500, detail=f"生成摘要失敗: {str(e)}")
 
 @router.post("/quiz", response_model=QuizResponse)
 async def generate_quiz(request: QuizRequest):
     try:
-        print(f"Quiz request: session_id={request.session_id}, document_ids={request.document_ids}, num_questions={request.num_questions}")
+        logger.debug(f"Quiz request: session_id={request.session_id}, document_ids={request.document_ids}, num_questions={request.num_questions}")
         result = await rag_service.generate_quiz(session_id=request.session_id, num_questions=request.num_questions)
         questions = [
             QuizQuestion(
@@ -188,16 +190,14 @@ async def generate_quiz(request: QuizRequest):
         ]
         return QuizResponse(questions=questions, timestamp=result.get("timestamp", "2024-01-01T00:00:00"))
     except Exception as e:
-        print(f"Quiz generation error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Quiz generation error: {e}")
         raise HTTPException(status_code=500, detail=f"生成測驗失敗: {str(e)}")
 
 @router.get("/health")
 async def health_check():
     """系統健康檢查端點"""
     try:
-        health_status = rag_service.health_check()
+        health_status = await rag_service.health_check()
         status_code = 200 if health_status["status"] == "healthy" else 503
         return health_status
     except Exception as e:
@@ -4,6 +4,9 @@ import uuid
 import asyncio
 from ..services.prompt_service import enhance_prompt_for_icon
 from ..services.image_service import generate_image_from_prompt
+from ..services.structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 # 建立路由器
 router = APIRouter(prefix="/api/v1/icon-generator", tags=["icon-generator"])
@@ -43,7 +46,7 @@ async def generate_icon(background_tasks: BackgroundTasks, request: dict):
         
         # 使用 Prompt Enhancement Engine
         enhanced_prompt = await enhance_prompt_for_icon(subject, style, composition)
-        print(f"Enhanced prompt: {enhanced_prompt}")
+        logger.debug("Enhanced prompt: %s", enhanced_prompt)
         
         # 儲存任務
         icon_tasks[task_id] = {
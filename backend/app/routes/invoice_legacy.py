@@ -0,0 +1,45 @@
+from fastapi import APIRouter, File, UploadFile, Depends, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+
+from ..models.invoice import InvoiceResponse, InvoiceStats
+from ..services.invoice_database import get_async_db
+from . import invoice_manager
+
+# 原獨立的 AI Invoice Manager 後端的 API 路徑，轉接到統一的發票服務
+# （同一個資料庫連線池、OCR 服務與工作佇列）。
+# GET/PUT /api/invoice/{invoice_id} 與新路徑相同，由 invoice_manager 直接提供。
+router = APIRouter(prefix="/api", tags=["invoice-legacy"], deprecated=True)
+
+@router.post("/upload-invoice", response_model=InvoiceResponse)
+async def upload_invoice(
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """上傳發票圖片並進行 OCR 識別（同 POST /api/invoice/upload）"""
+    return await invoice_manager.upload_invoice(file=file, force=False, db=db)
+
+@router.get("/invoices", response_model=List[InvoiceResponse])
+async def get_invoices(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=500),
+    category: str = None,
+    status: str = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """取得發票列表（同 GET /api/invoice/list，依建立時間由新到舊排序）"""
+    return await invoice_manager.get_invoices(
+        response=response, skip=skip, limit=limit, cursor=None, category=category, status=status,
+        date_from=None, date_to=None, min_amount=None, max_amount=None, vendor=None, fields=None, db=db
+    )
+
+@router.get("/categories")
+async def get_categories():
+    """取得費用分類列表（同 GET /api/invoice/categories/list）"""
+    return await invoice_manager.get_categories()
+
+@router.get("/stats", response_model=InvoiceStats)
+async def get_stats(db: AsyncSession = Depends(get_async_db)):
+    """取得統計資訊（同 GET /api/invoice/stats/summary）"""
+    return await invoice_manager.get_invoice_stats(db=db)
@@ -1,25 +1,37 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, MetaData, func
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import Integer, String, bindparam, select, tuple_, type_coerce, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer, load_only
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional
+import asyncio
+import base64
+import filecmp
 import os
 import shutil
+import threading
 import uuid
 
-from ..models.invoice import Base, Invoice, InvoiceCreate, InvoiceResponse, InvoiceStats
+from ..models.invoice import (
+    Invoice, InvoiceCreate, InvoiceResponse, InvoiceStats, InvoiceJob, BatchUploadResponse,
+    InvoiceTimeBucket, InvoiceVendorStats
+)
+from ..services.invoice_database import AsyncSessionLocal, SessionLocal, get_async_db
+from ..services import invoice_export, invoice_stats
 from ..services.invoice_ocr_service import InvoiceOCRService
+from ..services.invoice_job_queue import InvoiceJobQueue
+from ..services.image_hash import (
+    DuplicateMatch, ImageHashIndex, compute_content_hash, compute_dhash, same_invoice_fields
+)
+from ..services.thumbnail_service import get_thumbnail_service
+from ..services.structured_logging import get_logger
 
-router = APIRouter(prefix="/api/invoice", tags=["invoice"])
-
-# 資料庫設定
-DATABASE_URL = "sqlite:///./database/invoices.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = get_logger(__name__)
 
-# 建立資料表
-Base.metadata.create_all(bind=engine)
+router = APIRouter(prefix="/api/invoice", tags=["invoice"])
 
 # 上傳目錄
 UPLOAD_DIR = "./invoice_uploads"
@@ -27,125 +39,602 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # 初始化服務
 ocr_service = InvoiceOCRService()
+thumbnail_service = get_thumbnail_service()
+
+# 圖片雜湊索引：內容完全相同時不再呼叫 OCR；dHash 相近只作為疑似重複的候選
+hash_index = ImageHashIndex(
+    SessionLocal,
+    max_distance=int(os.getenv("INVOICE_DUPLICATE_MAX_DISTANCE", "4"))
+)
+
+# 舊版獨立發票後端（AI Invoice Manager）的上傳目錄；相對路徑以統一後端目錄為準
+LEGACY_UPLOAD_DIR = os.getenv("INVOICE_LEGACY_UPLOAD_DIR", "../AI Invoice Manager/backend/uploads")
+
+def local_image_path(image_path: str) -> str:
+    """將 /uploads/ 網址轉為本地檔案路徑"""
+    return image_path.replace('/uploads/', './invoice_uploads/')
 
-def get_db():
-    """取得資料庫連線"""
+def _legacy_source_path(image_path: str, legacy_dir: str) -> Optional[str]:
+    """舊版記錄的 image_path 是本地路徑（例如 ./uploads/xxx.jpg），找出檔案實際位置"""
+    if os.path.isabs(image_path) and os.path.isfile(image_path):
+        return image_path
+    candidate = os.path.join(legacy_dir, os.path.basename(image_path))
+    return candidate if os.path.isfile(candidate) else None
+
+def migrate_legacy_uploads(legacy_dir: str = LEGACY_UPLOAD_DIR, batch_size: int = 200) -> int:
+    """將舊版後端上傳的圖片複製到 invoice_uploads，並把 image_path 改為 /uploads/ 網址，回傳遷移筆數
+
+    找不到檔案的記錄維持原樣，下次啟動再試；原目錄的檔案不會刪除。
+    遷移的發票清空雜湊與縮圖欄位，由啟動時的補算重新產生。
+    """
     db = SessionLocal()
+    migrated = 0
+    missing = 0
+    last_id = 0
     try:
-        yield db
+        while True:
+            rows = db.query(Invoice.id, Invoice.image_path).filter(
+                Invoice.id > last_id,
+                Invoice.image_path.isnot(None),
+                ~Invoice.image_path.startswith("/uploads/")
+            ).order_by(Invoice.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            values = []
+            for invoice_id, image_path in rows:
+                source = _legacy_source_path(image_path, legacy_dir)
+                if source is None:
+                    missing += 1
+                    continue
+                filename = os.path.basename(source)
+                target = os.path.join(UPLOAD_DIR, filename)
+                # 同名但內容不同的檔案不覆寫；內容相同表示上次已複製但尚未更新記錄
+                if os.path.exists(target) and not filecmp.cmp(source, target, shallow=False):
+                    filename = f"legacy_{invoice_id}_{filename}"
+                    target = os.path.join(UPLOAD_DIR, filename)
+                if not os.path.exists(target):
+                    shutil.copy2(source, target)
+                values.append({
+                    "id": invoice_id, "image_path": f"/uploads/{filename}",
+                    "image_hash": None, "content_hash": None, "thumbnail_url": None, "preview_url": None
+                })
+            # 依主鍵批次更新，不載入完整的發票物件
+            if values:
+                db.execute(update(Invoice), values)
+                db.commit()
+                migrated += len(values)
     finally:
         db.close()
+    if migrated or missing:
+        logger.info("Migrated legacy invoice uploads", extra={"migrated": migrated, "missing": missing, "legacy_dir": legacy_dir})
+    return migrated
+
+def _save_upload(file: UploadFile) -> tuple:
+    """以唯一檔名儲存上傳的圖片，回傳 (檔名, 路徑)"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{file.filename}"
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    return filename, file_path
+
+async def _run_ocr(file_path: str, original_filename: str) -> dict:
+    """執行 OCR；失敗時回傳只有檔名的基本資料，讓使用者之後手動補齊"""
+    try:
+        ocr_result = await ocr_service.extract_invoice_info(file_path)
+        
+        if not ocr_result["success"]:
+            raise HTTPException(status_code=500, detail=f"OCR 識別失敗: {ocr_result['error']}")
+        return ocr_result
+    except Exception as ocr_error:
+        # 如果 OCR 失敗，創建基本記錄
+        logger.warning(f"OCR Error: {ocr_error}")
+        return {
+            "success": True,
+            "data": {
+                "invoice_number": None,
+                "invoice_date": None,
+                "vendor_name": original_filename,
+                "vendor_tax_id": None,
+                "total_amount": 0.0,
+                "tax_amount": 0.0,
+                "net_amount": 0.0,
+                "category": "其他"
+            },
+            "raw_text": ""
+        }
+
+# 處理中的圖片內容雜湊 -> 建立的發票 ID；同時上傳完全相同的圖片時，後到者等待第一張的結果
+_inflight_contents: Dict[str, asyncio.Future] = {}
+
+async def _hash_image(file_path: str) -> tuple:
+    """計算 (dHash, 內容雜湊)；無法讀取時回傳 (None, None)"""
+    try:
+        return await asyncio.to_thread(
+            lambda: (compute_dhash(file_path), compute_content_hash(file_path))
+        )
+    except Exception as e:
+        logger.warning(f"Image hash error: {e}", extra={"file_path": file_path})
+        return None, None
+
+async def _wait_for_inflight(content_hash: Optional[str]) -> Optional[int]:
+    """等待內容相同、正在處理中的上傳完成，回傳其發票 ID
+
+    沒有處理中的上傳（或它失敗）時回傳 None 並占用此雜湊，呼叫端完成後須以 _release_inflight 釋放。
+    """
+    while content_hash:
+        pending = _inflight_contents.get(content_hash)
+        if pending is None:
+            # 檢查與登記之間沒有 await，同一事件迴圈中的其他上傳一定看得到
+            _inflight_contents[content_hash] = asyncio.get_running_loop().create_future()
+            return None
+        invoice_id = await asyncio.shield(pending)
+        if invoice_id is not None:
+            return invoice_id
+    return None
+
+def _release_inflight(content_hash: Optional[str], invoice_id: Optional[int]) -> None:
+    pending = _inflight_contents.pop(content_hash, None) if content_hash else None
+    if pending is not None and not pending.done():
+        pending.set_result(invoice_id)
+
+async def _find_duplicate_image(image_hash: Optional[str], content_hash: Optional[str]) -> Optional[DuplicateMatch]:
+    """OCR 前比對既有發票圖片"""
+    if not image_hash and not content_hash:
+        return None
+    return await asyncio.to_thread(hash_index.find_duplicate, image_hash, content_hash)
+
+async def _suspected_duplicate_of(db: AsyncSession, match: Optional[DuplicateMatch], ocr_result: dict) -> Optional[int]:
+    """圖片相似（非完全相同）時，以 OCR 欄位確認是否可能為同一張發票"""
+    if match is None or match.exact:
+        return None
+    existing = await db.get(Invoice, match.invoice_id)
+    if existing is not None and same_invoice_fields(ocr_result["data"], existing):
+        return existing.id
+    return None
+
+async def _remove_unreferenced_thumbnails(db: AsyncSession, urls) -> None:
+    """縮圖以內容命名，可能與其他發票共用，沒有發票引用時才刪除"""
+    for url in urls:
+        if url and not (await db.execute(
+            select(Invoice.id).where((Invoice.thumbnail_url == url) | (Invoice.preview_url == url)).limit(1)
+        )).first():
+            thumbnail_service.remove(url)
+
+async def _discard_thumbnails(thumbnail_task: asyncio.Task) -> None:
+    """OCR 或寫入失敗時，等縮圖產生完成（進程池中的工作無法取消）再刪除其輸出"""
+    thumbnails = await thumbnail_task
+    if thumbnails:
+        async with AsyncSessionLocal() as db:
+            await _remove_unreferenced_thumbnails(db, thumbnails.values())
+
+async def _ocr_and_store(
+    db: AsyncSession, file_path: str, original_filename: str, filename: str,
+    image_hash: str = None, content_hash: str = None
+) -> tuple:
+    """OCR 並建立發票記錄，縮圖在進程池中同時產生；失敗時清除已產生的縮圖"""
+    thumbnail_task = asyncio.create_task(thumbnail_service.generate(file_path))
+    try:
+        ocr_result = await _run_ocr(file_path, original_filename)
+        thumbnails = await thumbnail_task
+        db_invoice, is_duplicate = await _create_invoice_record(
+            db, ocr_result, filename, image_hash, thumbnails, content_hash
+        )
+    except Exception:
+        await _discard_thumbnails(thumbnail_task)
+        raise
+    return ocr_result, db_invoice, is_duplicate
+
+async def backfill_hashes() -> int:
+    """在執行緒中為舊發票補算圖片雜湊，回傳補算筆數
+
+    執行緒無法以 cancel() 中斷：工作被取消時設定停止旗標，等執行緒處理完目前這筆再結束。
+    """
+    stop_event = threading.Event()
+    future = asyncio.ensure_future(asyncio.to_thread(hash_index.backfill, local_image_path, stop_event=stop_event))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        stop_event.set()
+        await future
+        raise
+
+async def backfill_thumbnails(batch_size: int = 100) -> int:
+    """為沒有縮圖的舊發票補產生縮圖，回傳補產生筆數
+
+    依 id 分頁只讀取 id 與圖片路徑，每頁各自提交；無法產生縮圖的發票以空字串標記，不再重試。
+    圖片檔案不存在時不標記，下次啟動再試（例如尚未遷移的舊版上傳）。
+    """
+    generated = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Invoice.id, Invoice.image_path).where(
+                    Invoice.id > last_id,
+                    Invoice.thumbnail_url.is_(None),
+                    Invoice.image_path.isnot(None)
+                ).order_by(Invoice.id).limit(batch_size)
+            )).all()
+            if not rows:
+                return generated
+            last_id = rows[-1].id
+            
+            values = []
+            for invoice_id, image_path in rows:
+                path = local_image_path(image_path)
+                if not os.path.isfile(path):
+                    continue
+                thumbnails = await thumbnail_service.generate(path)
+                if thumbnails:
+                    generated += 1
+                    values.append({"id": invoice_id, "thumbnail_url": thumbnails["thumbnail"], "preview_url": thumbnails["preview"]})
+                else:
+                    values.append({"id": invoice_id, "thumbnail_url": "", "preview_url": ""})
+            # 依主鍵批次更新，不載入完整的發票物件
+            if values:
+                await db.execute(update(Invoice), values)
+                await db.commit()
+
+async def _create_invoice_record(
+    db: AsyncSession,
+    ocr_result: dict,
+    filename: str,
+    image_hash: str = None,
+    thumbnails: dict = None,
+    content_hash: str = None
+) -> tuple:
+    """將 OCR 結果寫入發票表，回傳 (發票, 是否為重複號碼)"""
+    invoice_data = ocr_result["data"]
+    
+    # 檢查重複的發票號碼
+    invoice_number = invoice_data.get("invoice_number")
+    is_duplicate = False
+    if invoice_number:
+        existing = (await db.execute(
+            select(Invoice.id).where(Invoice.invoice_number == invoice_number).limit(1)
+        )).first()
+        if existing:
+            is_duplicate = True
+            invoice_number = f"{invoice_number}_副本_{uuid.uuid4().hex[:4]}"
+    
+    db_invoice = Invoice(
+        invoice_number=invoice_number,
+        invoice_date=datetime.strptime(invoice_data["invoice_date"], "%Y-%m-%d") if invoice_data.get("invoice_date") else None,
+        vendor_name=invoice_data.get("vendor_name"),
+        vendor_tax_id=invoice_data.get("vendor_tax_id"),
+        total_amount=invoice_data.get("total_amount", 0.0),
+        tax_amount=invoice_data.get("tax_amount", 0.0),
+        net_amount=invoice_data.get("net_amount", 0.0),
+        category=invoice_data.get("category", "其他"),
+        image_path=f"/uploads/{filename}",
+        ocr_text=ocr_result.get("raw_text", ""),
+        image_hash=image_hash,
+        content_hash=content_hash,
+        thumbnail_url=(thumbnails or {}).get("thumbnail"),
+        preview_url=(thumbnails or {}).get("preview"),
+        status="pending"
+    )
+    
+    db.add(db_invoice)
+    await db.commit()
+    await db.refresh(db_invoice)
+    if image_hash or content_hash:
+        hash_index.add(db_invoice.id, image_hash, content_hash)
+    return db_invoice, is_duplicate
+
+async def _process_ocr_job(payload: dict) -> dict:
+    """批次上傳的背景工作：OCR 後寫入資料庫
+
+    只有內容完全相同的圖片會跳過 OCR 並刪除上傳檔；圖片僅相似時照常建立發票，
+    OCR 欄位也相符才標記為疑似重複，由使用者確認。
+    """
+    file_path = payload["file_path"]
+    image_hash, content_hash = await _hash_image(file_path)
+    earlier_id = await _wait_for_inflight(content_hash)
+    claimed = None if earlier_id else content_hash
+    invoice_id = None
+    try:
+        match = DuplicateMatch(earlier_id, 0, True) if earlier_id else await _find_duplicate_image(image_hash, content_hash)
+        if match and match.exact:
+            os.remove(file_path)
+            invoice_id = match.invoice_id
+            return {"invoice_id": match.invoice_id, "duplicate": True, "duplicate_of_id": match.invoice_id}
+
+        async with AsyncSessionLocal() as db:
+            ocr_result, db_invoice, is_duplicate = await _ocr_and_store(
+                db, file_path, payload["original_filename"], payload["filename"], image_hash, content_hash
+            )
+            invoice_id = db_invoice.id
+            return {
+                "invoice_id": invoice_id,
+                "duplicate": is_duplicate,
+                "suspected_duplicate_of_id": await _suspected_duplicate_of(db, match, ocr_result)
+            }
+    finally:
+        _release_inflight(claimed, invoice_id)
+
+# 批次 OCR 工作佇列（worker 數量即同時進行的 OCR 上限）
+ocr_queue = InvoiceJobQueue(
+    _process_ocr_job,
+    workers=int(os.getenv("INVOICE_OCR_WORKERS", "4")),
+    max_queue_size=int(os.getenv("INVOICE_OCR_QUEUE_SIZE", "1000"))
+)
 
 @router.post("/upload", response_model=InvoiceResponse)
 async def upload_invoice(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    force: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """上傳發票圖片並進行 OCR 識別"""
+    """上傳發票圖片並進行 OCR 識別
+
+    圖片與既有發票內容完全相同時不呼叫 OCR，直接回傳既有發票並帶 duplicate_of_id；
+    force=true 時仍照常識別。圖片僅相似且 OCR 欄位相符時照常建立，並帶 suspected_duplicate_of_id。
+    """
+    claimed = None
+    invoice_id = None
     try:
         if not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="只接受圖片檔案")
         
-        # 生成唯一檔名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
         # 儲存檔案
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # OCR 識別
-        try:
-            ocr_result = await ocr_service.extract_invoice_info(file_path)
-            
-            if not ocr_result["success"]:
-                raise HTTPException(status_code=500, detail=f"OCR 識別失敗: {ocr_result['error']}")
-        except Exception as ocr_error:
-            # 如果 OCR 失敗，創建基本記錄
-            print(f"OCR Error: {ocr_error}")
-            ocr_result = {
-                "success": True,
-                "data": {
-                    "invoice_number": None,
-                    "invoice_date": None,
-                    "vendor_name": file.filename,
-                    "vendor_tax_id": None,
-                    "total_amount": 0.0,
-                    "tax_amount": 0.0,
-                    "net_amount": 0.0,
-                    "category": "其他"
-                },
-                "raw_text": ""
-            }
-        
-        # 建立發票記錄
-        invoice_data = ocr_result["data"]
+        filename, file_path = _save_upload(file)
         
-        # 檢查重複的發票號碼
-        invoice_number = invoice_data.get("invoice_number")
-        is_duplicate = False
-        if invoice_number:
-            existing = db.query(Invoice).filter(Invoice.invoice_number == invoice_number).first()
-            if existing:
-                is_duplicate = True
-                invoice_number = f"{invoice_number}_副本_{uuid.uuid4().hex[:4]}"
+        # 先以圖片雜湊檢查重複上傳，避免付費的 OCR 呼叫
+        image_hash, content_hash = await _hash_image(file_path)
+        match = None
+        if not force:
+            earlier_id = await _wait_for_inflight(content_hash)
+            claimed = None if earlier_id else content_hash
+            match = DuplicateMatch(earlier_id, 0, True) if earlier_id else await _find_duplicate_image(image_hash, content_hash)
+            if match and match.exact:
+                existing = await db.get(Invoice, match.invoice_id)
+                if existing:
+                    os.remove(file_path)
+                    response_data = existing.__dict__.copy()
+                    response_data['duplicate_of_id'] = existing.id
+                    return response_data
         
-        db_invoice = Invoice(
-            invoice_number=invoice_number,
-            invoice_date=datetime.strptime(invoice_data["invoice_date"], "%Y-%m-%d") if invoice_data.get("invoice_date") else None,
-            vendor_name=invoice_data.get("vendor_name"),
-            vendor_tax_id=invoice_data.get("vendor_tax_id"),
-            total_amount=invoice_data.get("total_amount", 0.0),
-            tax_amount=invoice_data.get("tax_amount", 0.0),
-            net_amount=invoice_data.get("net_amount", 0.0),
-            category=invoice_data.get("category", "其他"),
-            image_path=f"/uploads/{filename}",
-            ocr_text=ocr_result.get("raw_text", ""),
-            status="pending"
+        # OCR 識別並建立發票記錄（縮圖在進程池中同時產生，不增加回應時間）
+        ocr_result, db_invoice, is_duplicate = await _ocr_and_store(
+            db, file_path, file.filename, filename, image_hash, content_hash
         )
-        
-        db.add(db_invoice)
-        db.commit()
-        db.refresh(db_invoice)
+        invoice_id = db_invoice.id
         
         # 如果是重複發票，在回應中添加提醒
         response_data = db_invoice.__dict__.copy()
         if is_duplicate:
             response_data['_duplicate_warning'] = True
-            response_data['_original_invoice_number'] = invoice_data.get("invoice_number")
+            response_data['_original_invoice_number'] = ocr_result["data"].get("invoice_number")
+        response_data['suspected_duplicate_of_id'] = await _suspected_duplicate_of(db, match, ocr_result)
         
         return response_data
         
     except Exception as e:
-        print(f"Upload Error: {e}")
+        logger.warning(f"Upload Error: {e}")
         if 'file_path' in locals() and os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"上傳失敗: {str(e)}")
+    finally:
+        _release_inflight(claimed, invoice_id)
+
+@router.post("/batch-upload", response_model=BatchUploadResponse, status_code=202)
+async def batch_upload_invoices(files: List[UploadFile] = File(...)):
+    """批次上傳發票圖片：立即回傳工作 ID，OCR 由背景 worker 處理"""
+    batch_id = str(uuid.uuid4())
+    jobs = []
+    rejected = []
+    
+    for file in files:
+        if not file.content_type or not file.content_type.startswith("image/"):
+            rejected.append({"filename": file.filename, "reason": "只接受圖片檔案"})
+            continue
+        
+        filename, file_path = _save_upload(file)
+        try:
+            jobs.append(ocr_queue.submit({
+                "filename": filename,
+                "file_path": file_path,
+                "original_filename": file.filename
+            }, batch_id=batch_id))
+        except asyncio.QueueFull:
+            os.remove(file_path)
+            rejected.append({"filename": file.filename, "reason": "OCR 佇列已滿，請稍後再試"})
+    
+    if not jobs and rejected and all(item["reason"].startswith("OCR 佇列已滿") for item in rejected):
+        raise HTTPException(status_code=503, detail="OCR 佇列已滿，請稍後再試")
+    
+    return {"batch_id": batch_id, "jobs": jobs, "rejected": rejected}
+
+@router.get("/jobs/{job_id}", response_model=InvoiceJob)
+async def get_ocr_job(job_id: str):
+    """查詢單一 OCR 工作狀態"""
+    job = ocr_queue.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="工作不存在")
+    return job
+
+@router.get("/batches/{batch_id}")
+async def get_ocr_batch(batch_id: str):
+    """查詢批次上傳的整體進度"""
+    jobs = ocr_queue.get_batch(batch_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "total": len(jobs),
+        "status_counts": counts,
+        "jobs": jobs
+    }
+
+# 列表可選的欄位（fields 參數）；ocr_text 體積大，預設不載入
+LIST_FIELDS = {
+    "id", "invoice_number", "invoice_date", "vendor_name", "vendor_tax_id", "total_amount",
+    "tax_amount", "net_amount", "category", "status", "image_path", "thumbnail_url",
+    "preview_url", "ocr_text", "created_at", "updated_at"
+}
+
+# created_at 在 SQLite 中儲存的原始字串：CURRENT_TIMESTAMP 不含微秒，ORM 寫入的值含六位微秒，
+# 兩者無法從 datetime 還原，游標必須沿用資料庫中的原字串才能與排序一致
+_CREATED_AT_RAW = type_coerce(Invoice.created_at, String).label("created_at_raw")
+
+def _encode_cursor(created_at_raw, invoice_id: int) -> str:
+    raw = f"{created_at_raw}|{invoice_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, invoice_id = raw.rsplit("|", 1)
+        datetime.fromisoformat(created_at)
+        return created_at, int(invoice_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="無效的分頁游標")
+
+def _apply_filters(query, category=None, status=None, date_from=None, date_to=None,
+                   min_amount=None, max_amount=None, vendor=None):
+    """列表與匯出共用的篩選條件"""
+    if category:
+        query = query.where(Invoice.category == category)
+    if status:
+        query = query.where(Invoice.status == status)
+    if date_from:
+        query = query.where(Invoice.invoice_date >= date_from)
+    if date_to:
+        query = query.where(Invoice.invoice_date <= date_to)
+    if min_amount is not None:
+        query = query.where(Invoice.total_amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(Invoice.total_amount <= max_amount)
+    if vendor:
+        query = query.where(Invoice.vendor_name.contains(vendor))
+    return query
 
 @router.get("/list", response_model=List[InvoiceResponse])
 async def get_invoices(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
     category: str = None,
     status: str = None,
-    db: Session = Depends(get_db)
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    vendor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """取得發票列表"""
-    query = db.query(Invoice)
+    """取得發票列表
+
+    依建立時間由新到舊排序，以 (created_at, id) 游標分頁：
+    回應標頭 X-Next-Cursor 為下一頁的 cursor，沒有下一頁時不回傳。
+    fields 以逗號分隔指定回傳欄位（例如 id,vendor_name,total_amount）。
+    """
+    query = _apply_filters(
+        select(Invoice), category, status, date_from, date_to, min_amount, max_amount, vendor
+    )
     
-    if category:
-        query = query.filter(Invoice.category == category)
-    if status:
-        query = query.filter(Invoice.status == status)
+    # 只載入需要的欄位
+    selected = None
+    if fields:
+        selected = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = set(selected) - LIST_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知的欄位: {', '.join(sorted(unknown))}")
+        # 分頁游標需要 id 與 created_at
+        columns = set(selected) | {"id", "created_at"}
+        query = query.options(load_only(*[getattr(Invoice, name) for name in columns]))
+    else:
+        query = query.options(defer(Invoice.ocr_text))
     
-    invoices = query.offset(skip).limit(limit).all()
+    # 游標分頁：直接從索引定位，不必掃過前面的資料列
+    if cursor:
+        created_at, invoice_id = _decode_cursor(cursor)
+        # SQLite 以字串比較日期，游標值以儲存格式的字串綁定
+        query = query.where(tuple_(Invoice.created_at, Invoice.id) < tuple_(
+            bindparam("cursor_created_at", created_at, type_=String),
+            bindparam("cursor_id", invoice_id, type_=Integer)
+        ))
+    elif skip:
+        query = query.offset(skip)
+    
+    # 多取一筆判斷是否還有下一頁
+    query = query.add_columns(_CREATED_AT_RAW)
+    query = query.order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    invoices = [row[0] for row in rows[:limit]]
+    if len(rows) > limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[limit - 1].created_at_raw, invoices[-1].id)
+    
+    if selected is not None:
+        items = [{name: getattr(invoice, name) for name in selected} for invoice in invoices]
+        headers = {"X-Next-Cursor": response.headers["X-Next-Cursor"]} if "X-Next-Cursor" in response.headers else None
+        return JSONResponse(content=jsonable_encoder(items), headers=headers)
     return invoices
 
+@router.get("/export")
+async def export_invoices(
+    format: str = "csv",
+    category: str = None,
+    status: str = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    vendor: Optional[str] = None,
+    include_ocr_text: bool = False
+):
+    """串流匯出發票（csv、parquet 或 arrow），逐批讀取與輸出，記憶體用量固定"""
+    if format not in invoice_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的格式: {format}")
+    if format != "csv" and not invoice_export.arrow_available():
+        raise HTTPException(status_code=501, detail="伺服器未安裝 pyarrow，無法匯出 Parquet/Arrow")
+    
+    columns = invoice_export.EXPORT_COLUMNS + ((invoice_export.OCR_TEXT_COLUMN,) if include_ocr_text else ())
+    statement = _apply_filters(
+        select(*[getattr(Invoice, name) for name, _ in columns]),
+        category, status, date_from, date_to, min_amount, max_amount, vendor
+    ).order_by(Invoice.id)
+    
+    streamers = {
+        "csv": invoice_export.stream_csv,
+        "parquet": invoice_export.stream_parquet,
+        "arrow": invoice_export.stream_arrow
+    }
+    media_type, extension = invoice_export.EXPORT_FORMATS[format]
+    filename = f"invoices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return StreamingResponse(
+        streamers[format](statement, columns),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/thumbnails/{filename}")
+async def get_thumbnail(filename: str, request: Request):
+    """提供縮圖；網址含內容雜湊，可永久快取並以 ETag 回應 304"""
+    path = thumbnail_service.path_for(filename)
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="縮圖不存在")
+    
+    etag = f'"{filename.split(".")[0]}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
 @router.get("/{invoice_id}", response_model=InvoiceResponse)
-async def get_invoice(invoice_id: int, db: Session = Depends(get_db)):
+async def get_invoice(invoice_id: int, db: AsyncSession = Depends(get_async_db)):
     """取得特定發票詳情"""
-    invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
+    invoice = await db.get(Invoice, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="發票不存在")
     return invoice
@@ -154,59 +643,59 @@ async def get_invoice(invoice_id: int, db: Session = Depends(get_db)):
 async def update_invoice(
     invoice_id: int,
     invoice_update: InvoiceCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新發票資訊"""
-    invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
+    invoice = await db.get(Invoice, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="發票不存在")
     
     for field, value in invoice_update.dict(exclude_unset=True).items():
         setattr(invoice, field, value)
     
-    db.commit()
-    db.refresh(invoice)
+    await db.commit()
+    await db.refresh(invoice)
     return invoice
 
 @router.get("/stats/summary", response_model=InvoiceStats)
-async def get_invoice_stats(db: Session = Depends(get_db)):
-    """取得發票統計資訊"""
-    total_invoices = db.query(Invoice).count()
-    total_amount = db.query(func.sum(Invoice.total_amount)).scalar() or 0
-    
-    # 按類別統計
-    category_stats = db.query(
-        Invoice.category,
-        func.count(Invoice.id).label('count'),
-        func.sum(Invoice.total_amount).label('amount')
-    ).group_by(Invoice.category).all()
-    
-    return InvoiceStats(
-        total_invoices=total_invoices,
-        total_amount=total_amount,
-        category_stats=[
-            {
-                "category": stat.category,
-                "count": stat.count,
-                "amount": stat.amount or 0
-            }
-            for stat in category_stats
-        ]
-    )
+async def get_invoice_stats(db: AsyncSession = Depends(get_async_db)):
+    """取得發票統計資訊（由彙總表讀取，不掃描發票表）"""
+    return InvoiceStats(**await db.run_sync(invoice_stats.get_summary))
+
+@router.get("/stats/timeseries", response_model=List[InvoiceTimeBucket])
+async def get_invoice_timeseries(
+    bucket: str = "month",
+    start: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    end: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """依月/季/年的發票金額統計（start、end 為 YYYY-MM）"""
+    try:
+        return await db.run_sync(invoice_stats.get_timeseries, bucket=bucket, start=start, end=end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/stats/vendors", response_model=List[InvoiceVendorStats])
+async def get_vendor_stats(limit: int = Query(20, ge=1, le=200), db: AsyncSession = Depends(get_async_db)):
+    """金額最高的商家統計"""
+    return await db.run_sync(invoice_stats.get_top_vendors, limit=limit)
 
 @router.delete("/{invoice_id}")
-async def delete_invoice(invoice_id: int, db: Session = Depends(get_db)):
+async def delete_invoice(invoice_id: int, db: AsyncSession = Depends(get_async_db)):
     """刪除發票"""
-    invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
+    invoice = await db.get(Invoice, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="發票不存在")
     
     # 刪除圖片檔案
-    if invoice.image_path and os.path.exists(invoice.image_path.replace('/uploads/', './invoice_uploads/')):
-        os.remove(invoice.image_path.replace('/uploads/', './invoice_uploads/'))
+    if invoice.image_path and os.path.exists(local_image_path(invoice.image_path)):
+        os.remove(local_image_path(invoice.image_path))
+    
+    await db.delete(invoice)
+    await db.commit()
+    hash_index.remove(invoice_id)
     
-    db.delete(invoice)
-    db.commit()
+    await _remove_unreferenced_thumbnails(db, (invoice.thumbnail_url, invoice.preview_url))
     return {"message": "發票已刪除"}
 
 @router.get("/categories/list")
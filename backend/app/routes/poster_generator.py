@@ -4,6 +4,9 @@ import uuid
 import asyncio
 from ..services.prompt_service import enhance_prompt_for_poster
 from ..services.image_service import generate_image_from_prompt
+from ..services.structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 # 建立路由器
 router = APIRouter(prefix="/api/v1/poster-generator", tags=["poster-generator"])
@@ -48,7 +51,7 @@ async def generate_poster(background_tasks: BackgroundTasks, request: dict):
         enhanced_prompt, token_usage = await enhance_prompt_for_poster(
             text_content, style, poster_type, has_image=False
         )
-        print(f"Enhanced prompt: {enhanced_prompt}")
+        logger.debug("Enhanced prompt: %s", enhanced_prompt)
         
         # 儲存任務
         poster_tasks[task_id] = {
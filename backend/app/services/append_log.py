@@ -0,0 +1,291 @@
+import json
+import os
+import time
+import atexit
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+from .file_lock import FileLock
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+def write_json_atomic(path: Path, data: Any, indent: Optional[int] = None):
+    """以臨時檔 + os.replace 原子寫入 JSON，寫入中途崩潰不會留下半個檔案"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class AppendLog:
+    """多進程共用的「快照 + append-only 日誌」存儲
+
+    - append 只把紀錄放進記憶體緩衝，由背景執行緒定期批次追加到日誌
+    - 日誌過大（或距上次壓縮過久）時，在跨進程檔案鎖下合併回快照並清空日誌
+    - 磁碟狀態常駐記憶體：日誌只從上次讀到的位置往後解析，快照只在壓縮後重新載入
+    - read 在記憶體狀態鎖內執行，不等待背景寫入或跨進程檔案鎖；
+      紀錄在磁碟狀態納入它之前一直算在「尚未寫出」中，不會漏算或重複計算
+
+    狀態的格式由呼叫端決定：
+    - empty() 建立空狀態
+    - load_snapshot(state, data) 將快照內容併入狀態
+    - apply_record(state, record) 將一筆日誌紀錄併入狀態
+    - coalesce(records) 寫入前合併多筆紀錄（選用，減少日誌行數）
+    - prepare_snapshot(state) 壓縮前整理狀態，例如刪除過期資料（選用）
+    """
+
+    def __init__(
+        self,
+        snapshot_file: Path,
+        log_file: Path,
+        lock_file: Path,
+        empty: Callable[[], Any],
+        load_snapshot: Callable[[Any, Any], None],
+        apply_record: Callable[[Any, Any], None],
+        coalesce: Optional[Callable[[List[Any]], List[Any]]] = None,
+        prepare_snapshot: Optional[Callable[[Any], None]] = None,
+        flush_interval_seconds: float = 2.0,
+        compact_bytes: int = 256 * 1024,
+        compact_interval_seconds: Optional[float] = None,
+        snapshot_indent: Optional[int] = None,
+        name: str = "append-log"
+    ):
+        self.snapshot_file = Path(snapshot_file)
+        self.log_file = Path(log_file)
+        self.lock_file = Path(lock_file)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.compact_bytes = compact_bytes
+        self.compact_interval_seconds = compact_interval_seconds
+        self.snapshot_indent = snapshot_indent
+        self.name = name
+        self._empty = empty
+        self._load_snapshot = load_snapshot
+        self._apply_record = apply_record
+        self._coalesce = coalesce
+        self._prepare_snapshot = prepare_snapshot
+        # 記憶體狀態鎖：保護緩衝、寫入中的紀錄與磁碟狀態，只在記憶體操作期間持有
+        self._lock = threading.Lock()
+        self._pending: List[Any] = []
+        self._writing: List[Any] = []
+        self._disk_state = empty()
+        self._snapshot_signature: Optional[Tuple] = None
+        self._log_offset = 0
+        # 序列化寫入；更新磁碟狀態（解析檔案）時另持 _refresh_lock，讀取端不會等待
+        self._flush_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_compact = time.time()
+        atexit.register(self.flush)
+
+    def append(self, record: Any):
+        """追加一筆紀錄到記憶體緩衝"""
+        with self._lock:
+            self._pending.append(record)
+        self._ensure_flusher()
+
+    def flush(self):
+        """把緩衝中的紀錄追加到日誌，必要時壓縮"""
+        with self._flush_lock:
+            with self._lock:
+                # 上次寫入失敗的紀錄留在 _writing，與新紀錄一起重試
+                self._writing.extend(self._pending)
+                self._pending = []
+                records = list(self._writing)
+            if not records:
+                return
+
+            lines = self._coalesce(records) if self._coalesce else records
+            lock = FileLock(self.lock_file)
+            if not lock.acquire():
+                # 紀錄仍在 _writing 中，讀取時照常計入，下次再寫
+                logger.warning(f"{self.name} flush skipped: lock {self.lock_file} busy")
+                return
+            try:
+                # 寫入到更新磁碟狀態之間持有 _refresh_lock，讀取端不會先讀到仍在 _writing 中的紀錄
+                with self._refresh_lock:
+                    try:
+                        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+                        with open(self.log_file, 'a', encoding='utf-8') as f:
+                            f.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+                    except Exception as e:
+                        logger.warning(f"Failed to flush {self.name}: {e}")
+                        return
+
+                    # 持有檔案鎖時日誌不會被壓縮，解析新增的行後再把紀錄移出 _writing
+                    try:
+                        self._refresh_locked(written=len(records))
+                    except Exception as e:
+                        logger.warning(f"Failed to refresh {self.name}: {e}")
+
+                    compact_due = (
+                        self.compact_interval_seconds is not None
+                        and time.time() - self._last_compact > self.compact_interval_seconds
+                    )
+                    if self._log_size() > self.compact_bytes or compact_due:
+                        try:
+                            self._compact_locked()
+                        except Exception as e:
+                            logger.warning(f"Failed to compact {self.name}: {e}")
+            finally:
+                lock.release()
+
+    def compact(self):
+        """立即把日誌合併回快照"""
+        self.flush()
+        with FileLock(self.lock_file):
+            with self._refresh_lock:
+                self._refresh_locked()
+                self._compact_locked()
+
+    def read(self, view: Callable[[Any, List[Any]], T]) -> T:
+        """在記憶體狀態鎖內以 (磁碟狀態, 本進程尚未寫出的紀錄) 呼叫 view 並回傳結果
+
+        view 不可修改狀態，也不可回傳狀態內部的物件（鎖外可能被更新）。
+        其他進程的新紀錄只在不需等待時併入：日誌尾端隨時可讀，
+        快照被壓縮替換時若檔案鎖忙碌，先沿用目前的狀態。
+        """
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.warning(f"Failed to refresh {self.name}: {e}")
+            finally:
+                self._refresh_lock.release()
+        with self._lock:
+            return view(self._disk_state, self._writing + self._pending)
+
+    def _refresh(self):
+        """（需持有 _refresh_lock，未持有檔案鎖）把其他進程的變更併入磁碟狀態"""
+        if self._snapshot_signature == self._signature(self.snapshot_file) and self._log_size() >= self._log_offset:
+            records, offset = self._read_log(self._log_offset)
+            # 讀取途中快照被替換，代表日誌已被壓縮清空，讀到的內容不可靠
+            if records and self._snapshot_signature == self._signature(self.snapshot_file):
+                with self._lock:
+                    for record in records:
+                        self._apply_record(self._disk_state, record)
+                    self._log_offset = offset
+            return
+        # 快照被替換或日誌被清空：需在檔案鎖下重新載入，避免讀到壓縮進行到一半的檔案
+        lock = FileLock(self.lock_file, timeout_seconds=0)
+        if lock.acquire():
+            try:
+                self._refresh_locked()
+            finally:
+                lock.release()
+
+    def _refresh_locked(self, written: int = 0):
+        """（需持有 _refresh_lock 與檔案鎖）更新磁碟狀態，並把已寫入的 written 筆紀錄移出 _writing"""
+        try:
+            signature = self._signature(self.snapshot_file)
+            if signature == self._snapshot_signature and self._log_size() >= self._log_offset:
+                records, offset = self._read_log(self._log_offset)
+                with self._lock:
+                    for record in records:
+                        self._apply_record(self._disk_state, record)
+                    self._log_offset = offset
+                    del self._writing[:written]
+                return
+            state = self._read_snapshot()
+            records, offset = self._read_log(0)
+            for record in records:
+                self._apply_record(state, record)
+        except Exception:
+            with self._lock:
+                # 紀錄已在磁碟上，下次完整重新載入時計入
+                del self._writing[:written]
+                self._snapshot_signature = None
+            raise
+        with self._lock:
+            self._disk_state = state
+            self._snapshot_signature = signature
+            self._log_offset = offset
+            del self._writing[:written]
+
+    def _read_snapshot(self) -> Any:
+        state = self._empty()
+        try:
+            if self.snapshot_file.exists():
+                with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                    self._load_snapshot(state, json.load(f))
+        except Exception as e:
+            logger.warning(f"Failed to load {self.snapshot_file}: {e}")
+        return state
+
+    def _read_log(self, offset: int) -> Tuple[List[Any], int]:
+        """從 offset 開始解析日誌中完整的行，回傳 (紀錄, 下次開始的位置)"""
+        try:
+            with open(self.log_file, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # 最後一行可能是其他進程寫到一半的內容，保留到下次讀取
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                logger.warning(f"Skipping corrupted line in {self.log_file}")
+        return records, offset + end
+
+    def _compact_locked(self):
+        """（需持有 _refresh_lock 與檔案鎖，磁碟狀態已是最新）把狀態寫成新快照並清空日誌"""
+        with self._lock:
+            if self._prepare_snapshot:
+                self._prepare_snapshot(self._disk_state)
+            # 持有 _refresh_lock 期間狀態不會再被修改，序列化可在記憶體狀態鎖外進行
+            state = self._disk_state
+        write_json_atomic(self.snapshot_file, state, indent=self.snapshot_indent)
+        with open(self.log_file, 'w', encoding='utf-8'):
+            pass
+        with self._lock:
+            self._snapshot_signature = self._signature(self.snapshot_file)
+            self._log_offset = 0
+        self._last_compact = time.time()
+
+    def _log_size(self) -> int:
+        try:
+            return self.log_file.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name=f"{self.name}-flusher", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval_seconds):
+            self.flush()
+
+    @staticmethod
+    def _signature(path: Path) -> Optional[Tuple]:
+        # os.replace 產生新的 inode，壓縮後即使 mtime 與大小相同也能分辨
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
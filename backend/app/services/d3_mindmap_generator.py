@@ -3,6 +3,9 @@ from typing import Dict, Any, List
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 # 載入環境變數
 load_dotenv()
@@ -22,7 +25,7 @@ async def generate_d3_mindmap_data(content_blocks: list) -> Dict[str, Any]:
         return mindmap_data
         
     except Exception as e:
-        print(f"D3 心智圖生成錯誤: {e}")
+        logger.exception("D3 心智圖生成錯誤: %s", e)
         return _get_fallback_d3_data()
 
 async def _generate_d3_structure(content_text: str) -> Dict[str, Any]:
@@ -0,0 +1,49 @@
+from typing import List
+
+from PIL import Image, ImageOps
+
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# QR Code 解碼器為選用依賴：優先 pyzbar（需系統 libzbar），其次 OpenCV
+try:
+    from pyzbar import pyzbar
+except ImportError:  # pyzbar 未安裝或找不到 libzbar
+    pyzbar = None
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+
+
+def qr_decoder_available() -> bool:
+    return pyzbar is not None or cv2 is not None
+
+
+def _decode_text(data: bytes) -> str:
+    # 編碼參數 0 的電子發票品名為 Big5
+    for encoding in ("utf-8", "big5"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def decode_qr_codes(image_path: str) -> List[str]:
+    """解碼圖片上所有 QR Code，回傳內容字串；沒有可用的解碼器或找不到 QR Code 時回傳空串列"""
+    with Image.open(image_path) as image:
+        gray = ImageOps.exif_transpose(image).convert("L")
+
+    if pyzbar is not None:
+        symbols = pyzbar.decode(gray, symbols=[pyzbar.ZBarSymbol.QRCODE])
+        return [_decode_text(symbol.data) for symbol in symbols]
+
+    if cv2 is not None:
+        ok, texts, _points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(np.asarray(gray))
+        return [text for text in texts if text] if ok else []
+
+    return []
@@ -7,6 +7,9 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import graphviz
 from ..models.schemas import ReactFlowMindMap
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 # 載入環境變數並設定 Gemini API
 load_dotenv()
@@ -28,7 +31,7 @@ async def generate_enhanced_mindmap(content_blocks: list) -> str:
         return png_path
         
     except Exception as e:
-        print(f"心智圖生成錯誤: {e}")
+        logger.exception("心智圖生成錯誤: %s", e)
         # 使用備用數據生成心智圖
         fallback_data = _get_fallback_mindmap_data()
         return _create_graphviz_mindmap(fallback_data)
@@ -317,11 +320,11 @@ async def generate_reactflow_mindmap(content_blocks: list) -> ReactFlowMindMap:
             return ReactFlowMindMap(**result_dict)
             
         except (json.JSONDecodeError, ValueError) as e:
-            print(f"ReactFlow心智圖生成失敗: {e}")
+            logger.warning("ReactFlow心智圖生成失敗: %s", e)
             return _get_fallback_reactflow_mindmap()
             
     except Exception as e:
-        print(f"ReactFlow心智圖生成錯誤: {e}")
+        logger.exception("ReactFlow心智圖生成錯誤: %s", e)
         return _get_fallback_reactflow_mindmap()
 
 def _get_fallback_reactflow_mindmap() -> ReactFlowMindMap:
@@ -0,0 +1,67 @@
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class FileLock:
+    """跨進程的簡易檔案鎖
+
+    以 O_CREAT | O_EXCL 建立鎖檔，在 Windows 與 POSIX 上行為一致，
+    不依賴 fcntl/msvcrt。持有者崩潰留下的鎖檔在超過 stale_seconds 後視為失效。
+    """
+
+    def __init__(self, path: Path, timeout_seconds: float = 5.0, stale_seconds: float = 30.0, poll_seconds: float = 0.02):
+        self.path = Path(path)
+        self.timeout_seconds = timeout_seconds
+        self.stale_seconds = stale_seconds
+        self.poll_seconds = poll_seconds
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        """取得鎖，逾時回傳 False"""
+        deadline = time.monotonic() + self.timeout_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                self._fd = os.open(str(self.path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(self._fd, str(os.getpid()).encode())
+                return True
+            except FileExistsError:
+                self._remove_if_stale()
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(self.poll_seconds)
+
+    def release(self):
+        """釋放鎖"""
+        if self._fd is None:
+            return
+        try:
+            os.close(self._fd)
+        finally:
+            self._fd = None
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _remove_if_stale(self):
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.stale_seconds:
+                os.remove(self.path)
+                logger.info(f"Removed stale lock {self.path}")
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "FileLock":
+        if not self.acquire():
+            raise TimeoutError(f"Timed out waiting for lock {self.path}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -1,22 +1,26 @@
 import os
 import json
-import time
 from typing import Dict, Any
 
-import google.generativeai as genai
-from dotenv import load_dotenv
-
 from ..models.schemas import NoteResult, ReactFlowMindMap, ContentBlock, ActionItem
+from .llm_gateway import get_llm_gateway
+from .usage_ledger import usage_context
+from .metrics import BACKGROUND_QUEUE_DEPTH
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
-# 載入環境變數並設定 Gemini API
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+llm_gateway = get_llm_gateway()
 
 # 全域任務儲存
 task_store: Dict[str, Dict[str, Any]] = {}
 
+# 排隊與處理中的會議筆記任務數
+BACKGROUND_QUEUE_DEPTH.set_function(
+    lambda: sum(1 for task in list(task_store.values()) if task.get("status") in ("queued", "processing")),
+    queue="meeting_notes"
+)
+
 def _load_task_store_from_notes():
     """從筆記管理器載入任務到 task_store"""
     try:
@@ -36,9 +40,9 @@ def _load_task_store_from_notes():
                         "result": full_note
                     }
                     loaded_count += 1
-        print(f"已從筆記管理器載入 {loaded_count} 個任務")
+        logger.info("已從筆記管理器載入任務", extra={"count": loaded_count})
     except Exception as e:
-        print(f"載入任務存儲失敗: {e}")
+        logger.error("載入任務存儲失敗: %s", e)
 
 def reload_task_store():
     """重新載入任務存儲（用於 API 呼叫）"""
@@ -49,21 +53,12 @@ _load_task_store_from_notes()
 
 async def process_audio_with_gemini(audio_file_path: str) -> NoteResult:
     """使用 Gemini 2.5 Flash 處理音頻檔案並返回結構化結果"""
-    print(f"Uploading file to Gemini: {audio_file_path}")
+    logger.info("Uploading file to Gemini", extra={"file_path": audio_file_path})
     
-    # 上傳檔案到 Gemini 檔案服務
-    audio_file = genai.upload_file(path=audio_file_path)
-
-    # 等待檔案處理完成
-    while audio_file.state.name == "PROCESSING":
-        print('.', end='')
-        time.sleep(2)
-        audio_file = genai.get_file(audio_file.name)
-
-    if audio_file.state.name == "FAILED":
-        raise ValueError(audio_file.state.name)
+    # 上傳檔案到 Gemini 檔案服務並等待處理完成
+    audio_file = await llm_gateway.upload_file(audio_file_path, wait_until_active=True)
         
-    print(f"\nFile uploaded successfully. Starting analysis...")
+    logger.debug("File uploaded, starting analysis", extra={"file_path": audio_file_path})
 
     # 定義結構化 Prompt
     prompt = """
@@ -109,9 +104,13 @@ async def process_audio_with_gemini(audio_file_path: str) -> NoteResult:
 請直接輸出 JSON，不要包含 Markdown 語法。
     """
 
-    # 建立模型並發送請求
-    model = genai.GenerativeModel(model_name="models/gemini-2.5-flash")
-    response = model.generate_content([audio_file, prompt])
+    # 發送請求
+    response = await llm_gateway.generate_content(
+        "models/gemini-2.5-flash",
+        [audio_file, prompt],
+        service_type="meeting_notes",
+        input_modality="audio"
+    )
 
     # 清理並解析 JSON 回應
     cleaned_json_string = response.text.strip()
@@ -124,7 +123,7 @@ async def process_audio_with_gemini(audio_file_path: str) -> NoteResult:
     
     cleaned_json_string = cleaned_json_string.strip()
     
-    print(f"Cleaned JSON: {cleaned_json_string[:500]}...")  # 顯示前500字符用於調試
+    logger.debug("Cleaned JSON response", extra={"length": len(cleaned_json_string)})
     
     try:
         parsed_data = json.loads(cleaned_json_string)
@@ -136,8 +135,8 @@ async def process_audio_with_gemini(audio_file_path: str) -> NoteResult:
         action_items = [ActionItem(**item) for item in action_items_data]
         
     except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        print(f"Problematic JSON around position {e.pos}: {cleaned_json_string[max(0, e.pos-50):e.pos+50]}")
+        logger.error("JSON decode error: %s", e)
+        logger.debug("Problematic JSON around position %s: %s", e.pos, cleaned_json_string[max(0, e.pos-50):e.pos+50])
         # 嘗試修復常見的 JSON 錯誤
         fixed_json = cleaned_json_string.replace('\n', ' ').replace('\t', ' ')
         # 移除多餘的逗號
@@ -160,7 +159,8 @@ async def process_audio_task(task_id: str, file_path: str):
     """背景任務：處理音頻檔案"""
     try:
         task_store[task_id]["status"] = "processing"
-        result = await process_audio_with_gemini(file_path)
+        with usage_context(task_id=task_id):
+            result = await process_audio_with_gemini(file_path)
         task_store[task_id]["status"] = "completed"
         task_store[task_id]["result"] = result
         
@@ -178,9 +178,9 @@ async def process_audio_task(task_id: str, file_path: str):
                 result_dict = result
             
             notes_manager.save_note(task_id, filename, result_dict)
-            print(f"筆記已自動保存: {task_id}")
+            logger.info("筆記已自動保存", extra={"task_id": task_id})
         except Exception as save_error:
-            print(f"保存筆記失敗: {save_error}")
+            logger.error("保存筆記失敗: %s", save_error, extra={"task_id": task_id})
             
     except Exception as e:
         task_store[task_id]["status"] = "failed"
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from PIL import Image, ImageOps
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from ..models.invoice import Invoice
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# 圖片不存在或無法解碼的發票以空字串標記，啟動補算時不再重試
+UNHASHABLE = ""
+
+
+def compute_content_hash(image_path: str) -> str:
+    """計算檔案內容的 SHA-256；只有位元組完全相同的圖片才會相同"""
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_dhash(image_path: str, hash_size: int = 8) -> str:
+    """計算圖片的差異雜湊（dHash），回傳 16 位十六進位字串
+
+    先依 EXIF 轉正再縮成 (hash_size+1) x hash_size 的灰階圖，
+    比較相鄰像素亮度；重新壓縮、縮放或輕微調色後雜湊幾乎不變。
+    """
+    with Image.open(image_path) as image:
+        # JPEG 可直接以低解析度解碼，大幅減少手機原圖的解碼時間
+        image.draft("L", (hash_size * 16, hash_size * 16))
+        image = ImageOps.exif_transpose(image).convert("L")
+        image = image.resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = list(image.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+class DuplicateMatch(NamedTuple):
+    """相似發票的比對結果；exact 表示檔案內容完全相同"""
+    invoice_id: int
+    distance: int
+    exact: bool
+
+
+def same_invoice_fields(data: Dict[str, Any], existing: Any) -> bool:
+    """OCR 結果與既有發票是否為同一張：發票號碼相同，或日期與總金額都相同
+
+    dHash 只有 64 位元，同一商家版面相同的收據雜湊可能完全一樣，
+    圖片相似時須以此確認，才能標記為疑似重複。
+    """
+    number = data.get("invoice_number")
+    if number and existing.invoice_number and number == existing.invoice_number.split("_副本_")[0]:
+        return True
+    date = data.get("invoice_date")
+    existing_date = existing.invoice_date.strftime("%Y-%m-%d") if existing.invoice_date else None
+    total = data.get("total_amount")
+    return bool(date and total and date == existing_date and existing.total_amount is not None
+                and abs(total - existing.total_amount) < 0.01)
+
+
+class ImageHashIndex:
+    """已儲存發票圖片的雜湊索引，用於 OCR 前偵測重複上傳
+
+    索引保存在記憶體中（invoice_id -> dHash 整數、內容雜湊 -> invoice_id）：
+    - 內容雜湊（SHA-256）相同才是確定的重複，可以跳過 OCR
+    - dHash 漢明距離在門檻內只代表版面相似，呼叫端須再比對 OCR 欄位
+    每次查詢前只載入 id 大於已載入最大值的新發票，其他 worker 新增的發票也能比對到。
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_distance: int = 4):
+        self.session_factory = session_factory
+        self.max_distance = max_distance
+        self._hashes: Dict[int, int] = {}
+        self._contents: Dict[str, int] = {}
+        self._max_id = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self, db: Session):
+        """載入新發票的雜湊（需持有鎖）"""
+        rows = db.query(Invoice.id, Invoice.image_hash, Invoice.content_hash).filter(
+            Invoice.id > self._max_id,
+            or_(Invoice.image_hash.isnot(None), Invoice.content_hash.isnot(None))
+        ).all()
+        for invoice_id, image_hash, content_hash in rows:
+            self._add_locked(invoice_id, image_hash, content_hash)
+            self._max_id = max(self._max_id, invoice_id)
+
+    def _add_locked(self, invoice_id: int, image_hash: Optional[str], content_hash: Optional[str]):
+        if image_hash:
+            self._hashes[invoice_id] = int(image_hash, 16)
+        if content_hash:
+            # 同內容的多張發票以最早的為準
+            self._contents.setdefault(content_hash, invoice_id)
+
+    def find_duplicate(self, image_hash: Optional[str], content_hash: Optional[str] = None) -> Optional[DuplicateMatch]:
+        """尋找相同或相似的已存發票；內容完全相同者優先，其次為 dHash 距離最近者"""
+        target = int(image_hash, 16) if image_hash else None
+        db = self.session_factory()
+        try:
+            with self._lock:
+                self._refresh(db)
+                candidates = []
+                exact_id = self._contents.get(content_hash) if content_hash else None
+                if exact_id is not None:
+                    candidates.append(DuplicateMatch(exact_id, 0, True))
+                if target is not None:
+                    candidates.extend(sorted(
+                        DuplicateMatch(invoice_id, distance, False)
+                        for invoice_id, value in self._hashes.items()
+                        if invoice_id != exact_id and (distance := (target ^ value).bit_count()) <= self.max_distance
+                    ))
+            for match in candidates:
+                # 發票可能已被其他 worker 刪除
+                if db.get(Invoice, match.invoice_id) is not None:
+                    return match
+                self.remove(match.invoice_id)
+            return None
+        finally:
+            db.close()
+
+    def add(self, invoice_id: int, image_hash: Optional[str], content_hash: Optional[str] = None):
+        with self._lock:
+            self._add_locked(invoice_id, image_hash, content_hash)
+
+    def remove(self, invoice_id: int):
+        with self._lock:
+            self._hashes.pop(invoice_id, None)
+            for content_hash in [key for key, value in self._contents.items() if value == invoice_id]:
+                del self._contents[content_hash]
+
+    def backfill(
+        self,
+        image_path_resolver: Callable[[str], str],
+        batch_size: int = 500,
+        stop_event: Optional[threading.Event] = None
+    ) -> int:
+        """為尚未有雜湊的舊發票補算 dHash 與內容雜湊，回傳補算筆數
+
+        依 id 分頁只讀取 id 與圖片路徑，每頁各自提交，記憶體與交易大小不隨發票數量增長。
+        無法計算雜湊的發票標記為 UNHASHABLE，下次啟動不再重試；圖片檔案不存在時不標記，下次啟動再試。
+        stop_event 設定後在下一筆前提交已算好的部分並結束，其餘留待下次啟動。
+        """
+        db = self.session_factory()
+        updated = 0
+        last_id = 0
+        try:
+            while stop_event is None or not stop_event.is_set():
+                rows = db.query(Invoice.id, Invoice.image_path).filter(
+                    Invoice.id > last_id,
+                    or_(Invoice.image_hash.is_(None), Invoice.content_hash.is_(None)),
+                    Invoice.image_path.isnot(None)
+                ).order_by(Invoice.id).limit(batch_size).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+
+                values = []
+                for invoice_id, image_path in rows:
+                    if stop_event is not None and stop_event.is_set():
+                        break
+                    path = image_path_resolver(image_path)
+                    if not os.path.isfile(path):
+                        continue
+                    try:
+                        values.append({
+                            "id": invoice_id,
+                            "image_hash": compute_dhash(path),
+                            "content_hash": compute_content_hash(path)
+                        })
+                        updated += 1
+                    except Exception as e:
+                        logger.warning(f"Failed to hash invoice image: {e}", extra={"invoice_id": invoice_id})
+                        values.append({"id": invoice_id, "image_hash": UNHASHABLE, "content_hash": UNHASHABLE})
+                # 依主鍵批次更新，不載入完整的發票物件
+                if values:
+                    db.execute(update(Invoice), values)
+                    db.commit()
+        finally:
+            db.close()
+        if updated:
+            # 補算的發票 id 可能小於已載入的最大值，下次查詢時重新載入全部
+            with self._lock:
+                self._max_id = 0
+        return updated
@@ -1,23 +1,19 @@
-import os
 import uuid
 from pathlib import Path
-from google import genai
 from google.genai import types
 from PIL import Image, ImageDraw, ImageFont
-from dotenv import load_dotenv
 from io import BytesIO
 import base64
 from ..models.usage_tracking import TokenUsage, UsageReport
 from .usage_tracker import UsageTracker
+from .llm_gateway import get_llm_gateway
+from .structured_logging import get_logger
 
-# 載入環境變數
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+logger = get_logger(__name__)
 
-if GEMINI_API_KEY:
-    client = genai.Client(api_key=GEMINI_API_KEY)
-else:
-    client = None
+# 共用的 LLM 閘道與 Imagen 用戶端
+llm_gateway = get_llm_gateway()
+client = llm_gateway.get_image_client()
 
 # 建立圖像儲存目錄
 IMAGES_DIR = Path("./generated_images")
@@ -44,14 +40,14 @@ async def generate_poster_from_prompt_and_image(prompt: str, text_content: str =
         # 直接使用生成的 prompt
         final_prompt = prompt
             
-        print(f"Original poster prompt: {prompt}")
+        logger.debug("Original poster prompt: %s", prompt)
 
-        print(f"Final combined prompt sent to Imagen: {final_prompt}")
+        logger.debug("Final combined prompt sent to Imagen: %s", final_prompt)
         
         # 使用官方 API 調用方式
-        response = client.models.generate_images(
-            model='imagen-4.0-generate-001',
-            prompt=final_prompt,
+        response = await llm_gateway.generate_images(
+            'imagen-4.0-generate-001',
+            final_prompt,
             config=types.GenerateImagesConfig(
                 number_of_images=1,
             )
@@ -65,7 +61,7 @@ async def generate_poster_from_prompt_and_image(prompt: str, text_content: str =
             # 保存圖片
             generated_image.image.save(image_path)
             
-            print(f"Saved poster design: {image_path}")
+            logger.info("Saved poster design", extra={"image_path": str(image_path)})
             
             # 創建使用報告
             task_id = str(uuid.uuid4())
@@ -88,7 +84,7 @@ async def generate_poster_from_prompt_and_image(prompt: str, text_content: str =
 
 
     except Exception as e:
-        print(f"Poster generation error: {e}")
+        logger.exception("Poster generation error: %s", e)
         placeholder_path = await create_placeholder_image(f"Error: {e}")
         # 創建錯誤情況下的使用報告
         error_usage = UsageTracker.create_usage_report(
@@ -164,19 +160,16 @@ async def add_text_to_poster(image_path: Path, text_content: str) -> str:
         return str(final_path)
         
     except Exception as e:
-        print(f"Text overlay error: {e}")
+        logger.exception("Text overlay error: %s", e)
         return str(image_path)  # 返回原始圖片
 
 async def analyze_image_with_gemini(image: Image.Image) -> tuple[str, TokenUsage]:
     """使用 Gemini 分析圖片內容"""
     try:
-        import google.generativeai as genai
-        
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content([
+        response = await llm_gateway.generate_content('gemini-2.5-flash', [
             "Analyze this image's visual design elements only: color palette, composition style, layout structure, visual hierarchy, and design aesthetics. Ignore any text or specific content. Focus on how this design approach could inspire a poster background layout.",
             image
-        ])
+        ], service_type="poster_generator")
         
         # 提取 token 使用量
         token_usage = UsageTracker.extract_token_usage_from_response(response, "text")
@@ -184,16 +177,12 @@ async def analyze_image_with_gemini(image: Image.Image) -> tuple[str, TokenUsage
         return response.text.strip(), token_usage
         
     except Exception as e:
-        print(f"Image analysis error: {e}")
+        logger.exception("Image analysis error: %s", e)
         return "uploaded image elements", TokenUsage()
 
 async def combine_prompt_with_gemini(poster_prompt: str, image_description: str, text_content: str) -> tuple[str, TokenUsage]:
     """用 Gemini 結合海報需求和圖片分析生成最終 prompt"""
     try:
-        import google.generativeai as genai
-        
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
         combination_prompt = f"""
 You are a Senior Creative Director. Enhance this poster background prompt by incorporating the design style from the reference image.
 
@@ -208,7 +197,7 @@ CRITICAL: Keep all "no text, no letters, no words" restrictions. Only adapt visu
 Output the enhanced prompt:
 """
         
-        response = model.generate_content(combination_prompt)
+        response = await llm_gateway.generate_content('gemini-2.5-flash', combination_prompt, service_type="poster_generator")
         
         # 提取 token 使用量
         token_usage = UsageTracker.extract_token_usage_from_response(response, "text")
@@ -216,7 +205,7 @@ Output the enhanced prompt:
         return response.text.strip(), token_usage
         
     except Exception as e:
-        print(f"Prompt combination error: {e}")
+        logger.warning("Prompt combination error: %s", e)
         return f"{poster_prompt}, incorporating elements from: {image_description}", TokenUsage()
 
 async def generate_image_from_prompt(prompt: str) -> str:
@@ -226,12 +215,12 @@ async def generate_image_from_prompt(prompt: str) -> str:
         return await create_placeholder_image("API Key Not Found")
     
     try:
-        print(f"Generating icon with prompt: {prompt}")
+        logger.debug("Generating icon with prompt: %s", prompt)
         
         # 使用 Imagen API 生成圖片
-        response = client.models.generate_images(
-            model='imagen-4.0-generate-001',
-            prompt=prompt,
+        response = await llm_gateway.generate_images(
+            'imagen-4.0-generate-001',
+            prompt,
             config=types.GenerateImagesConfig(
                 number_of_images=1,
             )
@@ -245,7 +234,7 @@ async def generate_image_from_prompt(prompt: str) -> str:
             # 保存圖片
             generated_image.image.save(image_path)
             
-            print(f"Saved icon: {image_path}")
+            logger.info("Saved icon", extra={"image_path": str(image_path)})
             
             # 記錄 token 使用量
             from .token_service import get_token_service
@@ -257,5 +246,5 @@ async def generate_image_from_prompt(prompt: str) -> str:
             raise Exception("No images generated")
             
     except Exception as e:
-        print(f"Icon generation error: {e}")
+        logger.exception("Icon generation error: %s", e)
         return await create_placeholder_image(f"Icon Generation Error: {e}")
\ No newline at end of file
@@ -0,0 +1,152 @@
+import os
+from typing import AsyncIterator
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from ..models.invoice import Base, Invoice
+from .invoice_stats import rebuild_aggregates, register_aggregate_listeners
+
+DATABASE_URL = os.getenv("INVOICE_DATABASE_URL", "sqlite:///./database/invoices.db")
+
+# 每個連線建立時套用的 SQLite 設定
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",        # 讀寫互不阻塞，讀取可與單一寫入並行
+    "synchronous": "NORMAL",      # WAL 下只在 checkpoint 時 fsync，斷電最多遺失最後幾筆交易
+    "busy_timeout": 5000,         # 寫鎖被占用時等待而不是立即 SQLITE_BUSY
+    "cache_size": -64000,         # 每個連線 64 MB 頁面快取
+    "temp_store": "MEMORY",       # GROUP BY / ORDER BY 的暫存放記憶體
+    "mmap_size": 268435456,       # 以 256 MB mmap 讀取，減少 read() 系統呼叫
+    "foreign_keys": "ON"
+}
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def _is_memory_url(url: str) -> bool:
+    return url.startswith("sqlite") and (url.split("?")[0].endswith((":memory:", "://")) or "mode=memory" in url)
+
+
+def create_invoice_engine(url: str = DATABASE_URL, pool_size: int = 8, max_overflow: int = 8) -> Engine:
+    """建立發票資料庫引擎
+
+    以 QueuePool 重用連線（連線建立時已套用 pragma 與 mmap），
+    連線數上限約等於同時執行的同步資料庫操作數（FastAPI 執行緒池 + OCR worker）。
+    """
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=30
+    )
+    if url.startswith("sqlite"):
+        event.listen(engine, "connect", _apply_pragmas)
+    return engine
+
+
+def create_async_invoice_engine(url: str = DATABASE_URL, pool_size: int = 8, max_overflow: int = 8) -> AsyncEngine:
+    """建立非同步引擎（aiosqlite）：查詢在驅動的背景執行緒執行，不阻塞事件迴圈"""
+    async_url = url.replace("sqlite://", "sqlite+aiosqlite://", 1) if url.startswith("sqlite://") else url
+    # 記憶體資料庫使用 StaticPool（單一連線），不接受連線池大小參數
+    pool_args = {} if _is_memory_url(url) else {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": 30
+    }
+    engine = create_async_engine(async_url, **pool_args)
+    if url.startswith("sqlite"):
+        event.listen(engine.sync_engine, "connect", _apply_pragmas)
+    return engine
+
+
+class InvoiceSession(Session):
+    """發票資料庫專用的 Session 類別，彙總表的 ORM 事件只掛在此類別上"""
+
+
+# 建表後新增的欄位，既有資料庫啟動時以 ALTER TABLE 補上
+ADDED_COLUMNS = {
+    "image_hash": "VARCHAR(16)",
+    "content_hash": "VARCHAR(64)",
+    "thumbnail_url": "VARCHAR(200)",
+    "preview_url": "VARCHAR(200)"
+}
+
+
+def init_database(engine: Engine):
+    """建立資料表並補上新欄位與索引（create_all 不會修改已存在的資料表）
+
+    由應用啟動事件呼叫；匯入本模組不會連線或修改資料庫檔案。
+    """
+    Base.metadata.create_all(bind=engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("invoices")}
+    with engine.begin() as conn:
+        for name, column_type in ADDED_COLUMNS.items():
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE invoices ADD COLUMN {name} {column_type}"))
+
+    for index in Invoice.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    # 首次啟用彙總表時從既有發票建立
+    with engine.begin() as conn:
+        has_aggregates = conn.execute(text("SELECT 1 FROM invoice_aggregates LIMIT 1")).first()
+        has_invoices = conn.execute(text("SELECT 1 FROM invoices LIMIT 1")).first()
+        if has_invoices and not has_aggregates:
+            rebuild_aggregates(conn)
+
+    if engine.dialect.name != "sqlite":
+        return
+
+    # 更新查詢規劃器的統計資訊，讓複合索引被正確選用（首次執行完整 ANALYZE）
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).first():
+            conn.execute(text("PRAGMA optimize"))
+        else:
+            conn.execute(text("ANALYZE"))
+
+
+engine = create_invoice_engine(
+    pool_size=int(os.getenv("INVOICE_DB_POOL_SIZE", "8")),
+    max_overflow=int(os.getenv("INVOICE_DB_MAX_OVERFLOW", "8"))
+)
+# 同步 Session：啟動遷移與在執行緒中執行的背景工作（圖片雜湊索引）使用
+SessionLocal = sessionmaker(class_=InvoiceSession, autocommit=False, autoflush=False, bind=engine)
+
+# 非同步 Session：路由處理函式使用；commit 後不過期，回傳 ORM 物件時不會觸發延遲載入
+async_engine = create_async_invoice_engine(
+    pool_size=int(os.getenv("INVOICE_DB_POOL_SIZE", "8")),
+    max_overflow=int(os.getenv("INVOICE_DB_MAX_OVERFLOW", "8"))
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, sync_session_class=InvoiceSession, autoflush=False, expire_on_commit=False
+)
+
+register_aggregate_listeners(InvoiceSession)
+
+
+def get_db():
+    """取得資料庫連線"""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """取得非同步資料庫連線"""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,139 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, List, Sequence
+
+from sqlalchemy import Select
+
+from .invoice_database import AsyncSessionLocal
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# 匯出欄位與 Arrow 型別（ocr_text 體積大，預設不匯出）
+EXPORT_COLUMNS = (
+    ("id", "int64"),
+    ("invoice_number", "string"),
+    ("invoice_date", "timestamp"),
+    ("vendor_name", "string"),
+    ("vendor_tax_id", "string"),
+    ("total_amount", "float64"),
+    ("tax_amount", "float64"),
+    ("net_amount", "float64"),
+    ("category", "string"),
+    ("status", "string"),
+    ("image_path", "string"),
+    ("thumbnail_url", "string"),
+    ("created_at", "timestamp"),
+    ("updated_at", "timestamp")
+)
+OCR_TEXT_COLUMN = ("ocr_text", "string")
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows")
+}
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+async def _iter_batches(statement: Select, batch_size: int) -> AsyncIterator[Sequence]:
+    """以伺服器端游標分批讀取，記憶體用量只與 batch_size 有關
+
+    串流回應在路由函式返回後才開始，因此自行開啟 session，而不是使用請求的依賴注入。
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=batch_size))
+        async for partition in result.partitions(batch_size):
+            yield partition
+
+
+async def stream_csv(statement: Select, columns: Sequence[tuple], batch_size: int = 2000) -> AsyncIterator[bytes]:
+    """逐批輸出 CSV；開頭加上 BOM，讓 Excel 正確辨識 UTF-8 中文"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+
+    async for rows in _iter_batches(statement, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow([
+                value.isoformat(sep=" ") if isinstance(value, datetime) else value
+                for value in row
+            ])
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _arrow_schema(columns: Sequence[tuple]):
+    types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(), "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types[arrow_type]) for name, arrow_type in columns])
+
+
+def _record_batch(rows: Sequence, schema) -> "pa.RecordBatch":
+    arrays = [
+        pa.array([row[i] for row in rows], type=field.type)
+        for i, field in enumerate(schema)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """收集寫入的位元組，讓串流回應逐段取出（Parquet/Arrow writer 的輸出目標）"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_parquet(statement: Select, columns: Sequence[tuple], batch_size: int = 50000) -> AsyncIterator[bytes]:
+    """每批寫成一個 Parquet row group 並立即送出"""
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for rows in _iter_batches(statement, batch_size):
+            writer.write_batch(_record_batch(rows, schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+async def stream_arrow(statement: Select, columns: Sequence[tuple], batch_size: int = 50000) -> AsyncIterator[bytes]:
+    """Arrow IPC 串流格式，每批一個 record batch"""
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pa_ipc.new_stream(sink, schema)
+    try:
+        async for rows in _iter_batches(statement, batch_size):
+            writer.write_batch(_record_batch(rows, schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
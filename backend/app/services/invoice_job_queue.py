@@ -0,0 +1,142 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .metrics import BACKGROUND_QUEUE_DEPTH
+from .structured_logging import get_logger
+from .usage_ledger import usage_context
+
+logger = get_logger(__name__)
+
+# 工作狀態
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+# 已完成 OCR 並建立發票，但與既有發票圖片相似且欄位相符，等待使用者確認是否重複
+JOB_SUSPECTED_DUPLICATE = "suspected_duplicate"
+JOB_FINISHED = (JOB_COMPLETED, JOB_FAILED, JOB_SUSPECTED_DUPLICATE)
+
+
+class InvoiceJobQueue:
+    """發票 OCR 工作佇列
+
+    上傳端點只負責存檔並排入佇列，由固定數量的 worker 在背景執行 OCR 並寫入資料庫：
+    - 同時進行的 OCR 數量受 worker 數量限制，不會因大量上傳打爆 Gemini 配額
+    - 佇列有上限，滿了時 submit 會拋出 asyncio.QueueFull，由端點回應 503
+    - 工作狀態保存在記憶體中，完成的工作保留 retention_seconds 後移除
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        workers: int = 4,
+        max_queue_size: int = 1000,
+        retention_seconds: float = 24 * 3600
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.retention_seconds = retention_seconds
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        BACKGROUND_QUEUE_DEPTH.set_function(self.pending_count, queue="invoice_ocr")
+
+    def _ensure_workers(self):
+        """在目前的事件迴圈中啟動 worker（第一次提交工作時）"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        if not self._worker_tasks:
+            self._worker_tasks = [
+                asyncio.create_task(self._worker(i)) for i in range(self.workers)
+            ]
+
+    def submit(self, payload: Dict[str, Any], batch_id: Optional[str] = None) -> Dict[str, Any]:
+        """排入一筆工作並立即回傳工作資訊"""
+        self._ensure_workers()
+        self._prune()
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "batch_id": batch_id,
+            "filename": payload.get("filename"),
+            "status": JOB_QUEUED,
+            "invoice_id": None,
+            "error": None,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "completed_at": None,
+            "_payload": payload,
+            "_finished": None
+        }
+        self._queue.put_nowait(job_id)
+        self.jobs[job_id] = job
+        return self._public(job)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        return self._public(job) if job else None
+
+    def get_batch(self, batch_id: str) -> List[Dict[str, Any]]:
+        return [self._public(job) for job in self.jobs.values() if job["batch_id"] == batch_id]
+
+    def pending_count(self) -> int:
+        """排隊中與處理中的工作數"""
+        return sum(1 for job in self.jobs.values() if job["status"] in (JOB_QUEUED, JOB_PROCESSING))
+
+    async def stop(self):
+        """停止所有 worker（尚未處理的工作會被捨棄，上傳的檔案仍保留在磁碟）"""
+        for task in self._worker_tasks:
+            task.cancel()
+        if self._worker_tasks:
+            await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def _worker(self, index: int):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            try:
+                if job is None:
+                    continue
+                job["status"] = JOB_PROCESSING
+                job["started_at"] = datetime.now().isoformat()
+                # 把本工作產生的 LLM 用量歸到 job_id
+                with usage_context(endpoint="invoice_ocr_worker", task_id=job_id):
+                    result = await self.handler(job["_payload"])
+                job["invoice_id"] = result.get("invoice_id")
+                job["duplicate"] = result.get("duplicate", False)
+                job["duplicate_of_id"] = result.get("duplicate_of_id")
+                job["suspected_duplicate_of_id"] = result.get("suspected_duplicate_of_id")
+                job["status"] = JOB_SUSPECTED_DUPLICATE if job["suspected_duplicate_of_id"] else JOB_COMPLETED
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Invoice OCR job failed: {e}", extra={"job_id": job_id})
+                if job is not None:
+                    job["status"] = JOB_FAILED
+                    job["error"] = str(e)
+            finally:
+                if job is not None and job["status"] in JOB_FINISHED:
+                    job["completed_at"] = datetime.now().isoformat()
+                    job["_finished"] = time.time()
+                    job.pop("_payload", None)
+                self._queue.task_done()
+
+    def _prune(self):
+        """移除超過保留時間的已完成工作"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["_finished"] is not None and job["_finished"] < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in job.items() if not key.startswith("_")}
@@ -1,101 +1,230 @@
-import os
-import google.generativeai as genai
-from PIL import Image
+import asyncio
 import json
+import os
 import re
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List, Optional
 from datetime import datetime
-try:
-    from ..services.token_service import token_service
-except ImportError:
-    # 如果無法導入 token_service，創建一個虛擬的
-    class MockTokenService:
-        def record_usage(self, *args, **kwargs):
-            pass
-    token_service = MockTokenService()
+from PIL import Image
+from .llm_gateway import get_llm_gateway
+from .metrics import OCR_SECONDS
+from .image_preprocessor import get_image_preprocessor
+from .structured_logging import get_logger
+from .einvoice_qr import decode_qr_codes, qr_decoder_available
+from . import taiwan_invoice
+
+logger = get_logger(__name__)
+
+class OCRBackend:
+    """OCR 後端介面
+
+    extract 回傳 {"data": 欄位, "raw_text": 原始文字, "confidence": 0~1}，失敗時拋出例外。
+    """
+    
+    name = "base"
+    
+    def available(self) -> bool:
+        return True
+    
+    async def extract(self, image_path: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class GeminiOCRBackend(OCRBackend):
+    """以 Gemini 多模態模型辨識發票（最準確，但需要付費的遠端呼叫）"""
+    
+    name = "gemini"
+    
+    def __init__(self, model_name: str = 'gemini-2.0-flash-exp'):
+        self.model_name = model_name
+        self.gateway = get_llm_gateway()
+    
+    async def extract(self, image_path: str) -> Dict[str, Any]:
+        prompt = """
+        請分析這張發票圖片，提取以下資訊並以 JSON 格式回傳：
+        {
+            "invoice_number": "發票號碼",
+            "invoice_date": "發票日期 (YYYY-MM-DD 格式)",
+            "vendor_name": "商家名稱",
+            "vendor_tax_id": "商家統一編號",
+            "total_amount": 總金額數字,
+            "tax_amount": 稅額數字,
+            "net_amount": 未稅金額數字,
+            "category": "費用類別 (交通、餐飲、辦公用品、住宿、其他)",
+            "items": [
+                {
+                    "description": "商品描述",
+                    "quantity": 數量,
+                    "unit_price": 單價,
+                    "amount": 小計
+                }
+            ]
+        }
+        
+        注意事項：
+        1. 如果某個欄位無法識別，請設為 null
+        2. 金額請轉換為數字格式
+        3. 日期請使用 YYYY-MM-DD 格式
+        4. 費用類別請根據商家類型和商品內容判斷
+        5. 只回傳 JSON，不要其他文字
+        """
+        
+        image_file = await self.gateway.upload_file(image_path)
+        response = await self.gateway.generate_content(
+            self.model_name,
+            [prompt, image_file],
+            service_type="invoice_ocr",
+            image_count=1
+        )
+        
+        result_text = response.text.strip()
+        
+        # 清理回應文字
+        if result_text.startswith('```json'):
+            result_text = result_text[7:]
+        if result_text.endswith('```'):
+            result_text = result_text[:-3]
+        
+        return {"data": json.loads(result_text), "raw_text": result_text, "confidence": 1.0}
+
+
+class TesseractOCRBackend(OCRBackend):
+    """本地 Tesseract 辨識 + 統一發票規則擷取（選用：需安裝 pytesseract 與 chi_tra 語言資料）"""
+    
+    name = "tesseract"
+    
+    def __init__(self, lang: str = "chi_tra+eng"):
+        self.lang = lang
+        self._available: Optional[bool] = None
+    
+    def available(self) -> bool:
+        if self._available is None:
+            try:
+                import pytesseract
+                languages = set(pytesseract.get_languages(config=""))
+                self._available = all(lang in languages for lang in self.lang.split("+"))
+                if not self._available:
+                    logger.info(f"Tesseract language data missing for {self.lang}, local OCR disabled")
+            except Exception:
+                self._available = False
+        return self._available
+    
+    async def extract(self, image_path: str) -> Dict[str, Any]:
+        import pytesseract
+        
+        def _recognize() -> str:
+            with Image.open(image_path) as image:
+                return pytesseract.image_to_string(image, lang=self.lang, config="--psm 6")
+        
+        # Tesseract 是外部程序，在執行緒中等待不會阻塞事件迴圈
+        text = await asyncio.to_thread(_recognize)
+        data, confidence = taiwan_invoice.extract_fields(text)
+        return {"data": data, "raw_text": text, "confidence": confidence}
+
+
+# 可用的 OCR 後端，INVOICE_OCR_BACKENDS 依序列出要嘗試的後端
+OCR_BACKENDS = {
+    "tesseract": TesseractOCRBackend,
+    "gemini": GeminiOCRBackend
+}
+
 
 class InvoiceOCRService:
-    """發票 OCR 服務類別"""
+    """發票 OCR 服務類別
+    
+    電子發票證明聯先以 QR Code 直接取得欄位，成功就不做 OCR。
+    否則依序嘗試各 OCR 後端（預設先本地 Tesseract、再 Gemini）：
+    前面的後端信心分數達到門檻就直接採用，否則交給下一個後端；最後一個後端的結果一律採用。
+    未安裝的後端會自動略過。
+    """
     
-    def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+    def __init__(self, backends: Optional[List[OCRBackend]] = None, min_confidence: Optional[float] = None):
+        if backends is None:
+            names = os.getenv("INVOICE_OCR_BACKENDS", "tesseract,gemini").split(",")
+            backends = [OCR_BACKENDS[name.strip()]() for name in names if name.strip() in OCR_BACKENDS]
+        self.backends = [backend for backend in backends if backend.available()]
+        self.min_confidence = min_confidence if min_confidence is not None else float(
+            os.getenv("INVOICE_OCR_LOCAL_MIN_CONFIDENCE", "0.8")
+        )
+        self.qr_enabled = os.getenv("INVOICE_OCR_QR", "1") != "0" and qr_decoder_available()
+        self.preprocessor = get_image_preprocessor()
+    
+    async def _extract_from_qr(self, image_path: str) -> Optional[Dict[str, Any]]:
+        """解析電子發票 QR Code；不是電子發票或解碼失敗時回傳 None"""
+        started = time.perf_counter()
+        try:
+            payloads = await asyncio.to_thread(decode_qr_codes, image_path)
+            data = taiwan_invoice.parse_einvoice_qr(payloads)
+        except Exception as e:
+            OCR_SECONDS.observe(time.perf_counter() - started, engine="qrcode", outcome="error")
+            logger.warning(f"QR code decoding failed: {e}", extra={"image_path": image_path})
+            return None
+        
+        OCR_SECONDS.observe(time.perf_counter() - started, engine="qrcode", outcome="success" if data else "not_found")
+        if data is None:
+            return None
+        return {
+            "success": True,
+            "data": self._validate_and_clean_data(data),
+            "raw_text": "\n".join(payloads),
+            "engine": "qrcode",
+            "confidence": 1.0,
+            "preprocessing": None
+        }
         
     async def extract_invoice_info(self, image_path: str) -> Dict[str, Any]:
         """從發票圖片中提取結構化資訊"""
+        if self.qr_enabled:
+            # QR Code 需要原始解析度，在前處理之前解碼
+            qr_result = await self._extract_from_qr(image_path)
+            if qr_result is not None:
+                return qr_result
+        
+        upload_path = image_path
+        preprocessing = None
+        last_error = "沒有可用的 OCR 後端"
         try:
-            prompt = """
-            請分析這張發票圖片，提取以下資訊並以 JSON 格式回傳：
-            {
-                "invoice_number": "發票號碼",
-                "invoice_date": "發票日期 (YYYY-MM-DD 格式)",
-                "vendor_name": "商家名稱",
-                "vendor_tax_id": "商家統一編號",
-                "total_amount": 總金額數字,
-                "tax_amount": 稅額數字,
-                "net_amount": 未稅金額數字,
-                "category": "費用類別 (交通、餐飲、辦公用品、住宿、其他)",
-                "items": [
-                    {
-                        "description": "商品描述",
-                        "quantity": 數量,
-                        "unit_price": 單價,
-                        "amount": 小計
-                    }
-                ]
-            }
+            # 先在本地縮小、轉灰階，減少上傳量與圖片 token
+            upload_path, preprocessing = await self.preprocessor.preprocess(image_path)
             
-            注意事項：
-            1. 如果某個欄位無法識別，請設為 null
-            2. 金額請轉換為數字格式
-            3. 日期請使用 YYYY-MM-DD 格式
-            4. 費用類別請根據商家類型和商品內容判斷
-            5. 只回傳 JSON，不要其他文字
-            """
-            
-            image_file = genai.upload_file(image_path)
-            response = self.model.generate_content([prompt, image_file])
-            
-            # 記錄 token 使用量
-            try:
-                if hasattr(response, 'usage_metadata') and response.usage_metadata:
-                    input_tokens = getattr(response.usage_metadata, 'prompt_token_count', 0)
-                    output_tokens = getattr(response.usage_metadata, 'candidates_token_count', 0)
-                    
-                    token_service.record_usage(
-                        service_type="invoice_ocr",
-                        input_tokens=input_tokens,
-                        output_tokens=output_tokens,
-                        audio_input_tokens=0,
-                        image_count=1
+            for index, backend in enumerate(self.backends):
+                is_last = index == len(self.backends) - 1
+                started = time.perf_counter()
+                try:
+                    result = await backend.extract(upload_path)
+                    invoice_data = self._validate_and_clean_data(result["data"])
+                except Exception as e:
+                    OCR_SECONDS.observe(time.perf_counter() - started, engine=backend.name, outcome="error")
+                    last_error = str(e)
+                    continue
+                
+                if not is_last and result["confidence"] < self.min_confidence:
+                    OCR_SECONDS.observe(time.perf_counter() - started, engine=backend.name, outcome="low_confidence")
+                    logger.debug(
+                        "OCR confidence below threshold, falling back",
+                        extra={"engine": backend.name, "confidence": result["confidence"]}
                     )
-            except Exception as token_error:
-                print(f"Token recording error: {token_error}")
-                pass
-            
-            result_text = response.text.strip()
+                    continue
+                
+                OCR_SECONDS.observe(time.perf_counter() - started, engine=backend.name, outcome="success")
+                return {
+                    "success": True,
+                    "data": invoice_data,
+                    "raw_text": result["raw_text"],
+                    "engine": backend.name,
+                    "confidence": result["confidence"],
+                    "preprocessing": preprocessing
+                }
             
-            # 清理回應文字
-            if result_text.startswith('```json'):
-                result_text = result_text[7:]
-            if result_text.endswith('```'):
-                result_text = result_text[:-3]
-            
-            invoice_data = json.loads(result_text)
-            invoice_data = self._validate_and_clean_data(invoice_data)
-            
-            return {
-                "success": True,
-                "data": invoice_data,
-                "raw_text": result_text
-            }
-            
-        except Exception as e:
             return {
                 "success": False,
-                "error": str(e),
+                "error": last_error,
                 "data": None
             }
+        finally:
+            # 前處理產生的暫存圖只用於辨識，原圖保留供前端顯示
+            if upload_path != image_path and os.path.exists(upload_path):
+                os.remove(upload_path)
     
     def _validate_and_clean_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """驗證和清理提取的資料"""
@@ -0,0 +1,192 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from ..models.invoice import Invoice, InvoiceAggregate
+
+# 影響彙總的欄位
+TRACKED_ATTRIBUTES = ("category", "vendor_name", "invoice_date", "created_at", "total_amount", "tax_amount")
+BUCKETS = ("month", "quarter", "year")
+
+# (dimension, key) -> [count, total_amount, tax_amount]
+Deltas = Dict[Tuple[str, str], List[float]]
+
+
+def _aggregate_keys(values: Dict) -> Dict[str, str]:
+    """發票所屬的各彙總鍵；沒有發票日期時以建立時間（UTC，與 CURRENT_TIMESTAMP 一致）歸月"""
+    month_source = values["invoice_date"] or values["created_at"] or datetime.utcnow()
+    return {
+        "category": values["category"] or "",
+        "month": month_source.strftime("%Y-%m"),
+        "vendor": values["vendor_name"] or ""
+    }
+
+
+def _current_values(invoice: Invoice) -> Dict:
+    return {name: getattr(invoice, name) for name in TRACKED_ATTRIBUTES}
+
+
+def _committed_values(invoice: Invoice) -> Dict:
+    """本次 flush 前（資料庫中）的欄位值"""
+    state = inspect(invoice)
+    values = {}
+    for name in TRACKED_ATTRIBUTES:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.unchanged:
+            values[name] = history.unchanged[0]
+        else:
+            values[name] = getattr(invoice, name)
+    return values
+
+
+def _add(deltas: Deltas, values: Dict, sign: int):
+    for dimension, key in _aggregate_keys(values).items():
+        delta = deltas[(dimension, key)]
+        delta[0] += sign
+        delta[1] += sign * (values["total_amount"] or 0.0)
+        delta[2] += sign * (values["tax_amount"] or 0.0)
+
+
+def _apply_deltas(connection: Connection, deltas: Deltas):
+    rows = [
+        {"dimension": dimension, "key": key, "count": count, "total_amount": total, "tax_amount": tax}
+        for (dimension, key), (count, total, tax) in deltas.items()
+        if count or total or tax
+    ]
+    if not rows:
+        return
+    stmt = sqlite_insert(InvoiceAggregate).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[InvoiceAggregate.dimension, InvoiceAggregate.key],
+        set_={
+            "count": InvoiceAggregate.count + stmt.excluded.count,
+            "total_amount": InvoiceAggregate.total_amount + stmt.excluded.total_amount,
+            "tax_amount": InvoiceAggregate.tax_amount + stmt.excluded.tax_amount
+        }
+    )
+    connection.execute(stmt)
+
+
+def _before_flush(session: Session, flush_context, instances):
+    """在同一個交易中依本次 flush 的發票異動更新彙總表"""
+    deltas: Deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    for obj in session.new:
+        if isinstance(obj, Invoice):
+            _add(deltas, _current_values(obj), 1)
+    for obj in session.deleted:
+        if isinstance(obj, Invoice):
+            _add(deltas, _committed_values(obj), -1)
+    for obj in session.dirty:
+        if isinstance(obj, Invoice) and session.is_modified(obj):
+            before, after = _committed_values(obj), _current_values(obj)
+            if before != after:
+                _add(deltas, before, -1)
+                _add(deltas, after, 1)
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def register_aggregate_listeners(session_class):
+    """讓 session_class（同步與非同步 Session 共用的同步類別）在 flush 時維護彙總表
+
+    注意：query.update()/query.delete() 等批次操作不經過 ORM 事件，需另外呼叫 rebuild_aggregates。
+    """
+    event.listen(session_class, "before_flush", _before_flush)
+    # 讓修改欄位時一定載入舊值，歷史紀錄才能扣掉正確的舊彙總
+    for name in TRACKED_ATTRIBUTES:
+        event.listen(getattr(Invoice, name), "set", _keep_old_value, active_history=True, retval=True)
+
+
+def rebuild_aggregates(connection: Connection):
+    """從發票表重新計算所有彙總（初次啟用或資料修復時使用）"""
+    connection.execute(text("DELETE FROM invoice_aggregates"))
+    key_expressions = {
+        "category": "COALESCE(category, '')",
+        "month": "strftime('%Y-%m', COALESCE(invoice_date, created_at))",
+        "vendor": "COALESCE(vendor_name, '')"
+    }
+    for dimension, expression in key_expressions.items():
+        connection.execute(text(
+            "INSERT INTO invoice_aggregates (dimension, key, count, total_amount, tax_amount) "
+            f"SELECT :dimension, {expression}, COUNT(*), COALESCE(SUM(total_amount), 0), COALESCE(SUM(tax_amount), 0) "
+            f"FROM invoices GROUP BY {expression}"
+        ), {"dimension": dimension})
+
+
+def _rows(db: Session, dimension: str):
+    return db.query(InvoiceAggregate).filter(
+        InvoiceAggregate.dimension == dimension,
+        InvoiceAggregate.count > 0
+    )
+
+
+def get_summary(db: Session) -> Dict:
+    """總計與類別統計（只讀取類別彙總列）"""
+    categories = _rows(db, "category").all()
+    return {
+        "total_invoices": sum(row.count for row in categories),
+        "total_amount": round(sum(row.total_amount for row in categories), 2),
+        "category_stats": [
+            {"category": row.key or None, "count": row.count, "amount": round(row.total_amount, 2)}
+            for row in categories
+        ]
+    }
+
+
+def _period(month: str, bucket: str) -> str:
+    if bucket == "year":
+        return month[:4]
+    if bucket == "quarter":
+        return f"{month[:4]}-Q{(int(month[5:7]) - 1) // 3 + 1}"
+    return month
+
+
+def get_timeseries(db: Session, bucket: str = "month", start: Optional[str] = None, end: Optional[str] = None) -> List[Dict]:
+    """依月份彙總回傳時間序列，季/年由月份彙總相加
+
+    start/end 為 YYYY-MM（含），比較直接使用彙總鍵的字串順序。
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {BUCKETS}")
+    query = _rows(db, "month")
+    if start:
+        query = query.filter(InvoiceAggregate.key >= start)
+    if end:
+        query = query.filter(InvoiceAggregate.key <= end)
+
+    periods: Dict[str, Dict] = {}
+    for row in query.order_by(InvoiceAggregate.key).all():
+        period = _period(row.key, bucket)
+        entry = periods.setdefault(period, {"period": period, "count": 0, "total_amount": 0.0, "tax_amount": 0.0})
+        entry["count"] += row.count
+        entry["total_amount"] += row.total_amount
+        entry["tax_amount"] += row.tax_amount
+    for entry in periods.values():
+        entry["total_amount"] = round(entry["total_amount"], 2)
+        entry["tax_amount"] = round(entry["tax_amount"], 2)
+    return list(periods.values())
+
+
+def get_top_vendors(db: Session, limit: int = 20) -> List[Dict]:
+    """依金額排序的商家統計"""
+    rows = _rows(db, "vendor").order_by(InvoiceAggregate.total_amount.desc()).limit(limit).all()
+    return [
+        {
+            "vendor_name": row.key or None,
+            "count": row.count,
+            "total_amount": round(row.total_amount, 2),
+            "tax_amount": round(row.tax_amount, 2)
+        }
+        for row in rows
+    ]
@@ -0,0 +1,212 @@
+import os
+import time
+import asyncio
+import random
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+from .usage_tracker import UsageTracker
+from .metrics import LLM_CALL_SECONDS, LLM_RETRIES
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# 載入環境變數並設定 Gemini API
+load_dotenv()
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+
+# 可重試的錯誤（限流、暫時性伺服器錯誤、逾時）
+_RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+_RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "TooManyRequests", "ServerError", "Aborted"
+}
+
+
+class LLMGateway:
+    """共享的非同步 LLM 呼叫閘道
+
+    - 模型與用戶端物件在程序內共用，底層連線得以重複使用
+    - 每個模型有獨立的並行上限（semaphore），避免單一模型的突發流量拖慢其他請求
+    - 每次呼叫有逾時限制，並對暫時性錯誤以帶抖動的指數退避重試
+    - 指定 service_type 時，從回應的 usage_metadata 記錄實際 token 用量與延遲
+    """
+
+    def __init__(
+        self,
+        max_concurrency_per_model: int = 8,
+        timeout_seconds: float = 120.0,
+        upload_timeout_seconds: float = 600.0,
+        max_retries: int = 3,
+        base_delay_seconds: float = 1.0,
+        max_delay_seconds: float = 20.0
+    ):
+        self.max_concurrency_per_model = max_concurrency_per_model
+        self.timeout_seconds = timeout_seconds
+        self.upload_timeout_seconds = upload_timeout_seconds
+        self.max_retries = max_retries
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._models: Dict[tuple, genai.GenerativeModel] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._image_client = None
+
+    def get_model(self, model_name: str, generation_config: Optional[Dict[str, Any]] = None) -> genai.GenerativeModel:
+        """取得共用的 GenerativeModel 實例"""
+        key = (self._normalize(model_name), repr(sorted((generation_config or {}).items())))
+        model = self._models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+            self._models[key] = model
+        return model
+
+    def get_image_client(self):
+        """取得共用的 google-genai 用戶端（Imagen 圖片生成）"""
+        if self._image_client is None and GEMINI_API_KEY:
+            from google import genai as google_genai
+            self._image_client = google_genai.Client(api_key=GEMINI_API_KEY)
+        return self._image_client
+
+    async def generate_content(
+        self,
+        model_name: str,
+        contents: Any,
+        generation_config: Optional[Dict[str, Any]] = None,
+        service_type: Optional[str] = None,
+        input_modality: str = "text",
+        image_count: int = 0,
+        **kwargs
+    ) -> Any:
+        """非同步呼叫 Gemini generate_content"""
+        model = self.get_model(model_name, generation_config)
+        return await self.call(
+            model_name,
+            lambda: model.generate_content_async(contents, **kwargs),
+            service_type=service_type,
+            input_modality=input_modality,
+            image_count=image_count
+        )
+
+    async def invoke_chat(self, llm: Any, prompt: Any, model_name: str, service_type: Optional[str] = None) -> Any:
+        """非同步呼叫 LangChain 聊天模型"""
+        return await self.call(model_name, lambda: llm.ainvoke(prompt), service_type=service_type)
+
+    async def generate_images(self, model_name: str, prompt: str, config: Any = None) -> Any:
+        """非同步呼叫 Imagen 圖片生成"""
+        client = self.get_image_client()
+        if client is None:
+            raise ValueError("GEMINI_API_KEY environment variable is required")
+        return await self.call(
+            model_name,
+            lambda: client.aio.models.generate_images(model=model_name, prompt=prompt, config=config)
+        )
+
+    async def upload_file(self, path: str, wait_until_active: bool = False, poll_seconds: float = 2.0) -> Any:
+        """上傳檔案到 Gemini 檔案服務（不阻塞事件循環）"""
+        uploaded = await self.call(
+            "files",
+            lambda: asyncio.to_thread(genai.upload_file, path=path),
+            timeout_seconds=self.upload_timeout_seconds,
+            # 逾時後執行緒中的上傳仍在進行，重試會重複上傳同一個檔案
+            retry_on_timeout=False
+        )
+        if wait_until_active:
+            # 等待檔案處理完成
+            while uploaded.state.name == "PROCESSING":
+                await asyncio.sleep(poll_seconds)
+                uploaded = await asyncio.to_thread(genai.get_file, uploaded.name)
+            if uploaded.state.name == "FAILED":
+                raise ValueError(uploaded.state.name)
+        return uploaded
+
+    async def call(
+        self,
+        model_name: str,
+        factory: Callable[[], Awaitable[Any]],
+        timeout_seconds: Optional[float] = None,
+        service_type: Optional[str] = None,
+        input_modality: str = "text",
+        image_count: int = 0,
+        retry_on_timeout: bool = True
+    ) -> Any:
+        """在並行上限、逾時與重試策略下執行一次呼叫
+
+        retry_on_timeout=False 用於無法真正取消的呼叫（例如在執行緒中的同步上傳）。
+        """
+        semaphore = self._get_semaphore(model_name)
+        metric_model = self._normalize(model_name)
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        attempt = 0
+        while True:
+            started = None
+            try:
+                async with semaphore:
+                    # 延遲只計算實際呼叫模型的時間，不含排隊與重試等待
+                    started = time.perf_counter()
+                    response = await asyncio.wait_for(factory(), timeout=timeout_seconds)
+                    latency_ms = (time.perf_counter() - started) * 1000
+                LLM_CALL_SECONDS.observe(latency_ms / 1000, model=metric_model, outcome="success")
+                if service_type:
+                    UsageTracker.record_response_usage(response, service_type, input_modality, latency_ms, image_count)
+                return response
+            except Exception as e:
+                if started is not None:
+                    outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                    LLM_CALL_SECONDS.observe(time.perf_counter() - started, model=metric_model, outcome=outcome)
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                if isinstance(e, asyncio.TimeoutError) and not retry_on_timeout:
+                    raise
+                LLM_RETRIES.inc(model=metric_model)
+                delay = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** attempt))
+                delay = random.uniform(delay / 2, delay)  # 抖動，避免同時重試
+                attempt += 1
+                logger.warning(f"LLM call to {model_name} failed ({type(e).__name__}: {e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _get_semaphore(self, model_name: str) -> asyncio.Semaphore:
+        key = self._normalize(model_name)
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency_per_model)
+            self._semaphores[key] = semaphore
+        return semaphore
+
+    @staticmethod
+    def _normalize(model_name: str) -> str:
+        return model_name[len("models/"):] if model_name.startswith("models/") else model_name
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, asyncio.TimeoutError):
+            return True
+        if type(error).__name__ in _RETRYABLE_ERROR_NAMES:
+            return True
+        code = getattr(error, "code", None) or getattr(error, "status_code", None)
+        if callable(code):
+            try:
+                code = code()
+            except Exception:
+                code = None
+        code = getattr(code, "value", code)
+        if isinstance(code, tuple):
+            code = code[0]
+        return code in _RETRYABLE_STATUS_CODES
+
+
+# 全局實例
+_global_llm_gateway = None
+
+def get_llm_gateway() -> LLMGateway:
+    """獲取全局 LLMGateway 實例"""
+    global _global_llm_gateway
+    if _global_llm_gateway is None:
+        _global_llm_gateway = LLMGateway(
+            max_concurrency_per_model=int(os.getenv("LLM_MAX_CONCURRENCY_PER_MODEL", "8")),
+            timeout_seconds=float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+        )
+    return _global_llm_gateway
@@ -5,6 +5,9 @@ from typing import Dict, Any, List
 
 import google.generativeai as genai
 from dotenv import load_dotenv
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 # 載入環境變數並設定 Gemini API
 load_dotenv()
@@ -123,15 +126,13 @@ async def generate_markdown_mindmap_from_content_blocks(content_blocks: list) ->
         
         response = model.generate_content(prompt)
         
-        print(f"Markdown心智圖生成成功")
+        logger.info("Markdown心智圖生成成功")
         
         # 返回生成的markdown內容
         return response.text.strip()
         
     except Exception as e:
-        print(f"Markdown心智圖生成錯誤: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Markdown心智圖生成錯誤: %s", e)
         
         # 返回預設的markdown心智圖結構
         return """# 會議心智圖
@@ -280,15 +281,13 @@ async def generate_markdown_mindmap_from_transcript(transcript: str) -> str:
         
         response = model.generate_content(prompt)
         
-        print(f"從轉錄文本生成Markdown心智圖成功")
+        logger.info("從轉錄文本生成Markdown心智圖成功")
         
         # 返回生成的markdown內容
         return response.text.strip()
         
     except Exception as e:
-        print(f"從轉錄文本生成Markdown心智圖錯誤: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("從轉錄文本生成Markdown心智圖錯誤: %s", e)
         
         # 返回預設的markdown心智圖結構
         return """# 會議心智圖
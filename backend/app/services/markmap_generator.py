@@ -3,6 +3,9 @@ from typing import Dict, Any, List
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 # 載入環境變數
 load_dotenv()
@@ -22,7 +25,7 @@ async def generate_markmap_markdown(content_blocks: list) -> str:
         return markdown
         
     except Exception as e:
-        print(f"Markmap 心智圖生成錯誤: {e}")
+        logger.exception("Markmap 心智圖生成錯誤: %s", e)
         return _get_fallback_markdown()
 
 async def _generate_markdown_structure(content_text: str) -> str:
@@ -0,0 +1,174 @@
+import os
+import json
+import atexit
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .append_log import write_json_atomic
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class JournaledJSONStore:
+    """寫回式（write-behind）JSON 持久化存儲
+
+    - 每次變更只追加一行到 journal 檔（小量 append，不重寫整個檔案）
+    - 快照以防抖（debounce）方式在背景執行緒中寫入
+    - 快照透過臨時檔 + os.replace 原子替換；開始寫入前先把 journal 換成 .flushing，
+      快照寫入與 fsync 在鎖外進行，不阻塞其他寫入，寫入完成後再刪除 .flushing
+    - 啟動時讀取快照並依序重放 .flushing 與 journal，程序崩潰也不會遺失已記錄的變更
+      （重放的操作都是冪等的，快照已包含 .flushing 的內容時再重放一次結果不變）
+    """
+
+    def __init__(self, path: Path, debounce_seconds: float = 1.0):
+        self.path = Path(path)
+        self.journal_path = self.path.with_name(self.path.name + ".journal")
+        self.flushing_path = self.path.with_name(self.path.name + ".journal.flushing")
+        self.debounce_seconds = debounce_seconds
+        self._data: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        # 序列化快照寫入（背景計時器與 atexit 可能同時觸發）
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._dirty = False
+        _register_store(self)
+
+    def load(self) -> Dict[str, Any]:
+        """載入快照並重放 journal，回傳資料副本"""
+        with self._lock:
+            data: Dict[str, Any] = {}
+            if self.path.exists():
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except Exception as e:
+                    logger.warning(f"Failed to load snapshot {self.path}: {e}")
+
+            replayed = 0
+            for journal in (self.flushing_path, self.journal_path):
+                if not journal.exists():
+                    continue
+                with open(journal, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # 崩潰時最後一行可能寫到一半，直接略過
+                            continue
+                        self._apply(data, entry)
+                        replayed += 1
+
+            self._data = data
+            if replayed:
+                logger.info(f"Replayed {replayed} journal entries for {self.path.name}")
+                self._dirty = True
+                self._schedule_flush()
+            return json.loads(json.dumps(self._data))
+
+    def set(self, key: str, value: Any):
+        """更新單一鍵值"""
+        self._record({"op": "set", "key": key, "value": value})
+
+    def delete(self, key: str):
+        """刪除單一鍵值"""
+        self._record({"op": "delete", "key": key})
+
+    def replace(self, value: Dict[str, Any]):
+        """整體替換內容"""
+        self._record({"op": "replace", "value": value})
+
+    def flush(self):
+        """立即將快照寫入磁碟"""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                # 值在存入時已是獨立副本且只會被整個替換，淺層複製即可
+                snapshot = dict(self._data)
+                try:
+                    self._rotate_journal()
+                except Exception as e:
+                    logger.warning(f"Failed to rotate journal {self.journal_path}: {e}")
+                    return
+                self._dirty = False
+
+            try:
+                write_json_atomic(self.path, snapshot)
+                # 快照已涵蓋換出的 journal，之後的變更都在新的 journal 中
+                self.flushing_path.unlink(missing_ok=True)
+            except Exception as e:
+                logger.warning(f"Failed to flush {self.path}: {e}")
+                with self._lock:
+                    # .flushing 保留到下次寫入成功，重新標記待寫入
+                    self._dirty = True
+                    self._schedule_flush()
+
+    def _rotate_journal(self):
+        """（需持有 _lock）把目前的 journal 換成 .flushing，新的變更寫入新的 journal"""
+        if not self.journal_path.exists():
+            return
+        if self.flushing_path.exists():
+            # 上次寫入失敗留下的 .flushing，接上目前的 journal 以保持順序
+            with open(self.journal_path, 'r', encoding='utf-8') as src, \
+                    open(self.flushing_path, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.flushing_path)
+
+    def _record(self, entry: Dict[str, Any]):
+        with self._lock:
+            # 透過 JSON 序列化取得獨立副本，避免呼叫端後續修改影響快照
+            line = json.dumps(entry, ensure_ascii=False)
+            self._apply(self._data, json.loads(line))
+            try:
+                self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+            except Exception as e:
+                logger.warning(f"Failed to append journal {self.journal_path}: {e}")
+            self._dirty = True
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.debounce_seconds, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    @staticmethod
+    def _apply(data: Dict[str, Any], entry: Dict[str, Any]):
+        op = entry.get("op")
+        if op == "set":
+            data[entry["key"]] = entry["value"]
+        elif op == "delete":
+            data.pop(entry["key"], None)
+        elif op == "replace":
+            data.clear()
+            data.update(entry.get("value") or {})
+
+
+# 所有存儲實例，用於關閉時統一寫入
+_stores: List[JournaledJSONStore] = []
+
+
+def _register_store(store: JournaledJSONStore):
+    _stores.append(store)
+
+
+def flush_all_stores():
+    """將所有待寫入的快照立即寫入磁碟"""
+    for store in list(_stores):
+        store.flush()
+
+
+atexit.register(flush_all_stores)
@@ -0,0 +1,238 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# 預設的延遲分桶（秒），涵蓋毫秒級的檢索到分鐘級的 LLM/OCR 呼叫
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """可增可減的量測值，也可以在輸出時透過回呼函式取值"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """輸出指標時才呼叫 function 取值（例如佇列長度）"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = float(function())
+            except Exception as e:
+                logger.warning(f"Gauge {self.name} callback failed: {e}")
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """分桶統計的延遲分佈"""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 每組標籤：[各分桶計數..., 總和, 總數]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """量測 with 區塊的執行時間（秒）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', _format_value(bound)))} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """指標註冊表，輸出 Prometheus 文字格式"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, label_names))
+
+
+def gauge(name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, label_names))
+
+
+def histogram(name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, label_names, buckets))
+
+
+# 應用程式指標
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_PROGRESS = gauge(
+    "http_requests_in_progress", "HTTP requests currently being served", ("method", "route")
+)
+LLM_CALL_SECONDS = histogram(
+    "llm_call_duration_seconds", "LLM call latency by model", ("model", "outcome")
+)
+LLM_RETRIES = counter(
+    "llm_call_retries_total", "LLM call retries by model", ("model",)
+)
+EMBEDDING_SECONDS = histogram(
+    "embedding_duration_seconds", "Embedding model latency", ("operation",)
+)
+VECTOR_STORE_SECONDS = histogram(
+    "vector_store_operation_duration_seconds", "Chroma operation latency", ("operation",)
+)
+OCR_SECONDS = histogram(
+    "ocr_duration_seconds", "Invoice OCR latency", ("engine", "outcome")
+)
+OCR_PREPROCESS_SECONDS = histogram(
+    "ocr_preprocess_duration_seconds", "Invoice image pre-processing latency", ("outcome",)
+)
+OCR_IMAGE_BYTES = counter(
+    "ocr_image_bytes_total", "Invoice image bytes before pre-processing and as uploaded", ("stage",)
+)
+BACKGROUND_QUEUE_DEPTH = gauge(
+    "background_queue_depth", "Background tasks waiting or running", ("queue",)
+)
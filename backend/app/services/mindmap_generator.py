@@ -1,18 +1,13 @@
-import os
 import json
-import time
 from typing import Dict, Any
 
-import google.generativeai as genai
-from dotenv import load_dotenv
-
 from ..models.schemas import ReactFlowMindMap
+from .llm_gateway import get_llm_gateway, GEMINI_API_KEY
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
-# 載入環境變數並設定 Gemini API
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+llm_gateway = get_llm_gateway()
 
 async def generate_mindmap_from_content_blocks(content_blocks: list) -> ReactFlowMindMap:
     """從內容區塊生成心智圖"""
@@ -80,11 +75,8 @@ async def generate_mindmap_from_content_blocks(content_blocks: list) -> ReactFlo
 請直接輸出 JSON，不要包含 Markdown 語法。
         """
         
-        # 建立模型並發送請求
-        model = genai.GenerativeModel(model_name="gemini-2.5-flash")
-        response = model.generate_content(f"{text_content}\n\n{prompt}")
-        
-        print(f"Gemini 原始回應: {response.text}")
+        # 發送請求
+        response = await llm_gateway.generate_content("gemini-2.5-flash", f"{text_content}\n\n{prompt}", service_type="mindmap")
         
         # 清理並解析 JSON 回應
         cleaned_json_string = response.text.strip()
@@ -97,7 +89,7 @@ async def generate_mindmap_from_content_blocks(content_blocks: list) -> ReactFlo
         
         cleaned_json_string = cleaned_json_string.strip()
         
-        print(f"清理後的 JSON: {cleaned_json_string}")
+        logger.debug("Cleaned mindmap JSON", extra={"length": len(cleaned_json_string)})
         
         # 解析 JSON
         result_dict = json.loads(cleaned_json_string)
@@ -115,8 +107,7 @@ async def generate_mindmap_from_content_blocks(content_blocks: list) -> ReactFlo
         return ReactFlowMindMap(**result_dict)
         
     except json.JSONDecodeError as e:
-        print(f"JSON 解析錯誤: {e}")
-        print(f"原始回應: {response.text if 'response' in locals() else 'No response'}")
+        logger.error("JSON 解析錯誤: %s", e, extra={"response_length": len(response.text) if 'response' in locals() else 0})
         # 返回商業級別的預設心智圖結構
         return ReactFlowMindMap(
             nodes=[
@@ -134,9 +125,7 @@ async def generate_mindmap_from_content_blocks(content_blocks: list) -> ReactFlo
             ]
         )
     except Exception as e:
-        print(f"心智圖生成錯誤: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("心智圖生成錯誤: %s", e)
         # 返回商業級別的預設心智圖結構
         return ReactFlowMindMap(
             nodes=[
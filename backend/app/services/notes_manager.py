@@ -4,6 +4,10 @@ from pathlib import Path
 from typing import List, Dict, Optional
 from datetime import datetime
 
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
 class NotesManager:
     """筆記管理服務"""
     
@@ -20,7 +24,7 @@ class NotesManager:
                 with open(self.index_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
             except Exception as e:
-                print(f"Failed to load notes index: {e}")
+                logger.error("Failed to load notes index: %s", e)
         return {}
     
     def _save_index(self):
@@ -34,13 +38,11 @@ class NotesManager:
             with open(self.index_file, 'w', encoding='utf-8') as f:
                 json.dump(self.notes_index, f, ensure_ascii=False, indent=2, default=json_serializer)
         except Exception as e:
-            print(f"Failed to save notes index: {e}")
+            logger.error("Failed to save notes index: %s", e)
     
     def save_note(self, task_id: str, filename: str, result: Dict) -> bool:
         """保存筆記（包含心智圖）"""
         try:
-            print(f"開始保存筆記: task_id={task_id}, filename={filename}")
-            
             # 保存筆記內容（處理 datetime 序列化）
             def json_serializer(obj):
                 if hasattr(obj, 'isoformat'):
@@ -50,7 +52,6 @@ class NotesManager:
             note_file = self.notes_dir / f"{task_id}.json"
             with open(note_file, 'w', encoding='utf-8') as f:
                 json.dump(result, f, ensure_ascii=False, indent=2, default=json_serializer)
-            print(f"筆記文件已保存: {note_file}")
             
             # 更新索引
             note_info = {
@@ -65,15 +66,12 @@ class NotesManager:
                 "custom_tags": []
             }
             self.notes_index[task_id] = note_info
-            print(f"筆記索引已更新: {note_info}")
             
             self._save_index()
-            print(f"索引文件已保存，當前索引數量: {len(self.notes_index)}")
+            logger.info("Note saved", extra={"task_id": task_id, "note_filename": filename, "notes_count": len(self.notes_index)})
             return True
         except Exception as e:
-            print(f"Failed to save note {task_id}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Failed to save note %s: %s", task_id, e)
             return False
     
     def update_note_mindmap(self, task_id: str, mindmap_data: Dict) -> bool:
@@ -91,11 +89,11 @@ class NotesManager:
                 
                 with open(note_file, 'w', encoding='utf-8') as f:
                     json.dump(note, f, ensure_ascii=False, indent=2, default=json_serializer)
-                print(f"心智圖已更新: {task_id}")
+                logger.info("心智圖已更新", extra={"task_id": task_id})
                 return True
             return False
         except Exception as e:
-            print(f"Failed to update mindmap for {task_id}: {e}")
+            logger.error("Failed to update mindmap: %s", e, extra={"task_id": task_id})
             return False
     
     def update_note_markdown_mindmap(self, task_id: str, markdown_mindmap: str) -> bool:
@@ -113,11 +111,11 @@ class NotesManager:
                 
                 with open(note_file, 'w', encoding='utf-8') as f:
                     json.dump(note, f, ensure_ascii=False, indent=2, default=json_serializer)
-                print(f"Markdown心智圖已更新: {task_id}")
+                logger.info("Markdown心智圖已更新", extra={"task_id": task_id})
                 return True
             return False
         except Exception as e:
-            print(f"Failed to update markdown mindmap for {task_id}: {e}")
+            logger.error("Failed to update markdown mindmap: %s", e, extra={"task_id": task_id})
             return False
     
     def _extract_title(self, result: Dict) -> str:
@@ -262,7 +260,7 @@ class NotesManager:
                 with open(note_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
             except Exception as e:
-                print(f"Failed to load note {task_id}: {e}")
+                logger.error("Failed to load note: %s", e, extra={"task_id": task_id})
         return None
     
     def update_note_title(self, task_id: str, new_title: str) -> bool:
@@ -274,32 +272,25 @@ class NotesManager:
                 return True
             return False
         except Exception as e:
-            print(f"Failed to update note title {task_id}: {e}")
+            logger.error("Failed to update note title: %s", e, extra={"task_id": task_id})
             return False
     
     def update_note_properties(self, task_id: str, properties: Dict) -> bool:
         """更新筆記屬性"""
         try:
-            print(f"嘗試更新筆記屬性: task_id={task_id}, properties={properties}")
-            print(f"當前索引中的 task_id: {list(self.notes_index.keys())}")
-            
             if task_id in self.notes_index:
-                print(f"找到筆記: {task_id}")
                 allowed_props = ['color', 'favorite', 'custom_tags', 'tags']
-                for prop in allowed_props:
-                    if prop in properties:
-                        print(f"更新屬性: {prop} = {properties[prop]}")
-                        self.notes_index[task_id][prop] = properties[prop]
+                updated = [prop for prop in allowed_props if prop in properties]
+                for prop in updated:
+                    self.notes_index[task_id][prop] = properties[prop]
                 self._save_index()
-                print(f"更新後的筆記: {self.notes_index[task_id]}")
+                logger.debug("Note properties updated", extra={"task_id": task_id, "properties": updated})
                 return True
             else:
-                print(f"未找到筆記: {task_id}")
+                logger.info("Note not found for property update", extra={"task_id": task_id})
                 return False
         except Exception as e:
-            print(f"Failed to update note properties {task_id}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Failed to update note properties %s: %s", task_id, e)
             return False
     
     def search_notes(self, query: str = "", tags: List[str] = None, color: str = "", favorite: bool = None) -> List[Dict]:
@@ -349,7 +340,7 @@ class NotesManager:
             results.sort(key=lambda x: x["created_at"], reverse=True)
             return results
         except Exception as e:
-            print(f"Search notes error: {e}")
+            logger.exception("Search notes error: %s", e)
             return []
     
     def get_all_tags(self) -> List[str]:
@@ -361,7 +352,7 @@ class NotesManager:
                 all_tags.update(note_info.get('custom_tags', []))
             return sorted(list(all_tags))
         except Exception as e:
-            print(f"Get all tags error: {e}")
+            logger.exception("Get all tags error: %s", e)
             return []
     
     def delete_note(self, task_id: str) -> bool:
@@ -377,7 +368,7 @@ class NotesManager:
             
             return True
         except Exception as e:
-            print(f"Failed to delete note {task_id}: {e}")
+            logger.error("Failed to delete note: %s", e, extra={"task_id": task_id})
             return False
 
 # 全域實例
@@ -446,7 +437,5 @@ def get_all_notes():
         
         return notes
     except Exception as e:
-        print(f"獲取筆記列表錯誤: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("獲取筆記列表錯誤: %s", e)
         return []
\ No newline at end of file
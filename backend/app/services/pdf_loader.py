@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+from pypdf import PdfReader
+
+# 全局進程池，避免每份文件重複啟動子進程
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """獲取 PDF 解析用的共享進程池"""
+    global _pdf_executor
+    if _pdf_executor is None:
+        max_workers = int(os.getenv("PDF_PARSE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+        _pdf_executor = ProcessPoolExecutor(max_workers=max_workers)
+    return _pdf_executor
+
+
+def shutdown_pdf_executor():
+    """關閉 PDF 解析進程池（應用關閉時呼叫）"""
+    global _pdf_executor
+    if _pdf_executor is not None:
+        _pdf_executor.shutdown(wait=False, cancel_futures=True)
+        _pdf_executor = None
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """在子進程中解析指定頁碼範圍的文字"""
+    reader = PdfReader(file_path)
+    return [(i, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+class ParallelPDFLoader:
+    """按頁並行解析的 PDF 加載器
+
+    將頁碼範圍分派到進程池中解析，並依頁碼順序逐頁產出 Document，
+    呼叫端可以在後續頁面仍在解析時就開始分割前面的頁面。
+    產出的 metadata 與 PyPDFLoader 相同（source、page 從 0 開始）。
+    """
+
+    def __init__(self, file_path: str, pages_per_task: int = 16):
+        self.file_path = file_path
+        self.pages_per_task = pages_per_task
+
+    def lazy_load(self) -> Iterator[Document]:
+        """依頁碼順序逐頁產出 Document"""
+        total_pages = len(PdfReader(self.file_path).pages)
+
+        # 頁數少時直接在當前進程解析，省去進程間傳輸成本
+        if total_pages <= self.pages_per_task:
+            for page, text in _extract_page_range(self.file_path, 0, total_pages):
+                yield self._to_document(page, text, total_pages)
+            return
+
+        executor = get_pdf_executor()
+        futures = [
+            executor.submit(_extract_page_range, self.file_path, start, min(start + self.pages_per_task, total_pages))
+            for start in range(0, total_pages, self.pages_per_task)
+        ]
+
+        # 子任務可能亂序完成，暫存後依頁碼順序產出
+        pending: Dict[int, str] = {}
+        next_page = 0
+        try:
+            for future in as_completed(futures):
+                for page, text in future.result():
+                    pending[page] = text
+                while next_page in pending:
+                    yield self._to_document(next_page, pending.pop(next_page), total_pages)
+                    next_page += 1
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def load(self) -> List[Document]:
+        """一次性加載所有頁面"""
+        return list(self.lazy_load())
+
+    def _to_document(self, page: int, text: str, total_pages: int) -> Document:
+        return Document(
+            page_content=text,
+            metadata={"source": self.file_path, "page": page, "total_pages": total_pages}
+        )
@@ -37,13 +37,8 @@ class PosterIterationService:
         # 根據調整類型修改提示詞
         adjusted_prompt = await self._apply_specific_adjustment(original_prompt, adjustment_type)
         
-        # 計算 token 使用量
-        token_usage = TokenUsage(
-            input_tokens=len(original_prompt.split()) * 2,
-            output_tokens=len(adjusted_prompt.split()) * 2
-        )
-        
-        return adjusted_prompt, token_usage
+        # 調整以規則完成，沒有呼叫模型，不產生 token 用量
+        return adjusted_prompt, TokenUsage()
     
     async def _apply_specific_adjustment(self, prompt: str, adjustment_type: str) -> str:
         """應用特定的調整邏輯"""
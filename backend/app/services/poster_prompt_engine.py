@@ -3,19 +3,16 @@ AI 海報生成器 - 提示詞優化引擎
 基於《提示詞優化海報生成框架》實現的智能提示詞生成系統
 """
 
-import os
 import random
 from typing import Dict, List, Tuple, Optional
-import google.generativeai as genai
-from dotenv import load_dotenv
 from ..models.usage_tracking import TokenUsage
-from .token_service import token_service
+from .usage_tracker import UsageTracker
+from .llm_gateway import get_llm_gateway
+from .structured_logging import get_logger
 
-# 載入環境變數
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+logger = get_logger(__name__)
+
+llm_gateway = get_llm_gateway()
 
 class PosterPromptEngine:
     """海報提示詞生成引擎 - 實現自動化創意指導"""
@@ -218,16 +215,19 @@ class PosterPromptEngine:
         """
         
         try:
+            # 累計本次生成中各次 Gemini 呼叫的實際 token 使用量
+            token_usage = TokenUsage()
+            
             # 第一模組：概念轉化
-            main_subject = await self._conceptual_translation(theme)
+            main_subject = await self._conceptual_translation(theme, token_usage)
             
             # 第二模組：風格解構
             style_components = self._style_deconstruction(style)
-            print(f"Style components for {style}: {style_components}")
+            logger.debug("Style components for %s: %s", style, style_components)
             
             # 第三模組：機率性關鍵詞選擇
             selected_components = self._probabilistic_selection(style_components)
-            print(f"Selected components: {selected_components}")
+            logger.debug("Selected components: %s", selected_components)
             
             # 第四模組：最終提示詞合成
             final_prompt = self._synthesize_prompt(
@@ -236,48 +236,34 @@ class PosterPromptEngine:
                 poster_type
             )
             
-            # 計算 token 使用量（概念轉化步驟）
-            token_usage = TokenUsage(
-                input_tokens=len(theme.split()) * 2,  # 估算
-                output_tokens=len(final_prompt.split()) * 2
-            )
-            
-            # 更新全局統計
-            token_service.update_token_stats(
-                token_usage.input_tokens,
-                token_usage.output_tokens
-            )
-            
             return final_prompt, token_usage
             
         except Exception as e:
-            print(f"Enhanced prompt generation error: {e}")
+            logger.exception("Enhanced prompt generation error: %s", e)
             # 返回基礎提示詞
             fallback_prompt = self._generate_fallback_prompt(theme, style, poster_type)
             return fallback_prompt, TokenUsage()
     
-    async def _conceptual_translation(self, theme: str) -> str:
+    async def _conceptual_translation(self, theme: str, token_usage: TokenUsage) -> str:
         """第一模組：抽象概念轉化為具體視覺主體（內容引擎）"""
         
         # 優先使用 Gemini 生成具體場景
-        scene_template = await self._get_scene_template(theme)
+        scene_template = await self._get_scene_template(theme, token_usage)
         if scene_template:
             return scene_template
         
         # 如果沒有預設劇本，使用抽象概念轉化
         abstract_keywords = self._extract_abstract_concepts(theme)
         if abstract_keywords:
-            return await self._generative_brainstorming(theme, abstract_keywords)
+            return await self._generative_brainstorming(theme, abstract_keywords, token_usage)
         
         # 最後才使用抽象描述
         return f"professional visualization of {theme}"
     
-    async def _get_scene_template(self, theme: str) -> Optional[str]:
+    async def _get_scene_template(self, theme: str, token_usage: TokenUsage) -> Optional[str]:
         """使用 Gemini 生成具體場景描述"""
         
         try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            
             scene_prompt = f"""
 你是一位專業的商業攝影師和視覺設計師。
 
@@ -295,16 +281,24 @@ class PosterPromptEngine:
 直接輸出英文場景描述：
 """
             
-            response = model.generate_content(scene_prompt)
+            response = await llm_gateway.generate_content('gemini-2.5-flash', scene_prompt, service_type="poster_generator")
+            self._add_usage(token_usage, response)
             scene_description = response.text.strip()
             
-            print(f"Generated scene for '{theme}': {scene_description}")
+            logger.debug("Generated scene for %r: %s", theme, scene_description)
             return scene_description
             
         except Exception as e:
-            print(f"Scene generation error: {e}")
+            logger.warning("Scene generation error: %s", e)
             return None
     
+    @staticmethod
+    def _add_usage(token_usage: TokenUsage, response) -> None:
+        """將 Gemini 回應的實際 token 使用量累加到 token_usage"""
+        usage = UsageTracker.extract_token_usage_from_response(response, "text")
+        token_usage.input_tokens += usage.input_tokens
+        token_usage.output_tokens += usage.output_tokens
+    
     def _get_theme_keywords(self, template_key: str) -> List[str]:
         """獲取主題關鍵詞同義詞"""
         
@@ -348,12 +342,10 @@ class PosterPromptEngine:
         
         return synonyms_map.get(concept, [])
     
-    async def _generative_brainstorming(self, theme: str, concepts: List[str]) -> str:
+    async def _generative_brainstorming(self, theme: str, concepts: List[str], token_usage: TokenUsage) -> str:
         """使用 LLM 進行生成式腦力激盪"""
         
         try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            
             brainstorm_prompt = f"""
 你是一位資深視覺創意總監。為以下主題進行視覺隱喻腦力激盪：
 
@@ -371,7 +363,8 @@ class PosterPromptEngine:
 直接輸出 5 個英文短語，用逗號分隔：
 """
             
-            response = model.generate_content(brainstorm_prompt)
+            response = await llm_gateway.generate_content('gemini-2.5-flash', brainstorm_prompt, service_type="poster_generator")
+            self._add_usage(token_usage, response)
             metaphors = [m.strip() for m in response.text.split(',')]
             
             # 隨機選擇一個隱喻
@@ -380,7 +373,7 @@ class PosterPromptEngine:
             return selected_metaphor
             
         except Exception as e:
-            print(f"Generative brainstorming error: {e}")
+            logger.warning("Generative brainstorming error: %s", e)
             # 使用預設映射
             if concepts:
                 concept = concepts[0]
@@ -394,7 +387,7 @@ class PosterPromptEngine:
         
         # 獲取風格配方
         recipe = self.style_recipes.get(style, self.style_recipes["modern_tech"])
-        print(f"Using recipe for style '{style}': {recipe}")
+        logger.debug("Using recipe for style %r: %s", style, recipe)
         
         # 解構為具體關鍵詞組合
         components = {}
@@ -5,6 +5,9 @@ from typing import Dict, Any, List, Tuple
 import google.generativeai as genai
 from dotenv import load_dotenv
 from ..models.schemas import ReactFlowMindMap
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 # 載入環境變數並設定 Gemini API
 load_dotenv()
@@ -52,7 +55,7 @@ class ProfessionalMindMapGenerator:
             return professional_mindmap
             
         except Exception as e:
-            print(f"專業心智圖生成錯誤: {e}")
+            logger.exception("專業心智圖生成錯誤: %s", e)
             return self._create_fallback_mindmap()
 
     def _analyze_content_structure(self, content_blocks: list) -> str:
@@ -1,16 +1,12 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 from ..models.usage_tracking import TokenUsage
-from .token_service import token_service
 from .poster_prompt_engine import poster_prompt_engine
 from .poster_iteration_service import poster_iteration_service
+from .llm_gateway import get_llm_gateway
+from .structured_logging import get_logger
 
-# 載入環境變數並設定 Gemini API
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+logger = get_logger(__name__)
+
+llm_gateway = get_llm_gateway()
 
 async def enhance_prompt_for_poster(text_content: str, style: str, poster_type: str, has_image: bool = False) -> tuple[str, 'TokenUsage']:
     """使用智能提示詞引擎生成優化的海報提示詞"""
@@ -25,7 +21,7 @@ async def enhance_prompt_for_poster(text_content: str, style: str, poster_type:
         }
         
         mapped_style = style_mapping.get(style, style)
-        print(f"Original style: {style}, Mapped style: {mapped_style}")
+        logger.debug("Original style: %s, mapped style: %s", style, mapped_style)
         
         # 使用新的智能提示詞引擎
         enhanced_prompt, token_usage = await poster_prompt_engine.generate_enhanced_prompt(
@@ -37,7 +33,7 @@ async def enhance_prompt_for_poster(text_content: str, style: str, poster_type:
         return enhanced_prompt, token_usage
         
     except Exception as e:
-        print(f"Enhanced prompt generation error: {e}")
+        logger.warning("Enhanced prompt generation error: %s", e)
         # 使用備用的簡化版本
         return await _generate_fallback_prompt(text_content, style, poster_type)
 
@@ -58,7 +54,7 @@ async def apply_poster_adjustment(
         return adjusted_prompt, token_usage
         
     except Exception as e:
-        print(f"Poster adjustment error: {e}")
+        logger.warning("Poster adjustment error: %s", e)
         return original_prompt, TokenUsage()
 
 async def _generate_fallback_prompt(text_content: str, style: str, poster_type: str) -> tuple[str, TokenUsage]:
@@ -82,8 +78,6 @@ async def _generate_fallback_prompt(text_content: str, style: str, poster_type:
     
     # 使用 Gemini 智能生成 Imagen prompt
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
         # 風格描述
         style_desc = {
             'modern': '現代簡約風格，幾何形狀，藍白色系',
@@ -92,7 +86,7 @@ async def _generate_fallback_prompt(text_content: str, style: str, poster_type:
             'minimal': '極簡風格，大量留白，單色系'
         }.get(style, '現代簡約風格')
         
-        prompt_generation = model.generate_content(f"""
+        prompt_generation = await llm_gateway.generate_content('gemini-2.5-flash', f"""
 你是一位專業的視覺背景設計師與構圖藝術家。
 
 你的任務是根據以下指令，為 Imagen 創造一張高品質、有視覺焦點的「背景圖像」：
@@ -108,24 +102,18 @@ async def _generate_fallback_prompt(text_content: str, style: str, poster_type:
 4. **專業構圖：** 適合企業使用的高品質設計
 
 直接輸出英文 prompt（必須以 "no text, no letters, no words" 結尾）：
-""")
+""", service_type="poster_generator")
         
         generated_prompt = prompt_generation.text.strip()
         
-        # 提取 token 使用量
+        # 提取 token 使用量（全局統計已由 LLM 閘道記錄）
         from .usage_tracker import UsageTracker
         prompt_usage = UsageTracker.extract_token_usage_from_response(prompt_generation, "text")
         
-        # 更新全局 token 統計
-        token_service.update_token_stats(
-            prompt_usage.input_tokens,
-            prompt_usage.output_tokens
-        )
-        
         return generated_prompt, prompt_usage
         
     except Exception as e:
-        print(f"Fallback prompt generation error: {e}")
+        logger.warning("Fallback prompt generation error: %s", e)
         # 最終備用 prompt
         fallback_prompt = f"Professional poster background design with visual elements and clean composition, {style_prompts.get(style, style_prompts['modern'])}, space for text overlay, no text, no letters, no words"
         return fallback_prompt, TokenUsage()
@@ -149,9 +137,7 @@ async def enhance_prompt_for_icon(subject: str, style: str, composition: str) ->
     }
     
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        prompt_generation = model.generate_content(f"""
+        prompt_generation = await llm_gateway.generate_content('gemini-2.5-flash', f"""
 你是一位專業的圖示設計師。請為以下需求生成一個高品質的 Imagen prompt：
 
 主題：{subject}
@@ -165,19 +151,14 @@ async def enhance_prompt_for_icon(subject: str, style: str, composition: str) ->
 4. 無文字，純圖形設計
 
 直接輸出英文 prompt（必須包含 "transparent background, PNG format, no text"）：
-""")
+""", service_type="icon_generator")
         
         enhanced_prompt = prompt_generation.text.strip()
         
-        # 記錄 token 使用量
-        from .usage_tracker import UsageTracker
-        usage = UsageTracker.extract_token_usage_from_response(prompt_generation, "text")
-        token_service.update_token_stats(usage.input_tokens, usage.output_tokens)
-        
         return enhanced_prompt
         
     except Exception as e:
-        print(f"Icon prompt enhancement error: {e}")
+        logger.warning("Icon prompt enhancement error: %s", e)
         # 備用 prompt
         style_desc = style_prompts.get(style, style_prompts['modern'])
         comp_desc = composition_prompts.get(composition, composition_prompts['centered'])
@@ -1,26 +1,51 @@
 import os
 import uuid
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Iterator
 from pathlib import Path
 
 # LangChain imports
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_chroma import Chroma
 from langchain.chains import RetrievalQA
 from langchain.schema import Document
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_community.document_loaders import TextLoader
 from langchain_community.document_loaders.word_document import UnstructuredWordDocumentLoader
-import logging
 
-# 配置日誌
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from .metadata_store import JournaledJSONStore
+from .session_index import SessionIndexCache
+from .pdf_loader import ParallelPDFLoader
+from .llm_gateway import get_llm_gateway
+from .usage_tracker import UsageTracker
+from ..models.usage_tracking import TokenUsage, calculate_gemini_cost
+from .metrics import EMBEDDING_SECONDS, VECTOR_STORE_SECONDS, BACKGROUND_QUEUE_DEPTH
+from .tracing import Trace, start_trace
+from .structured_logging import get_logger
+
+# 日誌由應用程式統一設定（services/structured_logging.py）
+logger = get_logger(__name__)
 
 # 全局變量緩存 embedding 模型
 _cached_embeddings = None
 
+
+class TimedEmbeddings(Embeddings):
+    """記錄嵌入耗時的 Embeddings 包裝"""
+    
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with EMBEDDING_SECONDS.time(operation="documents"):
+            return self.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        with EMBEDDING_SECONDS.time(operation="query"):
+            return self.embeddings.embed_query(text)
+
 class RAGService:
     """完整的RAG服務實現"""
     
@@ -33,20 +58,23 @@ class RAGService:
         # 使用緩存的 embedding 模型
         global _cached_embeddings
         if _cached_embeddings is None:
-            print("Initializing embedding model (first time)...")
-            _cached_embeddings = HuggingFaceEmbeddings(
+            logger.info("Initializing embedding model (first time)...")
+            _cached_embeddings = TimedEmbeddings(HuggingFaceEmbeddings(
                 model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            )
+            ))
         else:
-            print("Using cached embedding model...")
+            logger.info("Using cached embedding model...")
         self.embeddings = _cached_embeddings
         
+        self.llm_model_name = "gemini-2.5-flash"  # 使用更穩定的模型
         self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",  # 使用更穩定的模型
+            model=self.llm_model_name,
             google_api_key=api_key,
             temperature=0.1,  # 降低溫度提高準確性
             max_tokens=2048
         )
+        # 所有 LLM 呼叫經由共享閘道（並行上限、逾時、重試）
+        self.gateway = get_llm_gateway()
         
         # 針對考古題優化的文本分割器
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -64,39 +92,62 @@ class RAGService:
         self.upload_dir = Path("./local_uploads")
         self.upload_dir.mkdir(exist_ok=True)
         
+        # 串流索引設定：每批嵌入的片段數與同時在途的批次上限
+        self.index_batch_size = 64
+        self.max_in_flight_batches = 2
+        self._indexing_tasks = set()
+        
+        # 摘要快取：文檔摘要存於文檔元數據，會話摘要以文檔組合為鍵
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+        self._session_summaries: Dict[tuple, Dict[str, Any]] = {}
+        
+        # map-reduce 摘要設定：每組字數上限與同時呼叫 LLM 的上限
+        self.summary_group_chars = 8000
+        # 分層摘要的最大輪數，避免部分摘要未縮短時無限呼叫 LLM
+        self.summary_max_depth = 4
+        self._summary_semaphore = asyncio.Semaphore(4)
+        
         # 文檔管理 - 持久化存儲
         self.documents: Dict[str, Dict] = {}
         self.doc_metadata_file = self.vector_store_path / "document_metadata.json"
+        self._doc_store = JournaledJSONStore(self.doc_metadata_file)
         
         # 會話管理
         self.sessions: Dict[str, Dict] = {}  # session_id -> {"active_docs": [doc_ids], "created_at": timestamp}
         self.session_metadata_file = self.vector_store_path / "session_metadata.json"
+        self._session_store = JournaledJSONStore(self.session_metadata_file)
         
         # 初始化向量庫
         self.vector_store = None
         self._init_vector_store()
+        self.session_index = SessionIndexCache(lambda: self.vector_store._collection)
         self._load_document_metadata()
         self._load_session_metadata()
         
         # Token 統計
         self.total_tokens = {"input": 0, "output": 0, "cost": 0.0}
+        self._token_store = JournaledJSONStore(self.vector_store_path / "token_stats.json")
         self._load_token_stats()
         
-        print(f"RAG Service ready: {len(self.documents)} docs, {len(self.sessions)} sessions")
+        # 背景佇列深度（輸出指標時才計算）
+        BACKGROUND_QUEUE_DEPTH.set_function(lambda: len(self._indexing_tasks), queue="rag_indexing")
+        BACKGROUND_QUEUE_DEPTH.set_function(lambda: len(self._summary_tasks), queue="rag_summary")
+        
+        logger.info(f"RAG Service ready: {len(self.documents)} docs, {len(self.sessions)} sessions")
     
     def _init_vector_store(self):
         """初始化向量數據庫"""
         try:
-            print("Connecting to vector store...")
+            logger.info("Connecting to vector store...")
             self.vector_store = Chroma(
                 collection_name="rag_documents",
                 persist_directory=str(self.vector_store_path),
                 embedding_function=self.embeddings
             )
             count = self.vector_store._collection.count()
-            print(f"Vector store ready with {count} vectors")
+            logger.info(f"Vector store ready with {count} vectors")
         except Exception as e:
-            print(f"Vector store error: {e}, creating new...")
+            logger.error(f"Vector store error: {e}, creating new...")
             self.vector_store = Chroma(
                 collection_name="rag_documents",
                 persist_directory=str(self.vector_store_path),
@@ -106,71 +157,63 @@ class RAGService:
     def _load_document_metadata(self):
         """加載文檔元數據"""
         try:
-            if self.doc_metadata_file.exists():
-                import json
-                with open(self.doc_metadata_file, 'r', encoding='utf-8') as f:
-                    self.documents = json.load(f)
-                print(f"Loaded metadata for {len(self.documents)} documents")
+            self.documents = self._doc_store.load()
+            logger.info(f"Loaded metadata for {len(self.documents)} documents")
         except Exception as e:
-            print(f"Failed to load document metadata: {e}")
+            logger.error(f"Failed to load document metadata: {e}")
             self.documents = {}
     
-    def _save_document_metadata(self):
-        """保存文檔元數據"""
+    def _save_document_metadata(self, doc_id: str = None):
+        """保存文檔元數據（寫入 journal，快照由背景防抖寫入）"""
         try:
-            import json
-            with open(self.doc_metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(self.documents, f, ensure_ascii=False, indent=2)
+            if doc_id is None:
+                self._doc_store.replace(self.documents)
+            elif doc_id in self.documents:
+                self._doc_store.set(doc_id, self.documents[doc_id])
+            else:
+                self._doc_store.delete(doc_id)
         except Exception as e:
-            print(f"Failed to save document metadata: {e}")
+            logger.error(f"Failed to save document metadata: {e}")
     
     def _load_session_metadata(self):
         """加載會話元數據"""
         try:
-            if self.session_metadata_file.exists():
-                import json
-                with open(self.session_metadata_file, 'r', encoding='utf-8') as f:
-                    self.sessions = json.load(f)
+            self.sessions = self._session_store.load()
         except Exception as e:
-            print(f"Failed to load session metadata: {e}")
+            logger.error(f"Failed to load session metadata: {e}")
             self.sessions = {}
     
-    def _save_session_metadata(self):
-        """保存會話元數據"""
+    def _save_session_metadata(self, session_id: str = None):
+        """保存會話元數據（寫入 journal，快照由背景防抖寫入）"""
         try:
-            import json
-            with open(self.session_metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(self.sessions, f, ensure_ascii=False, indent=2)
+            if session_id is None:
+                self._session_store.replace(self.sessions)
+            elif session_id in self.sessions:
+                self._session_store.set(session_id, self.sessions[session_id])
+            else:
+                self._session_store.delete(session_id)
         except Exception as e:
-            print(f"Failed to save session metadata: {e}")
+            logger.error(f"Failed to save session metadata: {e}")
     
     def _load_token_stats(self):
         """加載 token 統計"""
         try:
-            token_file = self.vector_store_path / "token_stats.json"
-            if token_file.exists():
-                import json
-                with open(token_file, 'r', encoding='utf-8') as f:
-                    self.total_tokens = json.load(f)
+            data = self._token_store.load()
+            if data:
+                self.total_tokens = data
         except Exception as e:
-            print(f"Failed to load token stats: {e}")
+            logger.error(f"Failed to load token stats: {e}")
     
     def _save_token_stats(self):
         """保存 token 統計"""
         try:
-            import json
-            token_file = self.vector_store_path / "token_stats.json"
-            with open(token_file, 'w', encoding='utf-8') as f:
-                json.dump(self.total_tokens, f, ensure_ascii=False, indent=2)
+            self._token_store.replace(self.total_tokens)
         except Exception as e:
-            print(f"Failed to save token stats: {e}")
+            logger.error(f"Failed to save token stats: {e}")
     
     def _calculate_cost(self, input_tokens: int, output_tokens: int) -> float:
         """計算 Gemini API 費用"""
-        # Gemini 1.5 Pro 價格 (USD per 1M tokens)
-        input_price = 1.25 / 1000000  # $1.25 per 1M input tokens
-        output_price = 5.00 / 1000000  # $5.00 per 1M output tokens
-        return (input_tokens * input_price) + (output_tokens * output_price)
+        return calculate_gemini_cost(TokenUsage(input_tokens=input_tokens, output_tokens=output_tokens)).total_cost
     
     def _update_token_stats(self, input_tokens: int, output_tokens: int):
         """更新 token 統計"""
@@ -181,10 +224,23 @@ class RAGService:
         self._save_token_stats()
         return cost
     
+    def _record_llm_usage(self, prompt: str, response: Any):
+        """依回應的 usage_metadata 記錄實際 token 用量，缺少時退回字元數估算"""
+        usage = UsageTracker.extract_token_usage_from_response(response, "text")
+        content = response.content if hasattr(response, 'content') else str(response)
+        input_tokens = usage.input_tokens or len(prompt) // 4
+        output_tokens = usage.output_tokens or len(content) // 4
+        cost = self._update_token_stats(input_tokens, output_tokens)
+        return input_tokens, output_tokens, cost
+    
     def _load_document(self, file_path: str, content_type: str) -> List[Document]:
         """根據文件類型加載文檔"""
+        return list(self._iter_document_pages(file_path, content_type))
+    
+    def _iter_document_pages(self, file_path: str, content_type: str) -> Iterator[Document]:
+        """根據文件類型逐頁產出文檔（PDF 以進程池按頁並行解析）"""
         if content_type == "application/pdf":
-            loader = PyPDFLoader(file_path)
+            loader = ParallelPDFLoader(file_path)
         elif content_type == "text/plain":
             loader = TextLoader(file_path, encoding='utf-8')
         elif content_type in ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
@@ -192,10 +248,13 @@ class RAGService:
         else:
             raise ValueError(f"不支援的文件類型: {content_type}")
         
-        return loader.load()
+        return loader.lazy_load()
     
-    async def add_document(self, file_content: bytes, filename: str, content_type: str) -> str:
-        """添加文檔到RAG系統"""
+    async def add_document(self, file_content: bytes, filename: str, content_type: str, wait: bool = True) -> str:
+        """添加文檔到RAG系統
+        
+        wait=False 時立即返回 doc_id，索引在背景進行；已寫入的批次可以立即被查詢。
+        """
         doc_id = str(uuid.uuid4())
         file_path = self.upload_dir / f"{doc_id}_{filename}"
         
@@ -211,61 +270,115 @@ class RAGService:
             "content_type": content_type,
             "file_path": str(file_path),
             "status": "processing",
+            "chunks_indexed": 0,
             "upload_time": datetime.now().isoformat()
         }
+        self._save_document_metadata(doc_id)
         
+        if wait:
+            await self._index_document(doc_id, str(file_path), filename, content_type)
+        else:
+            task = asyncio.create_task(self._index_document(doc_id, str(file_path), filename, content_type))
+            self._indexing_tasks.add(task)
+            task.add_done_callback(self._indexing_tasks.discard)
+        return doc_id
+    
+    async def _index_document(self, doc_id: str, file_path: str, filename: str, content_type: str):
+        """串流式索引：逐頁加載 → 分割 → 批次嵌入寫入，同時在途的批次數量有上限，記憶體佔用不隨文件大小增長"""
+        in_flight = set()
         try:
-            # 使用LangChain文檔加載器處理不同文件類型
-            documents = self._load_document(str(file_path), content_type)
-            
-            # 文本分割
-            chunks = self.text_splitter.split_documents(documents)
-            
-            # 為每個chunk添加metadata（保留原有的頁碼信息）
-            for i, chunk in enumerate(chunks):
-                chunk.metadata.update({
-                    "doc_id": doc_id,
-                    "filename": filename,
-                    "content_type": content_type,
-                    "chunk_index": i  # 添加chunk索引
-                })
-                # 保留原有頁碼或估算頁碼
-                if 'page' not in chunk.metadata:
-                    if content_type == "application/pdf":
-                        # 根據原始文檔頁數估算
-                        estimated_page = max(1, i // 3 + 1)  # 每3個chunk約為1頁
-                        chunk.metadata['page'] = estimated_page
-                    else:
-                        chunk.metadata['page'] = 1
-            
-            # 添加到向量庫並強制持久化
-            if chunks:
-                # 為每個chunk生成唯一ID
-                chunk_ids = [f"{doc_id}_chunk_{i}" for i in range(len(chunks))]
-                self.vector_store.add_documents(chunks, ids=chunk_ids)
+            pages = self._iter_document_pages(file_path, content_type)
+            batch = []
+            chunk_index = 0
+            
+            while True:
+                # 解析在執行緒中進行，避免阻塞事件循環
+                page = await asyncio.to_thread(next, pages, None)
+                if page is None:
+                    break
                 
-                # 新版ChromaDB自動持久化，無需手動persist()
-                
-                # 驗證添加成功
-                total_count = self.vector_store._collection.count()
-                print(f"Added {len(chunks)} chunks. Total documents in vector store: {total_count}")
-                
-                # 測試檢索功能
-                test_docs = self.vector_store.similarity_search("test", k=1)
-                print(f"Vector store test retrieval returned {len(test_docs)} documents")
+                for chunk in self.text_splitter.split_documents([page]):
+                    # 為每個chunk添加metadata（保留原有的頁碼信息）
+                    chunk.metadata.update({
+                        "doc_id": doc_id,
+                        "filename": filename,
+                        "content_type": content_type,
+                        "chunk_index": chunk_index  # 添加chunk索引
+                    })
+                    # 保留原有頁碼或估算頁碼
+                    if 'page' not in chunk.metadata:
+                        if content_type == "application/pdf":
+                            # 根據原始文檔頁數估算
+                            chunk.metadata['page'] = max(1, chunk_index // 3 + 1)  # 每3個chunk約為1頁
+                        else:
+                            chunk.metadata['page'] = 1
+                    batch.append(chunk)
+                    chunk_index += 1
+                    
+                    if len(batch) >= self.index_batch_size:
+                        in_flight.add(asyncio.create_task(self._upsert_chunks(doc_id, batch)))
+                        batch = []
+                        # 在途批次達到上限時，等待至少一個完成再繼續讀取
+                        if len(in_flight) >= self.max_in_flight_batches:
+                            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                            for task in done:
+                                task.result()
+            
+            if batch:
+                in_flight.add(asyncio.create_task(self._upsert_chunks(doc_id, batch)))
+            if in_flight:
+                done, _ = await asyncio.wait(in_flight)
+                for task in done:
+                    task.result()
+            
+            logger.info(f"Indexed {chunk_index} chunks for document {doc_id}")
             
             # 更新狀態為ready並保存元數據
             self.documents[doc_id]["status"] = "ready"
-            self.documents[doc_id]["chunks_count"] = len(chunks)
-            self._save_document_metadata()
-            return doc_id
+            self.documents[doc_id]["chunks_count"] = chunk_index
+            self._save_document_metadata(doc_id)
+            
+            # 預先生成文檔摘要，之後的摘要與測驗請求直接使用快取
+            if chunk_index:
+                self._schedule_document_summary(doc_id)
             
         except Exception as e:
-            print(f"文檔處理錯誤: {e}")
-            self.documents[doc_id]["status"] = "error"
-            self.documents[doc_id]["error"] = str(e)
-            self._save_document_metadata()
-            return doc_id
+            logger.error(f"文檔處理錯誤: {e}")
+            # 停止仍在途的批次，並移除已寫入的片段，避免失敗的文檔留下可被檢索的部分內容
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            try:
+                await asyncio.to_thread(self._delete_document_chunks, doc_id)
+                self._invalidate_document_caches(doc_id)
+            except Exception as cleanup_error:
+                logger.warning(f"清除失敗文檔的片段時發生錯誤: {cleanup_error}")
+            if doc_id in self.documents:
+                self.documents[doc_id]["status"] = "error"
+                self.documents[doc_id]["error"] = str(e)
+                self.documents[doc_id]["chunks_indexed"] = 0
+                self._save_document_metadata(doc_id)
+    
+    def _delete_document_chunks(self, doc_id: str):
+        """從向量庫刪除文檔的所有片段"""
+        collection = self.vector_store._collection
+        results = collection.get(where={"doc_id": {"$eq": doc_id}})
+        if results['ids']:
+            collection.delete(ids=results['ids'])
+            logger.info(f"Deleted {len(results['ids'])} chunks")
+    
+    async def _upsert_chunks(self, doc_id: str, chunks: List[Document]):
+        """嵌入並寫入一個批次的片段（新版ChromaDB自動持久化）"""
+        chunk_ids = [f"{doc_id}_chunk_{chunk.metadata['chunk_index']}" for chunk in chunks]
+        with VECTOR_STORE_SECONDS.time(operation="upsert"):
+            await asyncio.to_thread(self.vector_store.add_documents, chunks, ids=chunk_ids)
+        
+        # 已寫入的片段立即可被查詢
+        if doc_id in self.documents:
+            self.documents[doc_id]["chunks_indexed"] = self.documents[doc_id].get("chunks_indexed", 0) + len(chunks)
+            self._save_document_metadata(doc_id)
+        self._invalidate_document_caches(doc_id)
     
     def create_session(self, session_id: str = None) -> str:
         """創建新會話或獲取現有會話"""
@@ -282,7 +395,7 @@ class RAGService:
             "created_at": datetime.now().isoformat(),
             "name": f"會話 {session_id}"
         }
-        self._save_session_metadata()
+        self._save_session_metadata(session_id)
         return session_id
     
     def add_document_to_session(self, session_id: str, doc_id: str) -> bool:
@@ -295,8 +408,8 @@ class RAGService:
             return False
         if doc_id not in self.sessions[session_id]["active_docs"]:
             self.sessions[session_id]["active_docs"].append(doc_id)
-            self._save_session_metadata()
-            print(f"Added document {doc_id} to session {session_id}")
+            self._save_session_metadata(session_id)
+            logger.info(f"Added document {doc_id} to session {session_id}")
         return True
     
     def remove_document_from_session(self, session_id: str, doc_id: str) -> bool:
@@ -305,7 +418,7 @@ class RAGService:
             return False
         if doc_id in self.sessions[session_id]["active_docs"]:
             self.sessions[session_id]["active_docs"].remove(doc_id)
-            self._save_session_metadata()
+            self._save_session_metadata(session_id)
         return True
     
     def get_session_documents(self, session_id: str) -> List[str]:
@@ -326,9 +439,20 @@ class RAGService:
             for session_id, session_data in self.sessions.items()
         ]
     
-    async def query_documents(self, question: str, session_id: str = None, k: int = 8) -> Dict[str, Any]:
-        """企業級RAG查詢實現"""
+    async def query_documents(self, question: str, session_id: str = None, k: int = 8, include_timings: bool = False) -> Dict[str, Any]:
+        """企業級RAG查詢實現；include_timings 為 True 時在結果中附上各階段耗時（毫秒）"""
         query_id = str(uuid.uuid4())
+        trace = start_trace("rag.query", query_id=query_id, session_id=session_id, k=k)
+        try:
+            result = await self._query_documents(query_id, question, session_id, k, trace)
+        finally:
+            trace.finish()
+        if include_timings:
+            result["timings"] = trace.timings()
+        return result
+    
+    async def _query_documents(self, query_id: str, question: str, session_id: str, k: int, trace: Trace) -> Dict[str, Any]:
+        """RAG 查詢各階段，每個階段記錄為一個追蹤區段"""
         timestamp = __import__('datetime').datetime.now().isoformat()
         
         try:
@@ -348,8 +472,9 @@ class RAGService:
             
             # 2. 驗證向量庫狀態
             collection = self.vector_store._collection
-            total_docs = collection.count()
-            print(f"[Query {query_id[:8]}] Vector store: {total_docs} total, session docs: {len(active_doc_ids)}")
+            with VECTOR_STORE_SECONDS.time(operation="count"):
+                total_docs = collection.count()
+            logger.debug(f"[Query {query_id[:8]}] Vector store: {total_docs} total, session docs: {len(active_doc_ids)}")
             
             if total_docs == 0:
                 return {
@@ -362,14 +487,24 @@ class RAGService:
                 }
             
             # 3. 增強型多策略檢索 - 確保覆蓋整個文檔
-            doc_filter = {"doc_id": {"$in": active_doc_ids}} if active_doc_ids else None
+            # 有會話時使用會話範圍索引，只在會話文檔的向量中搜尋，避免對全域集合做後置過濾
+            session_index = None
+            query_vector = None
+            if active_doc_ids:
+                with trace.span("session_index", documents=len(active_doc_ids)) as span:
+                    session_index = self.session_index.get(active_doc_ids)
+                    span.set_attribute("chunks", len(session_index))
+                with trace.span("embed"):
+                    query_vector = self.embeddings.embed_query(question)
             
             # 策略1: 相似度搜索（增加檢索數量）
-            similarity_docs = self.vector_store.similarity_search(
-                question, 
-                k=k*2,  # 增加檢索數量
-                filter=doc_filter
-            )
+            with trace.span("retrieve.similarity") as span:
+                if session_index is not None:
+                    similarity_docs = session_index.similarity_search_by_vector(query_vector, k=k*2)
+                else:
+                    with VECTOR_STORE_SECONDS.time(operation="similarity_search"):
+                        similarity_docs = self.vector_store.similarity_search(question, k=k*2)
+                span.set_attribute("results", len(similarity_docs))
             
             # 策略2: 關鍵詞搜索（針對考古題）
             keyword_docs = []
@@ -378,82 +513,85 @@ class RAGService:
                 keywords = re.findall(r'[\u4e00-\u9fff]+', question)
                 if keywords:
                     keyword_query = " ".join(keywords[:3])
-                    keyword_docs = self.vector_store.similarity_search(
-                        keyword_query,
-                        k=k,
-                        filter=doc_filter
-                    )
-                    print(f"[Query {query_id[:8]}] Keyword search with '{keyword_query}' returned {len(keyword_docs)} documents")
+                    with trace.span("retrieve.keyword") as span:
+                        if session_index is not None:
+                            with trace.span("embed"):
+                                keyword_vector = self.embeddings.embed_query(keyword_query)
+                            keyword_docs = session_index.similarity_search_by_vector(keyword_vector, k=k)
+                        else:
+                            with VECTOR_STORE_SECONDS.time(operation="similarity_search"):
+                                keyword_docs = self.vector_store.similarity_search(keyword_query, k=k)
+                        span.set_attribute("results", len(keyword_docs))
+                    logger.debug(f"[Query {query_id[:8]}] Keyword search with '{keyword_query}' returned {len(keyword_docs)} documents")
             except Exception as e:
-                print(f"[Query {query_id[:8]}] Keyword search failed: {e}")
+                logger.warning(f"[Query {query_id[:8]}] Keyword search failed: {e}")
             
             # 策略3: MMR搜索（最大邊際相關性）
             mmr_docs = []
             try:
-                mmr_docs = self.vector_store.max_marginal_relevance_search(
-                    question,
-                    k=k,
-                    fetch_k=k*3,  # 增加候選數量
-                    filter=doc_filter
-                )
-                print(f"[Query {query_id[:8]}] MMR search returned {len(mmr_docs)} documents")
+                with trace.span("retrieve.mmr") as span:
+                    if session_index is not None:
+                        mmr_docs = session_index.max_marginal_relevance_search_by_vector(
+                            query_vector,
+                            k=k,
+                            fetch_k=k*3
+                        )
+                    else:
+                        with VECTOR_STORE_SECONDS.time(operation="mmr_search"):
+                            mmr_docs = self.vector_store.max_marginal_relevance_search(
+                                question,
+                                k=k,
+                                fetch_k=k*3  # 增加候選數量
+                            )
+                    span.set_attribute("results", len(mmr_docs))
+                logger.debug(f"[Query {query_id[:8]}] MMR search returned {len(mmr_docs)} documents")
             except Exception as e:
-                print(f"[Query {query_id[:8]}] MMR search failed: {e}")
+                logger.warning(f"[Query {query_id[:8]}] MMR search failed: {e}")
             
             # 策略4: 基於相似度分數的搜索（降低閾值以包含更多內容）
             score_docs = []
             try:
-                score_docs = self.vector_store.similarity_search_with_score(
-                    question,
-                    k=k*2,
-                    filter=doc_filter
-                )
-                # 只保留文檔，忽略分數
-                score_docs = [doc for doc, score in score_docs]
-                print(f"[Query {query_id[:8]}] Score-based search returned {len(score_docs)} documents")
+                with trace.span("retrieve.score") as span:
+                    if session_index is not None:
+                        score_docs = session_index.similarity_search_with_score_by_vector(query_vector, k=k*2)
+                    else:
+                        with VECTOR_STORE_SECONDS.time(operation="similarity_search"):
+                            score_docs = self.vector_store.similarity_search_with_score(question, k=k*2)
+                    # 只保留文檔，忽略分數
+                    score_docs = [doc for doc, score in score_docs]
+                    span.set_attribute("results", len(score_docs))
+                logger.debug(f"[Query {query_id[:8]}] Score-based search returned {len(score_docs)} documents")
             except Exception as e:
-                print(f"[Query {query_id[:8]}] Score-based search failed: {e}")
+                logger.warning(f"[Query {query_id[:8]}] Score-based search failed: {e}")
             
             # 合併並去重（保持更多樣性）
-            all_docs = similarity_docs + keyword_docs + mmr_docs + score_docs
-            seen_content = set()
-            unique_docs = []
-            for doc in all_docs:
-                content_hash = hash(doc.page_content[:200])  # 增加hash長度提高精確度
-                if content_hash not in seen_content:
-                    seen_content.add(content_hash)
-                    unique_docs.append(doc)
-            
-            # 按頁碼排序（如果有的話）確保覆蓋文檔各部分
-            try:
-                unique_docs.sort(key=lambda x: x.metadata.get('page', 0))
-            except:
-                pass
-            
-            # 策略5: 全文檔檢索（確保覆蓋整個文檔）
-            full_doc_search = []
-            try:
-                collection = self.vector_store._collection
-                for doc_id in active_doc_ids:
-                    results = collection.get(
-                        where={"doc_id": {"$eq": doc_id}},
-                        include=["documents", "metadatas"]
-                    )
-                    if results['documents']:
-                        for content, metadata in zip(results['documents'], results['metadatas']):
-                            doc_obj = Document(page_content=content, metadata=metadata)
-                            full_doc_search.append(doc_obj)
-                print(f"[Query {query_id[:8]}] Full document search returned {len(full_doc_search)} chunks")
-            except Exception as e:
-                print(f"[Query {query_id[:8]}] Full document search failed: {e}")
+            with trace.span("dedup") as span:
+                all_docs = similarity_docs + keyword_docs + mmr_docs + score_docs
+                seen_content = set()
+                unique_docs = []
+                for doc in all_docs:
+                    content_hash = hash(doc.page_content[:200])  # 增加hash長度提高精確度
+                    if content_hash not in seen_content:
+                        seen_content.add(content_hash)
+                        unique_docs.append(doc)
+                
+                # 按頁碼排序（如果有的話）確保覆蓋文檔各部分
+                try:
+                    unique_docs.sort(key=lambda x: x.metadata.get('page', 0))
+                except:
+                    pass
+                span.set_attribute("candidates", len(all_docs))
+                span.set_attribute("unique", len(unique_docs))
             
-
+            # 策略5: 全文檔檢索（確保覆蓋整個文檔），直接取自會話索引中已載入的片段
+            full_doc_search = list(session_index.documents) if session_index is not None else []
+            logger.debug(f"[Query {query_id[:8]}] Full document search returned {len(full_doc_search)} chunks")
             
             # 合併所有結果
             all_docs = similarity_docs + keyword_docs + mmr_docs + score_docs + full_doc_search
             
             docs = unique_docs[:k*4]  # 增加保留文檔數量
-            print(f"[Query {query_id[:8]}] Retrieved {len(docs)} unique documents from {len(all_docs)} total")
+            logger.debug(f"[Query {query_id[:8]}] Retrieved {len(docs)} unique documents from {len(all_docs)} total")
             
             if not docs:
                 return {
@@ -466,19 +604,21 @@ class RAGService:
                 }
             
             # 3. 構建高質量上下文 - 按文件名稱分組
-            file_groups = {}
-            for doc in docs:
-                filename = doc.metadata.get("filename", "未知文件")
-                if filename not in file_groups:
-                    file_groups[filename] = []
-                file_groups[filename].append(doc.page_content)
-            
-            context_parts = []
-            for filename, contents in file_groups.items():
-                combined_content = "\n\n".join(contents)
-                context_parts.append(f"[文件: {filename}]\n{combined_content}")
-            
-            context = "\n\n---\n\n".join(context_parts)
+            with trace.span("context_build") as span:
+                file_groups = {}
+                for doc in docs:
+                    filename = doc.metadata.get("filename", "未知文件")
+                    if filename not in file_groups:
+                        file_groups[filename] = []
+                    file_groups[filename].append(doc.page_content)
+                
+                context_parts = []
+                for filename, contents in file_groups.items():
+                    combined_content = "\n\n".join(contents)
+                    context_parts.append(f"[文件: {filename}]\n{combined_content}")
+                
+                context = "\n\n---\n\n".join(context_parts)
+                span.set_attribute("context_chars", len(context))
             
             # 4. 針對考古題優化的提示詞工程
             prompt = f"""你是一個專業的文檔分析助手，特別擅長處理考試題目和學習資料。請仔細分析提供的文檔內容來回答用戶問題。
@@ -503,18 +643,15 @@ class RAGService:
 ## 回答："""
             
             # 5. LLM生成回答
-            print(f"[Query {query_id[:8]}] Generating answer with {len(context)} characters of context")
-            
-            # 估算 input tokens (簡化計算)
-            input_tokens = len(prompt) // 4  # 簡化估算，1 token 約 4 字元
-            
-            response = self.llm.invoke(prompt)
-            
-            # 估算 output tokens
-            output_tokens = len(response.content) // 4
+            logger.debug(f"[Query {query_id[:8]}] Generating answer with {len(context)} characters of context")
             
-            # 更新 token 統計
-            cost = self._update_token_stats(input_tokens, output_tokens)
+            with trace.span("llm", model=self.llm_model_name) as span:
+                response = await self.gateway.invoke_chat(self.llm, prompt, self.llm_model_name, service_type="rag")
+                
+                # 更新 token 統計
+                input_tokens, output_tokens, cost = self._record_llm_usage(prompt, response)
+                span.set_attribute("input_tokens", input_tokens)
+                span.set_attribute("output_tokens", output_tokens)
             
             # 6. 提取來源信息 - 只顯示主要來源
             sources = []
@@ -535,31 +672,32 @@ class RAGService:
                     })
             
             # 7. 構建響應 - 優化來源預覽
-            source_documents = []
-            for filename, contents in file_groups.items():
-                combined_content = "\n\n".join(contents)
-                
-                # 智能片段提取
-                snippet = self._extract_relevant_snippet(combined_content, question, 200)
-                highlighted = self._highlight_keywords(snippet, question)
-                
-                # 計算相關度分數
-                relevance_score = self._calculate_relevance_score(combined_content, question)
+            with trace.span("snippets", files=len(file_groups)):
+                source_documents = []
+                for filename, contents in file_groups.items():
+                    combined_content = "\n\n".join(contents)
+                    
+                    # 智能片段提取
+                    snippet = self._extract_relevant_snippet(combined_content, question, 200)
+                    highlighted = self._highlight_keywords(snippet, question)
+                    
+                    # 計算相關度分數
+                    relevance_score = self._calculate_relevance_score(combined_content, question)
+                    
+                    source_documents.append({
+                        "snippet": snippet,
+                        "highlighted": highlighted,
+                        "full_content": combined_content,  # 完整內容供展開使用
+                        "metadata": {
+                            "filename": filename,
+                            "chunks_count": len(contents),
+                            "relevance_score": relevance_score,
+                            "expandable": len(combined_content) > 200
+                        }
+                    })
                 
-                source_documents.append({
-                    "snippet": snippet,
-                    "highlighted": highlighted,
-                    "full_content": combined_content,  # 完整內容供展開使用
-                    "metadata": {
-                        "filename": filename,
-                        "chunks_count": len(contents),
-                        "relevance_score": relevance_score,
-                        "expandable": len(combined_content) > 200
-                    }
-                })
-            
-            # 按相關度排序
-            source_documents.sort(key=lambda x: x["metadata"]["relevance_score"], reverse=True)
+                # 按相關度排序
+                source_documents.sort(key=lambda x: x["metadata"]["relevance_score"], reverse=True)
             
             result = {
                 "id": query_id,
@@ -576,14 +714,13 @@ class RAGService:
                 "source_documents": source_documents
             }
             
-            print(f"[Query {query_id[:8]}] Query completed successfully")
+            logger.debug(f"[Query {query_id[:8]}] Query completed successfully")
             return result
             
         except Exception as e:
             error_msg = f"RAG查詢系統錯誤: {str(e)}"
-            print(f"[Query {query_id[:8]}] Error: {error_msg}")
-            import traceback
-            traceback.print_exc()
+            trace.set_status("error")
+            logger.exception(f"[Query {query_id[:8]}] Error: {error_msg}")
             
             return {
                 "id": query_id,
@@ -594,241 +731,312 @@ class RAGService:
                 "source_documents": []
             }
     
-    async def generate_summary(self, session_id: str = None) -> Dict[str, Any]:
-        """生成文檔摘要"""
-        print(f"Generating summary for session: {session_id}")
+    async def generate_summary(self, session_id: str = None, mode: str = "cached") -> Dict[str, Any]:
+        """生成文檔摘要
+        
+        mode="cached": 歸納各文檔於索引時預先生成的摘要
+        mode="full": 對會話中所有片段重新執行 map-reduce 摘要
+        """
+        logger.debug(f"Generating summary for session: {session_id}, mode: {mode}")
         
         # 獲取會話中的文檔
         active_doc_ids = []
         if session_id:
             active_doc_ids = self.get_session_documents(session_id)
-            print(f"Active docs in session {session_id}: {active_doc_ids}")
+            logger.debug(f"Active docs in session {session_id}: {active_doc_ids}")
         
         if not active_doc_ids:
-            print("No active documents found")
+            logger.info("No active documents found")
             return {
                 "summary": "無法生成摘要，請先上傳文檔並添加到會話中。",
                 "key_points": [],
                 "timestamp": __import__('datetime').datetime.now().isoformat()
             }
         
-        doc_filter = {"doc_id": {"$in": active_doc_ids}}
+        from datetime import datetime
         
-        # 獲取會話中所有文檔的完整內容
-        try:
-            collection = self.vector_store._collection
-            all_content = []
-            
-            for doc_id in active_doc_ids:
-                results = collection.get(
-                    where={"doc_id": doc_id},
-                    include=["documents", "metadatas"]
-                )
-                
-                if results['documents']:
-                    filename = results['metadatas'][0].get('filename', 'unknown') if results['metadatas'] else 'unknown'
-                    combined_content = "\n\n".join(results['documents'])
-                    all_content.append(f"=== {filename} ===\n{combined_content}")
-            
-            if not all_content:
-                return {
-                    "summary": "無法生成摘要，文檔內容為空。",
-                    "key_points": [],
-                    "timestamp": __import__('datetime').datetime.now().isoformat()
-                }
-            
-            content = "\n\n" + "="*50 + "\n\n".join(all_content)
-            print(f"Summary generation using {len(content)} characters from {len(all_content)} documents")
-            
-        except Exception as e:
-            print(f"Error getting full document content for summary: {e}")
-            # fallback到原本的方法
-            docs = self.vector_store.similarity_search(
-                "摘要 總結 主要內容", 
-                k=30,
-                filter=doc_filter
-            )
-            
-            if not docs:
+        # 相同文檔組合的摘要直接使用快取
+        cache_key = tuple(sorted(active_doc_ids))
+        if mode == "full":
+            try:
+                chunks = self.session_index.get(active_doc_ids).documents
+                summary_text = await self._map_reduce_summarize([chunk.page_content for chunk in chunks])
+            except Exception as e:
+                logger.error(f"Error generating full summary: {e}")
                 return {
-                    "summary": "無法生成摘要，請先上傳文檔並添加到會話中。",
+                    "summary": f"生成摘要時發生錯誤：{str(e)}",
                     "key_points": [],
-                    "timestamp": __import__('datetime').datetime.now().isoformat()
+                    "timestamp": datetime.now().isoformat()
                 }
-            
-            content = "\n\n".join([doc.page_content for doc in docs])
-        
-        # 大幅限制內容長度
-        if len(content) > 8000:
-            content = content[:8000] + "..."
+            return {
+                "summary": summary_text or "無法生成摘要，文檔內容為空。",
+                "key_points": self._extract_key_points(summary_text),
+                "timestamp": datetime.now().isoformat()
+            }
         
-        prompt = f"請為以下文檔生成摘要：\n\n{content}\n\n請用繁體中文回答，包含：\n1. 主要內容摘要（2-3句話）\n2. 關鍵要點（用 • 開頭，3-5個要點）"
+        if cache_key in self._session_summaries:
+            logger.debug(f"Using cached summary for {len(cache_key)} documents")
+            return dict(self._session_summaries[cache_key], timestamp=datetime.now().isoformat())
         
         try:
-            # 計算 tokens
-            input_tokens = len(prompt) // 4
-            print(f"Invoking LLM for summary with {input_tokens} estimated input tokens")
-            
-            response = self.llm.invoke(prompt)
+            # Map: 各文檔摘要（已快取則直接使用）
+            doc_summaries = await asyncio.gather(*[self._get_document_summary(doc_id) for doc_id in active_doc_ids])
+            doc_summaries = [summary for summary in doc_summaries if summary]
             
-            print(f"Raw response type: {type(response)}")
-            print(f"Raw response: {response}")
+            if not doc_summaries:
+                return {
+                    "summary": "無法生成摘要，文檔內容為空。",
+                    "key_points": [],
+                    "timestamp": datetime.now().isoformat()
+                }
             
-            if hasattr(response, 'content'):
-                summary_text = response.content.strip()
+            if len(doc_summaries) == 1:
+                summary_text = doc_summaries[0]["summary"]
             else:
-                summary_text = str(response).strip()
-            
-            output_tokens = len(summary_text) // 4
-            self._update_token_stats(input_tokens, output_tokens)
-            
-            print(f"Summary text: '{summary_text}'")
-            print(f"Summary length: {len(summary_text)}")
+                # Reduce: 將各文檔摘要歸納為整體摘要
+                combined = "\n\n".join(
+                    f"=== {summary['filename']} ===\n{summary['summary']}" for summary in doc_summaries
+                )
+                prompt = f"以下是多份文檔各自的摘要，請整合為一份整體摘要：\n\n{combined}\n\n請用繁體中文回答，包含：\n1. 主要內容摘要（2-3句話）\n2. 關鍵要點（用 • 開頭，3-5個要點）"
+                logger.debug(f"Reducing {len(doc_summaries)} document summaries ({len(prompt)} characters)")
+                summary_text = await self._invoke_summary_llm(prompt)
             
-            if not summary_text or len(summary_text.strip()) == 0:
+            if not summary_text:
                 return {
                     "summary": "LLM 未返回摘要內容，請重試。可能是內容過長或API問題。",
                     "key_points": [],
-                    "timestamp": __import__('datetime').datetime.now().isoformat()
+                    "timestamp": datetime.now().isoformat()
                 }
             
         except Exception as e:
-            print(f"Error generating summary: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Error generating summary: {e}")
             return {
                 "summary": f"生成摘要時發生錯誤：{str(e)}",
                 "key_points": [],
-                "timestamp": __import__('datetime').datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat()
             }
         
-        key_points = []
-        lines = summary_text.split('\n')
-        for line in lines:
-            if line.strip().startswith('•'):
-                key_points.append(line.strip())
-        
-        from datetime import datetime
         result = {
             "summary": summary_text,
-            "key_points": key_points,
+            "key_points": self._extract_key_points(summary_text),
             "timestamp": datetime.now().isoformat()
         }
+        if all(self.documents.get(doc_id, {}).get("status") == "ready" for doc_id in cache_key):
+            self._session_summaries[cache_key] = result
         
-        print(f"Summary generation completed: {len(key_points)} key points extracted")
+        logger.info(f"Summary generation completed: {len(result['key_points'])} key points extracted")
         return result
     
+    async def _get_document_summary(self, doc_id: str) -> Dict[str, Any]:
+        """獲取單一文檔的快取摘要，尚未生成時立即生成（同一文檔只會生成一次）"""
+        doc_info = self.documents.get(doc_id)
+        if not doc_info:
+            return None
+        if doc_info.get("summary"):
+            return doc_info["summary"]
+        
+        task = self._summary_tasks.get(doc_id)
+        if task is None:
+            task = asyncio.create_task(self._summarize_document(doc_id))
+            self._summary_tasks[doc_id] = task
+            task.add_done_callback(lambda _: self._summary_tasks.pop(doc_id, None))
+        return await task
+    
+    async def _summarize_document(self, doc_id: str) -> Dict[str, Any]:
+        """Map 步驟：為單一文檔生成摘要並存入文檔元數據"""
+        chunks = self.session_index.get([doc_id]).documents
+        if not chunks:
+            return None
+        
+        # 以 map-reduce 覆蓋整份文檔，而不是只取前段內容
+        summary_text = await self._map_reduce_summarize([chunk.page_content for chunk in chunks])
+        if not summary_text:
+            return None
+        
+        from datetime import datetime
+        summary = {
+            "filename": self.documents.get(doc_id, {}).get("filename", "unknown"),
+            "summary": summary_text,
+            "key_points": self._extract_key_points(summary_text),
+            "generated_at": datetime.now().isoformat()
+        }
+        # 仍在索引中的文檔只有部分內容，摘要不寫入快取
+        if self.documents.get(doc_id, {}).get("status") == "ready":
+            self.documents[doc_id]["summary"] = summary
+            self._save_document_metadata(doc_id)
+            logger.info(f"Cached summary for document {doc_id}")
+        return summary
+    
+    def _schedule_document_summary(self, doc_id: str):
+        """索引完成後在背景預先生成文檔摘要"""
+        async def _run():
+            try:
+                await self._get_document_summary(doc_id)
+            except Exception as e:
+                logger.error(f"Background summary failed for {doc_id}: {e}")
+        
+        task = asyncio.create_task(_run())
+        self._indexing_tasks.add(task)
+        task.add_done_callback(self._indexing_tasks.discard)
+    
+    async def _map_reduce_summarize(self, texts: List[str]) -> str:
+        """分層 map-reduce 摘要
+        
+        將片段依字數分組後並行摘要（並行數受 semaphore 限制），
+        部分摘要合併後仍超過單次上限時再分組摘要，直到可以一次產生最終摘要。
+        達到最大輪數或某一輪未減少分組數時，截斷至單次上限直接產生最終摘要。
+        """
+        final_instruction = "請用繁體中文回答，包含：\n1. 主要內容摘要（2-3句話）\n2. 關鍵要點（用 • 開頭，3-5個要點）"
+        groups = self._group_texts(texts, self.summary_group_chars)
+        depth = 0
+        
+        while len(groups) > 1:
+            if depth >= self.summary_max_depth:
+                logger.warning(f"Map-reduce summary reached max depth {depth}, truncating {len(groups)} groups")
+                groups = [self._truncate_groups(groups, self.summary_group_chars)]
+                break
+            depth += 1
+            previous_count = len(groups)
+            logger.debug(f"Map-reduce summary: summarizing {len(groups)} groups")
+            partials = await asyncio.gather(*[
+                self._invoke_summary_llm(
+                    f"請以條列方式摘要以下文檔片段的重點，保留關鍵概念、數據與題目：\n\n{group}\n\n請用繁體中文回答。",
+                    limit_concurrency=True
+                )
+                for group in groups
+            ])
+            groups = self._group_texts([partial for partial in partials if partial], self.summary_group_chars)
+            if len(groups) >= previous_count:
+                # 部分摘要沒有縮短，再摘要一輪也不會收斂
+                logger.warning(f"Map-reduce summary did not shrink ({previous_count} -> {len(groups)} groups), truncating")
+                groups = [self._truncate_groups(groups, self.summary_group_chars)]
+                break
+        
+        if not groups:
+            return ""
+        return await self._invoke_summary_llm(f"請為以下文檔生成摘要：\n\n{groups[0]}\n\n{final_instruction}")
+    
+    @staticmethod
+    def _truncate_groups(groups: List[str], max_chars: int) -> str:
+        """每組保留相同長度的開頭後合併，總長不超過 max_chars，且每組都有內容進入最終摘要"""
+        per_group = max(1, max_chars // len(groups) - 2)
+        return "\n\n".join(group[:per_group] for group in groups)
+    
+    @staticmethod
+    def _group_texts(texts: List[str], max_chars: int) -> List[str]:
+        """將文字依順序合併為不超過 max_chars 的分組（單一過長片段會被切開）"""
+        groups = []
+        current = []
+        current_length = 0
+        for text in texts:
+            for start in range(0, max(len(text), 1), max_chars):
+                piece = text[start:start + max_chars]
+                if current and current_length + len(piece) > max_chars:
+                    groups.append("\n\n".join(current))
+                    current, current_length = [], 0
+                current.append(piece)
+                current_length += len(piece) + 2
+        if current:
+            groups.append("\n\n".join(current))
+        return [group for group in groups if group.strip()]
+    
+    async def _invoke_summary_llm(self, prompt: str, limit_concurrency: bool = False) -> str:
+        """呼叫 LLM 生成摘要並記錄 token"""
+        if limit_concurrency:
+            async with self._summary_semaphore:
+                response = await self.gateway.invoke_chat(self.llm, prompt, self.llm_model_name, service_type="rag")
+        else:
+            response = await self.gateway.invoke_chat(self.llm, prompt, self.llm_model_name, service_type="rag")
+        summary_text = (response.content if hasattr(response, 'content') else str(response)).strip()
+        self._record_llm_usage(prompt, response)
+        return summary_text
+    
+    @staticmethod
+    def _extract_key_points(summary_text: str) -> List[str]:
+        """從摘要文字中提取以 • 開頭的關鍵要點"""
+        return [line.strip() for line in summary_text.split('\n') if line.strip().startswith('•')]
+    
+    def _invalidate_document_caches(self, doc_id: str):
+        """文檔變更後清除相關的檢索索引與會話摘要快取"""
+        self.session_index.invalidate(doc_id)
+        for key in [key for key in self._session_summaries if doc_id in key]:
+            del self._session_summaries[key]
+    
     async def generate_quiz(self, session_id: str = None, num_questions: int = 3) -> Dict[str, Any]:
         """生成測驗題目"""
-        print(f"Generating quiz for session: {session_id}, num_questions: {num_questions}")
+        logger.debug(f"Generating quiz for session: {session_id}, num_questions: {num_questions}")
         
         # 獲取會話中的文檔
         active_doc_ids = []
         if session_id:
             active_doc_ids = self.get_session_documents(session_id)
-            print(f"Active docs in session {session_id}: {active_doc_ids}")
+            logger.debug(f"Active docs in session {session_id}: {active_doc_ids}")
         
         if not active_doc_ids:
-            print("No active documents found for quiz generation")
+            logger.info("No active documents found for quiz generation")
             return {
                 "questions": [],
                 "timestamp": __import__('datetime').datetime.now().isoformat()
             }
         
-        # 獲取會話中所有文檔的完整內容（簡化版）
-        content = ""
+        # 題材取自記憶體中的會話索引（不再逐一查詢向量庫），並涵蓋整份文檔而非前段截斷
+        content_length = 0
+        short_content = ""
         try:
-            collection = self.vector_store._collection
-            print(f"Getting content for doc_ids: {active_doc_ids}")
+            chunks = self.session_index.get(active_doc_ids).documents
+            content_length = sum(len(chunk.page_content.strip()) for chunk in chunks)
+            logger.debug(f"Total content length: {content_length} characters from {len(chunks)} chunks")
             
-            for doc_id in active_doc_ids:
-                print(f"Processing doc_id: {doc_id}")
-                results = collection.get(
-                    where={"doc_id": {"$eq": doc_id}},
-                    include=["documents", "metadatas"]
-                )
-                
-                print(f"Got {len(results.get('documents', []))} chunks for doc {doc_id}")
-                
-                if results.get('documents'):
-                    doc_content = "\n\n".join(results['documents'])
-                    content += doc_content + "\n\n"
-            
-            print(f"Total content length: {len(content)} characters")
-            
-            if len(content.strip()) < 100:
-                print("Fallback: Using similarity search")
-                doc_filter = {"doc_id": {"$in": active_doc_ids}}
-                docs = self.vector_store.similarity_search(
-                    "內容 文字 資料", 
-                    k=50,
-                    filter=doc_filter
-                )
-                content = "\n\n".join([doc.page_content for doc in docs])
-                print(f"Fallback content length: {len(content)} characters")
+            # 隨機選擇連續片段增加多樣性
+            import random
+            window = []
+            if chunks:
+                start = random.randint(0, len(chunks) - 1)
+                for chunk in chunks[start:] + chunks[:start]:
+                    window.append(chunk.page_content)
+                    if sum(len(text) for text in window) >= 3000:
+                        break
+            short_content = "\n\n".join(window)[:3000]
+            
+            # 附上預先生成的文檔摘要作為背景，讓題目兼顧整體重點
+            summaries = [
+                self.documents[doc_id]["summary"]["summary"]
+                for doc_id in active_doc_ids
+                if self.documents.get(doc_id, {}).get("summary")
+            ]
+            if summaries:
+                short_content = "Document overview:\n" + "\n\n".join(summaries) + "\n\nExcerpt:\n" + short_content
             
         except Exception as e:
-            print(f"Error getting document content: {e}")
-            import traceback
-            traceback.print_exc()
-            content = ""
-        
-        # 添加隨機性和時間戳
-        import random
-        import time
-        random_seed = int(time.time() * 1000) % 10000
-        
-        # 限制內容長度
-        if len(content) > 15000:
-            content = content[:15000] + "..."
+            logger.exception(f"Error getting document content: {e}")
         
         # 檢查內容是否足夠生成題目
-        if len(content.strip()) < 100:
-            print(f"Content too short for quiz generation: {len(content.strip())} characters")
-            print(f"Content preview: {content[:200]}...")
+        if content_length < 100:
+            logger.info(f"Content too short for quiz generation: {content_length} characters")
             return {
                 "questions": [],
                 "timestamp": __import__('datetime').datetime.now().isoformat()
             }
         
-        # 隨機選擇內容片段增加多樣性
-        import random
-        import time
-        random.seed(int(time.time()))
-        
-        if len(content) > 5000:
-            # 隨機選擇起始位置
-            max_start = len(content) - 3000
-            start_pos = random.randint(0, max(0, max_start))
-            short_content = content[start_pos:start_pos + 3000]
-        else:
-            short_content = content
-        
-        # 添加隨機性到提示詞
-        random_seed = random.randint(1000, 9999)
-        
         prompt = f"Based on this content, create {num_questions} multiple choice questions. Return only JSON array.\n\nContent:\n{short_content}\n\nFormat: [{{\"question\": \"...\", \"options\": [\"A\", \"B\", \"C\", \"D\"], \"correct_answer\": 0}}]"
         
         try:
-            # 計算 tokens
-            input_tokens = len(prompt) // 4
-            print(f"Invoking LLM for quiz with {input_tokens} estimated input tokens")
+            logger.debug(f"Invoking LLM for quiz with {len(prompt)} characters of prompt")
             
             # 使用主 LLM 實例
-            response = self.llm.invoke(prompt)
+            response = await self.gateway.invoke_chat(self.llm, prompt, self.llm_model_name, service_type="rag")
             
-            print(f"Raw LLM response: '{response.content}'")
-            print(f"Response length: {len(response.content)}")
+            logger.debug(f"Raw LLM response: {response.content[:500]!r}", extra={"sample_rate": 0.1})
+            logger.debug(f"Response length: {len(response.content)}")
             
             if not response.content or len(response.content.strip()) < 10:
-                print("LLM returned empty or very short response")
+                logger.info("LLM returned empty or very short response")
                 return {
                     "questions": [],
                     "timestamp": __import__('datetime').datetime.now().isoformat()
                 }
             
-            output_tokens = len(response.content) // 4
-            self._update_token_stats(input_tokens, output_tokens)
+            self._record_llm_usage(prompt, response)
             
             import json
             import re
@@ -886,10 +1094,10 @@ class RAGService:
                         break
             
             if not questions_data:
-                print(f"Failed to parse JSON from response: {response_text[:300]}")
+                logger.error(f"Failed to parse JSON from response: {response_text[:300]}")
                 questions_data = []
             
-            print(f"Parsed {len(questions_data)} questions from LLM response")
+            logger.debug(f"Parsed {len(questions_data)} questions from LLM response")
             
             questions = [
                 {
@@ -902,9 +1110,7 @@ class RAGService:
             ]
                 
         except Exception as e:
-            print(f"Quiz generation error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Quiz generation error: {e}")
             questions = []
         
         from datetime import datetime
@@ -913,7 +1119,7 @@ class RAGService:
             "timestamp": datetime.now().isoformat()
         }
         
-        print(f"Quiz generation completed: {len(questions)} questions generated")
+        logger.info(f"Quiz generation completed: {len(questions)} questions generated")
         return result
     
     def get_document_info(self, doc_id: str) -> Dict[str, Any]:
@@ -936,7 +1142,7 @@ class RAGService:
             for session_id in list(self.sessions.keys()):
                 if doc_id in self.sessions[session_id].get("active_docs", []):
                     self.sessions[session_id]["active_docs"].remove(doc_id)
-            self._save_session_metadata()
+                    self._save_session_metadata(session_id)
             
             # 2. 刪除物理文件
             if "file_path" in self.documents[doc_id]:
@@ -945,19 +1151,16 @@ class RAGService:
                     file_path.unlink()
             
             # 3. 從向量庫強制刪除
-            collection = self.vector_store._collection
-            results = collection.get(where={"doc_id": {"$eq": doc_id}})
-            if results['ids']:
-                collection.delete(ids=results['ids'])
-                print(f"Deleted {len(results['ids'])} chunks")
+            self._delete_document_chunks(doc_id)
+            self._invalidate_document_caches(doc_id)
             
             # 4. 從元數據刪除
             del self.documents[doc_id]
-            self._save_document_metadata()
+            self._save_document_metadata(doc_id)
             return True
             
         except Exception as e:
-            print(f"Delete error: {e}")
+            logger.error(f"Delete error: {e}")
             return False
     
     def get_vector_store_stats(self) -> Dict[str, Any]:
@@ -1030,6 +1233,8 @@ class RAGService:
             
             # 4. 重新初始化向量庫
             self._init_vector_store()
+            self.session_index.invalidate()
+            self._session_summaries.clear()
             
             # 5. 保存空的元數據
             self._save_document_metadata()
@@ -1048,7 +1253,7 @@ class RAGService:
                 "timestamp": __import__('datetime').datetime.now().isoformat()
             }
     
-    def health_check(self) -> Dict[str, Any]:
+    async def health_check(self) -> Dict[str, Any]:
         """系統健康檢查"""
         health_status = {
             "status": "healthy",
@@ -1063,15 +1268,15 @@ class RAGService:
             
             # 檢查向量庫
             try:
-                count = self.vector_store._collection.count()
+                count = await asyncio.to_thread(self.vector_store._collection.count)
                 health_status["components"]["vector_store"] = f"operational ({count} docs)"
             except Exception as e:
                 health_status["components"]["vector_store"] = f"error: {str(e)}"
                 health_status["status"] = "degraded"
             
-            # 檢查LLM連接
+            # 檢查LLM連接（監控流量不指定 service_type，不計入 token 統計與用量帳本）
             try:
-                test_response = self.llm.invoke("測試")
+                await self.gateway.invoke_chat(self.llm, "測試", self.llm_model_name)
                 health_status["components"]["llm"] = "operational"
             except Exception as e:
                 health_status["components"]["llm"] = f"error: {str(e)}"
@@ -1157,5 +1362,5 @@ class RAGService:
                 return "無法找到相關內容"
                 
         except Exception as e:
-            print(f"Error getting source content: {e}")
+            logger.error(f"Error getting source content: {e}")
             return f"獲取內容時發生錯誤: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from .metrics import VECTOR_STORE_SECONDS
+
+
+class SessionIndex:
+    """會話範圍的檢索索引
+
+    只包含會話中文檔的向量，檢索成本與會話文檔數量成正比，
+    而不是與整個向量庫的大小成正比。距離使用與 Chroma 預設相同的平方 L2 距離。
+    """
+
+    def __init__(self, embeddings: np.ndarray, documents: List[Document]):
+        self.embeddings = embeddings
+        self.documents = documents
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def similarity_search_with_score_by_vector(self, query_vector: Sequence[float], k: int = 4) -> List[Tuple[Document, float]]:
+        """依向量搜尋最相近的文檔片段，回傳 (文檔, 距離)"""
+        if not self.documents:
+            return []
+        distances = self._distances(query_vector)
+        k = min(k, len(self.documents))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(self.documents[i], float(distances[i])) for i in top]
+
+    def similarity_search_by_vector(self, query_vector: Sequence[float], k: int = 4) -> List[Document]:
+        """依向量搜尋最相近的文檔片段"""
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(query_vector, k)]
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        query_vector: Sequence[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5
+    ) -> List[Document]:
+        """最大邊際相關性搜尋（MMR）"""
+        if not self.documents:
+            return []
+        distances = self._distances(query_vector)
+        fetch_k = min(fetch_k, len(self.documents))
+        candidates = np.argsort(distances)[:fetch_k]
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        candidate_vectors = self.embeddings[candidates]
+        query_sim = _cosine_similarity(query[None, :], candidate_vectors)[0]
+        pairwise_sim = _cosine_similarity(candidate_vectors, candidate_vectors)
+
+        selected: List[int] = []
+        remaining = list(range(len(candidates)))
+        while remaining and len(selected) < k:
+            if selected:
+                redundancy = pairwise_sim[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = lambda_mult * query_sim[remaining] - (1 - lambda_mult) * redundancy
+            best = remaining[int(np.argmax(scores))]
+            selected.append(best)
+            remaining.remove(best)
+
+        return [self.documents[candidates[i]] for i in selected]
+
+    def _distances(self, query_vector: Sequence[float]) -> np.ndarray:
+        query = np.asarray(query_vector, dtype=np.float32)
+        diff = self.embeddings - query
+        return np.einsum('ij,ij->i', diff, diff)
+
+
+def _cosine_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a_norm = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b_norm = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return a_norm @ b_norm.T
+
+
+class SessionIndexCache:
+    """按文檔預先載入向量，並快取會話組合後的索引"""
+
+    def __init__(self, collection_getter: Callable[[], Any], max_documents: int = 64, max_sessions: int = 32):
+        self._collection_getter = collection_getter
+        self._max_documents = max_documents
+        self._max_sessions = max_sessions
+        self._documents: "OrderedDict[str, Tuple[np.ndarray, List[Document]]]" = OrderedDict()
+        self._sessions: "OrderedDict[Tuple[str, ...], SessionIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, doc_ids: Sequence[str]) -> SessionIndex:
+        """取得指定文檔集合的索引"""
+        key = tuple(sorted(set(doc_ids)))
+        with self._lock:
+            index = self._sessions.get(key)
+            if index is not None:
+                self._sessions.move_to_end(key)
+                return index
+
+            vectors: List[np.ndarray] = []
+            documents: List[Document] = []
+            for doc_id in key:
+                doc_vectors, doc_chunks = self._get_document(doc_id)
+                if len(doc_chunks):
+                    vectors.append(doc_vectors)
+                    documents.extend(doc_chunks)
+
+            embeddings = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+            index = SessionIndex(embeddings, documents)
+            self._sessions[key] = index
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+            return index
+
+    def invalidate(self, doc_id: Optional[str] = None):
+        """文檔內容變更後清除快取；未指定 doc_id 時全部清除"""
+        with self._lock:
+            if doc_id is None:
+                self._documents.clear()
+                self._sessions.clear()
+                return
+            self._documents.pop(doc_id, None)
+            for key in [key for key in self._sessions if doc_id in key]:
+                del self._sessions[key]
+
+    def _get_document(self, doc_id: str) -> Tuple[np.ndarray, List[Document]]:
+        cached = self._documents.get(doc_id)
+        if cached is not None:
+            self._documents.move_to_end(doc_id)
+            return cached
+
+        with VECTOR_STORE_SECONDS.time(operation="get"):
+            results = self._collection_getter().get(
+                where={"doc_id": {"$eq": doc_id}},
+                include=["embeddings", "documents", "metadatas"]
+            )
+        # 新版 Chroma 以 numpy 陣列回傳 embeddings，不能直接用 `or` 判斷
+        embeddings = results.get('embeddings')
+        if embeddings is None:
+            embeddings = []
+        rows = list(zip(embeddings, results.get('documents') or [], results.get('metadatas') or []))
+        rows.sort(key=lambda row: (row[2] or {}).get('chunk_index', 0))
+
+        chunks = [Document(page_content=content, metadata=metadata or {}) for _, content, metadata in rows]
+        vectors = np.asarray([row[0] for row in rows], dtype=np.float32)
+        if not rows:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+
+        self._documents[doc_id] = (vectors, chunks)
+        while len(self._documents) > self._max_documents:
+            self._documents.popitem(last=False)
+        return vectors, chunks
@@ -0,0 +1,115 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+# LogRecord 的內建屬性，其餘透過 extra 傳入的欄位會輸出成結構化欄位
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """將日誌輸出為單行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """開發用的易讀格式，extra 欄位以 key=value 附在訊息後"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = [
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RESERVED_ATTRS and not key.startswith("_")
+        ]
+        return f"{text} {' '.join(fields)}" if fields else text
+
+
+class SamplingFilter(logging.Filter):
+    """依取樣率丟棄高頻日誌
+
+    呼叫端可用 extra={"sample_rate": 0.01} 指定單筆日誌的取樣率；
+    未指定時 DEBUG 日誌套用 debug_sample_rate，WARNING 以上一律保留。
+    """
+
+    def __init__(self, debug_sample_rate: float = 1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self.debug_sample_rate if record.levelno <= logging.DEBUG else 1.0
+        return rate >= 1.0 or random.random() < rate
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None, debug_sample_rate: Optional[float] = None):
+    """設定根 logger：請求執行緒只把紀錄放進佇列，由背景執行緒格式化並寫出
+
+    - LOG_LEVEL：日誌等級（預設 INFO）
+    - LOG_FORMAT：json 或 text（預設 text）
+    - LOG_DEBUG_SAMPLE_RATE：DEBUG 日誌取樣率（預設 1.0）
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止背景寫出執行緒並寫出佇列中剩餘的日誌"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """獲取 logger"""
+    return logging.getLogger(name)
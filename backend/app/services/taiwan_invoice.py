@@ -0,0 +1,195 @@
+import base64
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 統一發票字軌：兩個英文字母 + 八位數字（常印成 AB-12345678）
+INVOICE_NUMBER_PATTERN = re.compile(r"\b([A-Z]{2})[\s-]?(\d{8})\b")
+ROC_DATE_PATTERN = re.compile(r"(?<!\d)(1\d{2})\s*[年/.\-]\s*(\d{1,2})\s*[月/.\-]\s*(\d{1,2})")
+WESTERN_DATE_PATTERN = re.compile(r"(?<!\d)(20\d{2})\s*[年/.\-]\s*(\d{1,2})\s*[月/.\-]\s*(\d{1,2})")
+TAX_ID_PATTERN = re.compile(r"(?:賣方|統一編號|統編|營業人統編)[^\d\n]{0,6}(\d{8})")
+AMOUNT_NUMBER = r"(?:NT\$|\$)?\s*([\d,]+(?:\.\d{1,2})?)"
+TOTAL_PATTERN = re.compile(r"(?:總計|合計|總金額|應付金額|總額|TOTAL)[^\d\n]{0,6}" + AMOUNT_NUMBER, re.IGNORECASE)
+TAX_PATTERN = re.compile(r"(?:稅額|營業稅)[^\d\n]{0,6}" + AMOUNT_NUMBER)
+NET_PATTERN = re.compile(r"(?:銷售額|未稅金額|未稅)[^\d\n]{0,6}" + AMOUNT_NUMBER)
+VENDOR_PATTERN = re.compile(r"^\s*(.{2,40}?(?:股份有限公司|有限公司|公司|商行|商店|企業社|門市|店))\s*$", re.MULTILINE)
+
+# 電子發票證明聯左側 QR Code 前 77 碼：字軌號碼(10) 民國日期(7) 隨機碼(4)
+# 銷售額(8, 16 進位) 總計額(8, 16 進位) 買方統編(8) 賣方統編(8) 加密驗證(24)
+EINVOICE_QR_PATTERN = re.compile(
+    r"^([A-Z]{2}\d{8})(\d{3})(\d{2})(\d{2})(\d{4})([0-9A-Fa-f]{8})([0-9A-Fa-f]{8})(\d{8})(\d{8})"
+)
+EINVOICE_QR_HEADER_LENGTH = 77
+# 右側 QR Code 以 ** 開頭，接續左側未放完的品項
+EINVOICE_QR_CONTINUATION = "**"
+
+# 依商家名稱與品項關鍵字推測費用類別
+CATEGORY_KEYWORDS = (
+    ("交通", ("加油", "中油", "台塑石油", "停車", "高鐵", "台鐵", "客運", "計程車", "捷運", "悠遊卡", "ETC")),
+    ("住宿", ("飯店", "旅館", "酒店", "民宿", "旅店", "住宿")),
+    ("通訊", ("中華電信", "台灣大哥大", "遠傳", "電信", "網路費")),
+    ("水電", ("台灣電力", "台電", "自來水", "瓦斯", "電費", "水費")),
+    ("辦公用品", ("文具", "影印", "辦公", "書局", "紙品", "碳粉")),
+    ("維修", ("維修", "保養", "修理", "汽車材料")),
+    ("保險", ("保險", "產險", "壽險")),
+    ("餐飲", ("餐", "飲", "咖啡", "食品", "便當", "麵", "飯", "小吃", "烘焙", "麥當勞", "星巴克", "超商", "7-ELEVEN", "全家"))
+)
+
+# 各欄位對信心分數的權重
+FIELD_WEIGHTS = {"invoice_number": 0.3, "invoice_date": 0.2, "total_amount": 0.3, "vendor_tax_id": 0.2}
+
+
+def is_valid_tax_id(tax_id: str) -> bool:
+    """檢查營利事業統一編號的檢查碼（2023 年起改為可被 5 整除）"""
+    if not re.fullmatch(r"\d{8}", tax_id or ""):
+        return False
+    weights = (1, 2, 1, 2, 1, 2, 4, 1)
+    total = 0
+    for digit, weight in zip(tax_id, weights):
+        product = int(digit) * weight
+        total += product // 10 + product % 10
+    if total % 5 == 0:
+        return True
+    # 第七碼為 7 時，乘積 28 可取 2+8=10 的十位數 1 或個位數 0
+    return tax_id[6] == "7" and (total + 1) % 5 == 0
+
+
+def _parse_amount(value: str) -> Optional[float]:
+    try:
+        return float(value.replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _parse_date(text: str) -> Optional[str]:
+    for pattern, year_offset in ((WESTERN_DATE_PATTERN, 0), (ROC_DATE_PATTERN, 1911)):
+        for match in pattern.finditer(text):
+            year, month, day = (int(part) for part in match.groups())
+            try:
+                return datetime(year + year_offset, month, day).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+    return None
+
+
+def _last_amount(pattern: re.Pattern, text: str) -> Optional[float]:
+    # 小計、總計可能出現多次，取最後一個（通常是最終金額）
+    matches = pattern.findall(text)
+    return _parse_amount(matches[-1]) if matches else None
+
+
+def guess_category(text: str) -> str:
+    for category, keywords in CATEGORY_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return category
+    return "其他"
+
+
+def extract_fields(text: str) -> Tuple[Dict[str, Any], float]:
+    """以規則從 OCR 文字擷取統一發票欄位，回傳 (欄位, 信心分數 0~1)
+
+    信心分數依擷取到的關鍵欄位加權計算，並以金額勾稽（未稅 + 稅額 = 總計）與統編檢查碼驗證。
+    """
+    normalized = text.replace("：", ":").replace("＄", "$")
+    data: Dict[str, Any] = {
+        "invoice_number": None,
+        "invoice_date": _parse_date(normalized),
+        "vendor_name": None,
+        "vendor_tax_id": None,
+        "total_amount": _last_amount(TOTAL_PATTERN, normalized),
+        "tax_amount": _last_amount(TAX_PATTERN, normalized),
+        "net_amount": _last_amount(NET_PATTERN, normalized),
+        "category": None
+    }
+
+    number_match = INVOICE_NUMBER_PATTERN.search(normalized)
+    if number_match:
+        data["invoice_number"] = "".join(number_match.groups())
+
+    for candidate in TAX_ID_PATTERN.findall(normalized):
+        if is_valid_tax_id(candidate):
+            data["vendor_tax_id"] = candidate
+            break
+
+    vendor_match = VENDOR_PATTERN.search(normalized)
+    if vendor_match:
+        data["vendor_name"] = vendor_match.group(1).strip()
+
+    data["category"] = guess_category(normalized)
+
+    confidence = sum(weight for field, weight in FIELD_WEIGHTS.items() if data.get(field))
+
+    total, tax, net = data["total_amount"], data["tax_amount"], data["net_amount"]
+    if total is not None and tax is not None and net is not None:
+        if abs(net + tax - total) <= 1:
+            confidence = min(1.0, confidence + 0.1)
+        else:
+            # 金額互相矛盾，代表至少一個數字辨識錯誤
+            confidence -= 0.3
+    if tax is None:
+        data["tax_amount"] = 0.0
+    if net is None and total is not None:
+        data["net_amount"] = total - data["tax_amount"]
+
+    return data, max(0.0, round(confidence, 2))
+
+
+def _parse_qr_items(fields: List[str]) -> List[Dict[str, Any]]:
+    """品項依序為 品名:數量:單價，欄位不完整或數字無法解析時略過"""
+    items = []
+    for i in range(0, len(fields) - 2, 3):
+        name, quantity, unit_price = fields[i:i + 3]
+        quantity_value, price_value = _parse_amount(quantity), _parse_amount(unit_price)
+        if not name or quantity_value is None or price_value is None:
+            continue
+        items.append({
+            "description": name,
+            "quantity": quantity_value,
+            "unit_price": price_value,
+            "amount": round(quantity_value * price_value, 2)
+        })
+    return items
+
+
+def parse_einvoice_qr(payloads: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """解析電子發票證明聯的 QR Code 內容，回傳與 OCR 相同格式的欄位；沒有有效的左側 QR Code 時回傳 None
+
+    payloads 為同一張圖片上解碼出的所有 QR Code 字串（順序不拘）。
+    """
+    left = next((payload for payload in payloads if EINVOICE_QR_PATTERN.match(payload)), None)
+    if left is None:
+        return None
+    (invoice_number, roc_year, month, day, _random_code, net_hex, total_hex,
+     _buyer_id, seller_id) = EINVOICE_QR_PATTERN.match(left).groups()
+    try:
+        invoice_date = datetime(int(roc_year) + 1911, int(month), int(day)).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+    net_amount = float(int(net_hex, 16))
+    total_amount = float(int(total_hex, 16))
+
+    # 77 碼之後為 :營業人自行使用區(10):QR 內記載品項數:交易品項總數:編碼(0 Big5 / 1 UTF-8 / 2 Base64):品項...
+    extra = left[EINVOICE_QR_HEADER_LENGTH:].split(":")
+    item_text = ":".join(extra[5:])
+    right = next((payload for payload in payloads if payload.startswith(EINVOICE_QR_CONTINUATION)), None)
+    if right is not None:
+        item_text = ":".join(part for part in (item_text, right[len(EINVOICE_QR_CONTINUATION):].lstrip(":")) if part)
+    if len(extra) > 4 and extra[4] == "2":
+        try:
+            item_text = base64.b64decode(item_text).decode("utf-8")
+        except ValueError:
+            item_text = ""
+    items = _parse_qr_items(item_text.split(":")) if item_text else []
+
+    return {
+        "invoice_number": invoice_number,
+        "invoice_date": invoice_date,
+        "vendor_name": None,
+        "vendor_tax_id": seller_id if is_valid_tax_id(seller_id) else None,
+        "total_amount": total_amount,
+        "tax_amount": round(total_amount - net_amount, 2),
+        "net_amount": net_amount,
+        "category": guess_category(" ".join(item["description"] for item in items)),
+        "items": items
+    }
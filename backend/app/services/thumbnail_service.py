@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# 縮圖尺寸（長邊像素）：列表用小縮圖、詳情用預覽圖
+THUMBNAIL_SIZES = {"thumbnail": 320, "preview": 1280}
+THUMBNAIL_DIR = "./invoice_uploads/thumbnails"
+THUMBNAIL_URL_PREFIX = "/api/invoice/thumbnails/"
+# 檔名即內容雜湊，內容不變網址就不變，可長期快取
+THUMBNAIL_NAME_PATTERN = re.compile(r"^[0-9a-f]{16}\.jpg$")
+
+
+def render_thumbnails(source_path: str, output_dir: str, sizes: Dict[str, int], quality: int = 80) -> Dict[str, str]:
+    """產生各尺寸縮圖，以內容雜湊命名，回傳 {尺寸名稱: 檔名}
+
+    在子進程中執行，只接受與回傳可序列化的參數。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    result = {}
+    with Image.open(source_path) as image:
+        # JPEG 直接以接近目標的解析度解碼
+        image.draft("RGB", (max(sizes.values()), max(sizes.values())))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+            data = buffer.getvalue()
+
+            filename = f"{hashlib.sha256(data).hexdigest()[:16]}.jpg"
+            path = os.path.join(output_dir, filename)
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            result[name] = filename
+    return result
+
+
+class ThumbnailService:
+    """在進程池中產生發票縮圖，不佔用事件迴圈"""
+
+    def __init__(self, output_dir: str = THUMBNAIL_DIR, sizes: Dict[str, int] = None, workers: int = 1):
+        self.output_dir = output_dir
+        self.sizes = sizes or THUMBNAIL_SIZES
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def generate(self, image_path: str) -> Optional[Dict[str, str]]:
+        """回傳 {尺寸名稱: 網址}；失敗時回傳 None（前端改用原圖）"""
+        loop = asyncio.get_running_loop()
+        try:
+            filenames = await loop.run_in_executor(
+                self._get_executor(), render_thumbnails, image_path, self.output_dir, self.sizes
+            )
+        except Exception as e:
+            logger.warning(f"Thumbnail generation failed: {e}", extra={"image_path": image_path})
+            return None
+        return {name: THUMBNAIL_URL_PREFIX + filename for name, filename in filenames.items()}
+
+    def path_for(self, filename: str) -> Optional[str]:
+        """由檔名取得縮圖路徑；檔名格式不符時回傳 None（避免路徑穿越）"""
+        if not THUMBNAIL_NAME_PATTERN.match(filename):
+            return None
+        return os.path.join(self.output_dir, filename)
+
+    def remove(self, url: Optional[str]):
+        if not url or not url.startswith(THUMBNAIL_URL_PREFIX):
+            return
+        path = self.path_for(url[len(THUMBNAIL_URL_PREFIX):])
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 全局實例
+_thumbnail_service = None
+
+def get_thumbnail_service() -> ThumbnailService:
+    """獲取全局縮圖服務"""
+    global _thumbnail_service
+    if _thumbnail_service is None:
+        _thumbnail_service = ThumbnailService(
+            workers=int(os.getenv("INVOICE_THUMBNAIL_WORKERS", "1"))
+        )
+    return _thumbnail_service
@@ -1,101 +1,176 @@
-import json
+import os
+import time
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, List, Optional
+
+from ..models.usage_tracking import TokenUsage, calculate_gemini_cost
+from .append_log import AppendLog
+from .usage_ledger import get_usage_ledger
+
+# 各服務累計的數值欄位；max_latency_ms 取最大值，其餘相加
+_SERVICE_FIELDS = ("input", "output", "cost", "audio_input", "image_count", "calls", "latency_ms")
+_TOTAL_FIELDS = ("input", "output", "cost")
+
+
+def _empty_stats() -> Dict[str, Any]:
+    return {"total": {field: 0 for field in _TOTAL_FIELDS}, "services": {}}
+
+
+def _merge_stats(target: Dict[str, Any], delta: Dict[str, Any]):
+    """將增量統計合併到 target"""
+    for field in _TOTAL_FIELDS:
+        target["total"][field] = target["total"].get(field, 0) + delta.get("total", {}).get(field, 0)
+    for service, values in delta.get("services", {}).items():
+        stats = target["services"].setdefault(service, {})
+        for field in _SERVICE_FIELDS:
+            if field in values:
+                stats[field] = stats.get(field, 0) + values[field]
+        if "max_latency_ms" in values:
+            stats["max_latency_ms"] = max(stats.get("max_latency_ms", 0.0), values["max_latency_ms"])
+
+
+def _coalesce(deltas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把多筆增量合併成一行日誌"""
+    merged = _empty_stats()
+    for delta in deltas:
+        _merge_stats(merged, delta)
+    return [{"ts": time.time(), "pid": os.getpid(), **merged}]
+
 
 class TokenService:
-    """全局 Token 統計服務"""
-    
-    def __init__(self):
+    """全局 Token 統計服務
+
+    記錄使用量只更新記憶體中的緩衝，不在請求路徑上寫檔：
+    - 背景執行緒定期把累加的增量追加到 append-only 日誌（token_stats_global.json.log）
+    - 日誌過大時在跨進程檔案鎖下壓縮回快照（token_stats_global.json）
+    - 讀取統計時合併快照、日誌與本進程尚未寫出的增量，多個 worker 的用量都會計入
+    """
+
+    def __init__(self, flush_interval_seconds: float = 2.0, compact_bytes: int = 256 * 1024):
         self.token_file = Path("./token_stats_global.json")
-        self.total_tokens = {"input": 0, "output": 0, "cost": 0.0}
-        self.service_stats = {}
-        self._load_token_stats()
-    
-    def _load_token_stats(self):
-        """加載 token 統計"""
-        try:
-            if self.token_file.exists():
-                with open(self.token_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.total_tokens = data.get('total', {"input": 0, "output": 0, "cost": 0.0})
-                    self.service_stats = data.get('services', {})
-        except Exception as e:
-            print(f"Failed to load global token stats: {e}")
-    
-    def _save_token_stats(self):
-        """保存 token 統計"""
-        try:
-            data = {
-                'total': self.total_tokens,
-                'services': self.service_stats
-            }
-            with open(self.token_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Failed to save global token stats: {e}")
-    
-    def _calculate_cost(self, input_tokens: int, output_tokens: int) -> float:
-        """計算 Gemini API 費用"""
-        # Gemini 1.5 Pro 價格 (USD per 1M tokens)
-        input_price = 1.25 / 1000000  # $1.25 per 1M input tokens
-        output_price = 5.00 / 1000000  # $5.00 per 1M output tokens
-        return (input_tokens * input_price) + (output_tokens * output_price)
-    
-    def record_usage(self, service_type: str, input_tokens: int, output_tokens: int, audio_input_tokens: int = 0, image_count: int = 0):
-        """記錄服務使用量"""
-        cost = self._calculate_cost(input_tokens, output_tokens)
-        
-        # 更新全局統計
-        self.total_tokens["input"] += input_tokens
-        self.total_tokens["output"] += output_tokens
-        self.total_tokens["cost"] += cost
-        
-        # 更新服務統計
-        if service_type not in self.service_stats:
-            self.service_stats[service_type] = {"input": 0, "output": 0, "cost": 0.0, "audio_input": 0, "image_count": 0}
-        
-        self.service_stats[service_type]["input"] += input_tokens
-        self.service_stats[service_type]["output"] += output_tokens
-        self.service_stats[service_type]["cost"] += cost
-        self.service_stats[service_type]["audio_input"] += audio_input_tokens
-        self.service_stats[service_type]["image_count"] += image_count
-        
-        self._save_token_stats()
+        self._log = AppendLog(
+            snapshot_file=self.token_file,
+            log_file=self.token_file.with_name(self.token_file.name + ".log"),
+            lock_file=self.token_file.with_name(self.token_file.name + ".lock"),
+            empty=_empty_stats,
+            load_snapshot=_merge_stats,
+            apply_record=_merge_stats,
+            coalesce=_coalesce,
+            flush_interval_seconds=flush_interval_seconds,
+            compact_bytes=compact_bytes,
+            snapshot_indent=2,
+            name="token-stats"
+        )
+
+    def _calculate_cost(self, input_tokens: int, output_tokens: int, audio_input_tokens: int = 0) -> float:
+        """計算 Gemini API 費用（文字與音頻輸入分開計價）"""
+        return calculate_gemini_cost(TokenUsage(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            audio_input_tokens=audio_input_tokens
+        )).total_cost
+
+    def record_usage(
+        self,
+        service_type: str,
+        input_tokens: int,
+        output_tokens: int,
+        audio_input_tokens: int = 0,
+        image_count: int = 0,
+        latency_ms: Optional[float] = None
+    ):
+        """記錄服務使用量（只追加到記憶體緩衝）"""
+        cost = self._calculate_cost(input_tokens, output_tokens, audio_input_tokens)
+
+        stats = {
+            "input": input_tokens,
+            "output": output_tokens,
+            "cost": cost,
+            "audio_input": audio_input_tokens,
+            "image_count": image_count
+        }
+        # 記錄呼叫次數與延遲，用於容量規劃
+        if latency_ms is not None:
+            stats["calls"] = 1
+            stats["latency_ms"] = latency_ms
+            stats["max_latency_ms"] = latency_ms
+        self._log.append({
+            "total": {"input": input_tokens, "output": output_tokens, "cost": cost},
+            "services": {service_type: stats}
+        })
+
+        # 同時記錄到時間序列帳本（端點與任務歸屬由 contextvar 帶入）
+        get_usage_ledger().record(service_type, TokenUsage(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            audio_input_tokens=audio_input_tokens,
+            image_count=image_count,
+            latency_ms=latency_ms
+        ), cost)
+
         return cost
-    
+
     def update_token_stats(self, input_tokens: int, output_tokens: int):
         """更新 token 統計 (向下相容)"""
         return self.record_usage("legacy", input_tokens, output_tokens)
-    
+
+    def flush(self):
+        """把緩衝中的增量追加到日誌，必要時壓縮"""
+        self._log.flush()
+
+    def compact(self):
+        """將日誌合併回快照"""
+        self._log.compact()
+
+    def _aggregated_stats(self) -> Dict[str, Any]:
+        """合併磁碟上所有進程的統計與本進程尚未寫出的增量"""
+        def merge(disk_stats: Dict[str, Any], pending: List[Dict[str, Any]]) -> Dict[str, Any]:
+            stats = _empty_stats()
+            _merge_stats(stats, disk_stats)
+            for delta in pending:
+                _merge_stats(stats, delta)
+            return stats
+
+        return self._log.read(merge)
+
     def get_stats(self, service_type: str = None) -> Dict:
         """獲取統計信息"""
-        if service_type and service_type in self.service_stats:
-            stats = self.service_stats[service_type]
+        return self._format_stats(self._aggregated_stats(), service_type)
+
+    @staticmethod
+    def _format_stats(aggregated: Dict[str, Any], service_type: str = None) -> Dict:
+        if service_type and service_type in aggregated["services"]:
+            stats = aggregated["services"][service_type]
             return {
-                "total_input_tokens": stats["input"],
-                "total_output_tokens": stats["output"],
-                "total_tokens": stats["input"] + stats["output"],
-                "total_cost_usd": stats["cost"],
+                "total_input_tokens": stats.get("input", 0),
+                "total_output_tokens": stats.get("output", 0),
+                "total_tokens": stats.get("input", 0) + stats.get("output", 0),
+                "total_cost_usd": stats.get("cost", 0.0),
                 "audio_input_tokens": stats.get("audio_input", 0),
-                "image_count": stats.get("image_count", 0)
+                "image_count": stats.get("image_count", 0),
+                "llm_calls": stats.get("calls", 0),
+                "avg_latency_ms": round(stats["latency_ms"] / stats["calls"], 1) if stats.get("calls") else None,
+                "max_latency_ms": round(stats.get("max_latency_ms", 0.0), 1) if stats.get("calls") else None
             }
         else:
+            total = aggregated["total"]
             return {
-                "total_input_tokens": self.total_tokens["input"],
-                "total_output_tokens": self.total_tokens["output"],
-                "total_tokens": self.total_tokens["input"] + self.total_tokens["output"],
-                "total_cost_usd": self.total_tokens["cost"]
+                "total_input_tokens": total["input"],
+                "total_output_tokens": total["output"],
+                "total_tokens": total["input"] + total["output"],
+                "total_cost_usd": total["cost"]
             }
-    
+
     def get_service_stats(self, service: str) -> Dict:
         """獲取特定服務的統計信息"""
         return self.get_stats(service)
-    
+
     def get_all_stats(self) -> Dict:
         """獲取所有統計信息"""
+        aggregated = self._aggregated_stats()
         return {
-            "total": self.get_stats(),
-            "services": {service: self.get_stats(service) for service in self.service_stats.keys()}
+            "total": self._format_stats(aggregated),
+            "services": {service: self._format_stats(aggregated, service) for service in aggregated["services"].keys()}
         }
 
 # 全局實例
@@ -105,8 +180,10 @@ def get_token_service():
     """獲取全局 TokenService 實例"""
     global _global_token_service
     if _global_token_service is None:
-        _global_token_service = TokenService()
+        _global_token_service = TokenService(
+            flush_interval_seconds=float(os.getenv("TOKEN_STATS_FLUSH_SECONDS", "2"))
+        )
     return _global_token_service
 
 # 向下相容
-token_service = get_token_service()
\ No newline at end of file
+token_service = get_token_service()
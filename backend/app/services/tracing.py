@@ -0,0 +1,204 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    from opentelemetry import trace as otel_trace
+    _otel_tracer = otel_trace.get_tracer("ai-smart-meeting-notes.rag")
+except ImportError:
+    otel_trace = None
+    _otel_tracer = None
+
+
+def _otel_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    # OpenTelemetry 不接受 None 屬性值
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+class Span:
+    """單一追蹤區段，欄位與 OpenTelemetry span 對應"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self._otel_span = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+        if self._otel_span is not None and value is not None:
+            self._otel_span.set_attribute(key, value)
+
+    def end(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._start_perf) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.start_ns + int((self.duration_ms or 0) * 1_000_000),
+            "duration_ms": round(self.duration_ms or 0, 3),
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+class Trace:
+    """一次請求的追蹤，收集各階段 span 並在結束時匯出"""
+
+    def __init__(self, name: str, exporter: Optional["JSONLSpanExporter"] = None, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.exporter = exporter
+        self.root = Span(name, self.trace_id, attributes=attributes)
+        self.spans: List[Span] = []
+        self._stack: List[Span] = [self.root]
+        self._otel_context = None
+        if _otel_tracer is not None:
+            self._otel_context = _otel_tracer.start_as_current_span(name, attributes=_otel_attributes(attributes))
+            self.root._otel_span = self._otel_context.__enter__()
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """建立子區段；可巢狀使用"""
+        span = Span(name, self.trace_id, parent_id=self._stack[-1].span_id, attributes=attributes)
+        self._stack.append(span)
+        otel_context = None
+        if _otel_tracer is not None:
+            otel_context = _otel_tracer.start_as_current_span(name, attributes=_otel_attributes(attributes))
+            span._otel_span = otel_context.__enter__()
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set_attribute("error", str(e))
+            raise
+        finally:
+            span.end()
+            if otel_context is not None:
+                otel_context.__exit__(None, None, None)
+            self._stack.pop()
+            self.spans.append(span)
+
+    def set_status(self, status: str):
+        self.root.status = status
+
+    def finish(self):
+        """結束追蹤並交給匯出器（非同步寫入，不阻塞請求）"""
+        self.root.end()
+        if self._otel_context is not None:
+            self._otel_context.__exit__(None, None, None)
+            self._otel_context = None
+        if self.exporter is not None:
+            self.exporter.export([self.root] + self.spans)
+
+    def timings(self) -> Dict[str, float]:
+        """各階段耗時（毫秒）；同名區段相加"""
+        timings: Dict[str, float] = {}
+        for span in self.spans:
+            timings[span.name] = round(timings.get(span.name, 0.0) + (span.duration_ms or 0), 2)
+        timings["total"] = round(self.root.duration_ms or (time.perf_counter() - self.root._start_perf) * 1000, 2)
+        return timings
+
+
+class JSONLSpanExporter:
+    """把 span 以 JSON Lines 追加寫入本地檔案，由背景執行緒批次寫入
+
+    檔案超過 max_bytes 時輪替為 .1、.2 …，最多保留 backup_count 個舊檔。
+    """
+
+    def __init__(self, path: Path, max_queue: int = 10000, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: List[Span]):
+        for span in spans:
+            try:
+                self._queue.put_nowait(span.to_dict())
+            except queue.Full:
+                # 匯出跟不上時丟棄，不影響請求
+                return
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._rotate_if_needed()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write("".join(json.dumps(span, ensure_ascii=False) + "\n" for span in batch))
+            except Exception as e:
+                logger.warning(f"Failed to export spans: {e}")
+
+    def _rotate_if_needed(self):
+        """與 logging.handlers.RotatingFileHandler 相同的輪替方式"""
+        try:
+            if self.path.stat().st_size < self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{i}")
+            if source.exists():
+                os.replace(source, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+
+
+# 全局匯出器
+_span_exporter = None
+
+def get_span_exporter() -> Optional[JSONLSpanExporter]:
+    """獲取全局 span 匯出器
+
+    本地 JSONL 匯出預設關閉（已安裝 OpenTelemetry 時 span 會交給其 SDK）：
+    - RAG_TRACE_FILE：設定後才啟用，例如 ./traces/rag_spans.jsonl
+    - RAG_TRACE_MAX_BYTES：單檔大小上限（預設 10 MB），超過時輪替
+    - RAG_TRACE_BACKUP_COUNT：保留的輪替檔數量（預設 3）
+    """
+    global _span_exporter
+    trace_file = os.getenv("RAG_TRACE_FILE", "")
+    if not trace_file:
+        return None
+    if _span_exporter is None:
+        _span_exporter = JSONLSpanExporter(
+            Path(trace_file),
+            max_bytes=int(os.getenv("RAG_TRACE_MAX_BYTES", str(10 * 1024 * 1024))),
+            backup_count=int(os.getenv("RAG_TRACE_BACKUP_COUNT", "3"))
+        )
+    return _span_exporter
+
+
+def start_trace(name: str, **attributes) -> Trace:
+    """開始一次追蹤"""
+    return Trace(name, exporter=get_span_exporter(), **attributes)
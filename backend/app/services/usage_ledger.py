@@ -0,0 +1,272 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from ..models.usage_tracking import TokenUsage
+from .append_log import AppendLog
+
+# 由中介軟體/背景任務設定，記錄用量時自動帶入端點與任務 ID
+_current_endpoint: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_endpoint", default=None)
+_current_task_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_task_id", default=None)
+
+# 彙總粒度（秒）
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+
+# 各粒度保留時間（秒），None 表示永久保留
+DEFAULT_RETENTION = {"minute": 2 * 86400, "hour": 90 * 86400, "day": None}
+
+T = TypeVar("T")
+
+_FIELDS = ("input", "output", "audio_input", "image_count", "cost", "requests", "timed_calls", "latency_ms")
+
+
+@contextmanager
+def usage_context(endpoint: Optional[str] = None, task_id: Optional[str] = None):
+    """在此範圍內記錄的用量歸屬到指定端點/任務"""
+    tokens = []
+    if endpoint is not None:
+        tokens.append((_current_endpoint, _current_endpoint.set(endpoint)))
+    if task_id is not None:
+        tokens.append((_current_task_id, _current_task_id.set(task_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def _empty_rollups() -> Dict[str, Any]:
+    return {"buckets": {name: {} for name in GRANULARITIES}, "tasks": {}}
+
+
+def _add(target: Dict[str, Any], values: Dict[str, Any]):
+    for field in _FIELDS:
+        if values.get(field):
+            target[field] = target.get(field, 0) + values[field]
+
+
+def _fold_event(rollups: Dict[str, Any], event: Dict[str, Any]):
+    """將單筆用量事件累加到各粒度的時間桶"""
+    ts = event["ts"]
+    service = event.get("service") or "unknown"
+    key = f"{service}\t{event.get('endpoint') or ''}"
+    for name, size in GRANULARITIES.items():
+        bucket = str(int(ts // size * size))
+        stats = rollups["buckets"][name].setdefault(bucket, {}).setdefault(key, {})
+        _add(stats, event)
+    task_id = event.get("task_id")
+    if task_id:
+        task = rollups["tasks"].setdefault(task_id, {})
+        _add(task, event)
+        services = task.setdefault("services", {})
+        services[service] = services.get(service, 0) + 1
+        task["last_ts"] = max(task.get("last_ts", 0), ts)
+
+
+def _merge_rollups(target: Dict[str, Any], source: Dict[str, Any]):
+    for name in GRANULARITIES:
+        for bucket, groups in source.get("buckets", {}).get(name, {}).items():
+            target_groups = target["buckets"][name].setdefault(bucket, {})
+            for key, stats in groups.items():
+                _add(target_groups.setdefault(key, {}), stats)
+    for task_id, stats in source.get("tasks", {}).items():
+        task = target["tasks"].setdefault(task_id, {})
+        _add(task, stats)
+        services = task.setdefault("services", {})
+        for service, count in stats.get("services", {}).items():
+            services[service] = services.get(service, 0) + count
+        task["last_ts"] = max(task.get("last_ts", 0), stats.get("last_ts", 0))
+
+
+def _format_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+    timed_calls = stats.get("timed_calls", 0)
+    return {
+        "input_tokens": stats.get("input", 0),
+        "output_tokens": stats.get("output", 0),
+        "audio_input_tokens": stats.get("audio_input", 0),
+        "total_tokens": stats.get("input", 0) + stats.get("output", 0) + stats.get("audio_input", 0),
+        "image_count": stats.get("image_count", 0),
+        "cost_usd": round(stats.get("cost", 0.0), 6),
+        "requests": stats.get("requests", 0),
+        "avg_latency_ms": round(stats["latency_ms"] / timed_calls, 1) if timed_calls else None
+    }
+
+
+class UsageLedger:
+    """時間序列用量帳本
+
+    - 每次呼叫只在記憶體中追加一筆事件，由背景執行緒批次寫入 append-only 的 events.log
+    - 壓縮時把事件彙總成分鐘/小時/天的時間桶與任務總量（rollups.json），並依保留期限刪除舊桶
+    - 查詢時合併 rollups、尚未壓縮的事件與本進程尚未寫出的事件
+    """
+
+    def __init__(
+        self,
+        directory: Path = Path("./usage_ledger"),
+        flush_interval_seconds: float = 2.0,
+        compact_interval_seconds: float = 300.0,
+        compact_bytes: int = 1024 * 1024,
+        retention: Optional[Dict[str, Optional[int]]] = None,
+        task_retention_seconds: int = 30 * 86400
+    ):
+        self.directory = Path(directory)
+        self.retention = {**DEFAULT_RETENTION, **(retention or {})}
+        self.task_retention_seconds = task_retention_seconds
+        self._log = AppendLog(
+            snapshot_file=self.directory / "rollups.json",
+            log_file=self.directory / "events.log",
+            lock_file=self.directory / "ledger.lock",
+            empty=_empty_rollups,
+            load_snapshot=_merge_rollups,
+            apply_record=_fold_event,
+            prepare_snapshot=self._apply_retention,
+            flush_interval_seconds=flush_interval_seconds,
+            compact_bytes=compact_bytes,
+            compact_interval_seconds=compact_interval_seconds,
+            name="usage-ledger"
+        )
+
+    def record(
+        self,
+        service_type: str,
+        token_usage: TokenUsage,
+        cost: float,
+        task_id: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        timestamp: Optional[float] = None
+    ):
+        """記錄一筆用量（只追加到記憶體緩衝）"""
+        event = {
+            "ts": timestamp or time.time(),
+            "service": service_type,
+            "endpoint": endpoint or _current_endpoint.get(),
+            "task_id": task_id or _current_task_id.get(),
+            "input": token_usage.input_tokens,
+            "output": token_usage.output_tokens,
+            "audio_input": token_usage.audio_input_tokens or 0,
+            "image_count": token_usage.image_count or 0,
+            "cost": cost,
+            "requests": 1
+        }
+        if token_usage.latency_ms is not None:
+            event["timed_calls"] = 1
+            event["latency_ms"] = token_usage.latency_ms
+        self._log.append(event)
+
+    def flush(self):
+        """把緩衝中的事件追加到 events.log，必要時壓縮"""
+        self._log.flush()
+
+    def compact(self):
+        """立即把事件彙總進 rollups 並套用保留期限"""
+        self._log.compact()
+
+    def query(
+        self,
+        granularity: str = "hour",
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        service: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        group_by: str = "service"
+    ) -> Dict[str, Any]:
+        """查詢時間序列用量
+
+        group_by 可為 "service"、"endpoint" 或 "none"。
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unsupported granularity: {granularity}")
+        if group_by not in ("service", "endpoint", "none"):
+            raise ValueError(f"Unsupported group_by: {group_by}")
+
+        def collect(views: List[Dict[str, Any]]) -> Dict[int, Dict[str, Dict[str, Any]]]:
+            points: Dict[int, Dict[str, Dict[str, Any]]] = {}
+            for rollups in views:
+                for bucket, groups in rollups["buckets"][granularity].items():
+                    bucket_ts = int(bucket)
+                    if (start is not None and bucket_ts + GRANULARITIES[granularity] <= start) or (end is not None and bucket_ts >= end):
+                        continue
+                    for key, stats in groups.items():
+                        key_service, key_endpoint = key.split("\t", 1)
+                        if service and key_service != service:
+                            continue
+                        if endpoint and key_endpoint != endpoint:
+                            continue
+                        group = {"service": key_service, "endpoint": key_endpoint or "(none)", "none": "all"}[group_by]
+                        _add(points.setdefault(bucket_ts, {}).setdefault(group, {}), stats)
+            return points
+
+        points = self._read(collect)
+
+        series = []
+        for bucket_ts in sorted(points):
+            groups = points[bucket_ts]
+            total: Dict[str, Any] = {}
+            for stats in groups.values():
+                _add(total, stats)
+            series.append({
+                "timestamp": datetime.fromtimestamp(bucket_ts, timezone.utc).isoformat(),
+                "total": _format_stats(total),
+                "groups": {name: _format_stats(stats) for name, stats in sorted(groups.items())}
+            })
+        return {"granularity": granularity, "group_by": group_by, "points": series}
+
+    def get_task_usage(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """查詢單一任務的累計用量"""
+        def collect(views: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            total: Dict[str, Any] = {}
+            services: Dict[str, int] = {}
+            found = False
+            for rollups in views:
+                stats = rollups["tasks"].get(task_id)
+                if stats:
+                    found = True
+                    _add(total, stats)
+                    for name, count in stats.get("services", {}).items():
+                        services[name] = services.get(name, 0) + count
+            if not found:
+                return None
+            return {"task_id": task_id, **_format_stats(total), "services": services}
+
+        return self._read(collect)
+
+    def _read(self, view: Callable[[List[Dict[str, Any]]], T]) -> T:
+        """以 [磁碟上的彙總（含未壓縮事件）, 本進程尚未寫出的事件] 呼叫 view（在記憶體狀態鎖內執行）"""
+        def with_pending(disk_rollups: Dict[str, Any], pending: List[Dict[str, Any]]) -> T:
+            pending_rollups = _empty_rollups()
+            for event in pending:
+                _fold_event(pending_rollups, event)
+            return view([disk_rollups, pending_rollups])
+
+        return self._log.read(with_pending)
+
+    def _apply_retention(self, rollups: Dict[str, Any]):
+        """壓縮前依保留期限刪除舊時間桶與任務"""
+        now = time.time()
+        for name, retention in self.retention.items():
+            if retention is None:
+                continue
+            cutoff = now - retention
+            buckets = rollups["buckets"][name]
+            for bucket in [bucket for bucket in buckets if int(bucket) < cutoff]:
+                del buckets[bucket]
+        task_cutoff = now - self.task_retention_seconds
+        for task_id in [task_id for task_id, stats in rollups["tasks"].items() if stats.get("last_ts", 0) < task_cutoff]:
+            del rollups["tasks"][task_id]
+
+
+# 全局實例
+_global_usage_ledger = None
+
+def get_usage_ledger() -> UsageLedger:
+    """獲取全局 UsageLedger 實例"""
+    global _global_usage_ledger
+    if _global_usage_ledger is None:
+        _global_usage_ledger = UsageLedger(
+            flush_interval_seconds=float(os.getenv("TOKEN_STATS_FLUSH_SECONDS", "2"))
+        )
+    return _global_usage_ledger
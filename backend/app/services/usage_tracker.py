@@ -1,39 +1,78 @@
 import json
 from typing import Dict, Any, Optional
 from ..models.usage_tracking import TokenUsage, UsageReport, calculate_gemini_cost, calculate_imagen_cost
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 class UsageTracker:
     """使用量追蹤服務"""
     
     @staticmethod
-    def extract_token_usage_from_response(response: Any, service_type: str = "text") -> TokenUsage:
-        """從 Gemini API 回應中提取 token 使用量"""
+    def extract_token_usage_from_response(response: Any, service_type: str = "text", latency_ms: Optional[float] = None) -> TokenUsage:
+        """從 Gemini API 回應中提取 token 使用量
+
+        支援 google.generativeai 回應（usage_metadata 物件）與
+        LangChain AIMessage（usage_metadata 字典）。
+        """
         try:
-            # 檢查回應是否有 usage_metadata
-            if hasattr(response, 'usage_metadata'):
-                usage = response.usage_metadata
-                
-                input_tokens = usage.prompt_token_count
-                output_tokens = usage.candidates_token_count
-                
-                # 如果是音頻服務，將輸入 token 標記為音頻 token
-                if service_type == "audio":
-                    return TokenUsage(
-                        input_tokens=0,
-                        output_tokens=output_tokens,
-                        audio_input_tokens=input_tokens
-                    )
-                else:
-                    return TokenUsage(
-                        input_tokens=input_tokens,
-                        output_tokens=output_tokens
-                    )
+            usage = getattr(response, 'usage_metadata', None)
+            if not usage:
+                return TokenUsage(latency_ms=latency_ms)
+
+            if isinstance(usage, dict):
+                # LangChain AIMessage.usage_metadata
+                input_tokens = usage.get('input_tokens') or 0
+                output_tokens = usage.get('output_tokens') or 0
+                audio_tokens = (usage.get('input_token_details') or {}).get('audio') or 0
             else:
-                return TokenUsage()
-                
+                input_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+                # thinking tokens 以輸出價格計費
+                output_tokens = (getattr(usage, 'candidates_token_count', 0) or 0) + (getattr(usage, 'thoughts_token_count', 0) or 0)
+                audio_tokens = sum(
+                    getattr(detail, 'token_count', 0) or 0
+                    for detail in (getattr(usage, 'prompt_tokens_details', None) or [])
+                    if 'AUDIO' in str(getattr(detail, 'modality', '')).upper()
+                )
+
+            # 舊版 SDK 沒有按模態拆分，音頻服務的輸入全部視為音頻 token
+            if service_type == "audio" and not audio_tokens:
+                audio_tokens = input_tokens
+
+            return TokenUsage(
+                input_tokens=max(0, input_tokens - audio_tokens),
+                output_tokens=output_tokens,
+                audio_input_tokens=audio_tokens or None,
+                latency_ms=latency_ms
+            )
+
+        except Exception as e:
+            logger.warning(f"Error extracting token usage: {e}")
+            return TokenUsage(latency_ms=latency_ms)
+    
+    @staticmethod
+    def record_response_usage(
+        response: Any,
+        service_type: str,
+        input_modality: str = "text",
+        latency_ms: Optional[float] = None,
+        image_count: int = 0
+    ) -> TokenUsage:
+        """提取回應中的實際 token 使用量並記錄到全局統計"""
+        token_usage = UsageTracker.extract_token_usage_from_response(response, input_modality, latency_ms)
+        try:
+            from .token_service import get_token_service
+            get_token_service().record_usage(
+                service_type,
+                token_usage.input_tokens,
+                token_usage.output_tokens,
+                token_usage.audio_input_tokens or 0,
+                image_count,
+                latency_ms=latency_ms
+            )
         except Exception as e:
-            print(f"Error extracting token usage: {e}")
-            return TokenUsage()
+            logger.warning(f"Token recording error: {e}")
+        return token_usage
     
     @staticmethod
     def create_usage_report(
@@ -0,0 +1,150 @@
+"""
+發票資料庫效能測試
+
+建立含大量發票的暫存 SQLite 資料庫，量測列表與統計查詢的延遲，
+並與未調校的設定（預設 journal、無複合索引）比較。
+
+用法：
+    python benchmark_invoice_db.py                # 1,000,000 筆
+    python benchmark_invoice_db.py --rows 200000 --repeat 20
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# 避免匯入時在工作目錄建立正式資料庫
+os.environ.setdefault("INVOICE_DATABASE_URL", "sqlite:///:memory:")
+
+from sqlalchemy import create_engine, func, text
+from sqlalchemy.orm import sessionmaker
+
+from app.models.invoice import Base, Invoice
+from app.services.invoice_database import create_invoice_engine, init_database
+from app.services.invoice_stats import get_summary, rebuild_aggregates
+
+CATEGORIES = ["交通", "餐飲", "辦公用品", "住宿", "通訊", "水電", "維修", "保險", "其他"]
+STATUSES = ["pending", "approved", "rejected"]
+COMPOSITE_INDEXES = [
+    "ix_invoices_created_id",
+    "ix_invoices_category_created",
+    "ix_invoices_status_created",
+    "ix_invoices_category_amount"
+]
+
+
+def populate(engine, rows: int, batch_size: int = 50000):
+    """以 executemany 批次寫入測試資料"""
+    random.seed(42)
+    start = datetime(2020, 1, 1)
+    insert = text(
+        "INSERT INTO invoices (invoice_number, invoice_date, vendor_name, total_amount, tax_amount, "
+        "net_amount, category, status, image_path, ocr_text, created_at, updated_at) "
+        "VALUES (:invoice_number, :invoice_date, :vendor_name, :total_amount, :tax_amount, "
+        ":net_amount, :category, :status, :image_path, :ocr_text, :created_at, :created_at)"
+    )
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for i in range(offset, min(offset + batch_size, rows)):
+            created = start + timedelta(seconds=i * 150)
+            amount = round(random.uniform(20, 20000), 0)
+            batch.append({
+                "invoice_number": f"AB{i:08d}",
+                "invoice_date": created,
+                "vendor_name": f"商家{random.randint(1, 5000)}",
+                "total_amount": amount,
+                "tax_amount": round(amount * 0.05, 0),
+                "net_amount": round(amount / 1.05, 0),
+                "category": random.choice(CATEGORIES),
+                "status": random.choice(STATUSES),
+                "image_path": f"/uploads/{i}.jpg",
+                "ocr_text": "x" * 400,
+                "created_at": created
+            })
+        with engine.begin() as conn:
+            conn.execute(insert, batch)
+
+
+def run_queries(session_factory, repeat: int):
+    """執行與 /list、/stats/summary 相同的查詢，回傳各查詢的延遲（毫秒）"""
+    queries = {
+        "list category=餐飲 limit 100": lambda db: db.query(Invoice).filter(Invoice.category == "餐飲")
+            .order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(100).all(),
+        "list status=pending limit 100": lambda db: db.query(Invoice).filter(Invoice.status == "pending")
+            .order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(100).all(),
+        "list newest limit 100": lambda db: db.query(Invoice)
+            .order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(100).all(),
+        "stats count": lambda db: db.query(Invoice).count(),
+        "stats sum(total_amount)": lambda db: db.query(func.sum(Invoice.total_amount)).scalar(),
+        "stats by category": lambda db: db.query(
+            Invoice.category, func.count(Invoice.id), func.sum(Invoice.total_amount)
+        ).group_by(Invoice.category).all(),
+        "stats summary (aggregates)": get_summary
+    }
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            db = session_factory()
+            try:
+                started = time.perf_counter()
+                query(db)
+                timings.append((time.perf_counter() - started) * 1000)
+            finally:
+                db.close()
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="發票資料庫效能測試")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="測試資料筆數")
+    parser.add_argument("--repeat", type=int, default=10, help="每個查詢執行次數")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "invoices_bench.db")
+        url = f"sqlite:///{path}"
+
+        print(f"=== 建立 {args.rows:,} 筆發票 ===")
+        started = time.perf_counter()
+        tuned_engine = create_invoice_engine(url)
+        init_database(tuned_engine)
+        populate(tuned_engine, args.rows)
+        with tuned_engine.begin() as conn:
+            # 直接以 SQL 寫入的資料不經過 ORM 事件，需重建彙總表
+            rebuild_aggregates(conn)
+            conn.execute(text("ANALYZE"))
+        print(f"寫入耗時 {time.perf_counter() - started:.1f}s，檔案大小 {os.path.getsize(path) / 1024 / 1024:.0f} MB\n")
+
+        tuned = run_queries(sessionmaker(bind=tuned_engine), args.repeat)
+        tuned_engine.dispose()
+
+        # 未調校的設定：預設 pragma、只有原本的索引
+        baseline_engine = create_engine(url, connect_args={"check_same_thread": False})
+        with baseline_engine.begin() as conn:
+            conn.execute(text("PRAGMA journal_mode=DELETE"))
+            for name in COMPOSITE_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            conn.execute(text("ANALYZE"))
+        baseline = run_queries(sessionmaker(bind=baseline_engine), args.repeat)
+        baseline_engine.dispose()
+
+    print(f"{'查詢':<34}{'未調校 p50':>12}{'p95':>10}{'調校後 p50':>12}{'p95':>10}{'加速':>8}")
+    for name in tuned:
+        base_p50, base_p95 = baseline[name]
+        tuned_p50, tuned_p95 = tuned[name]
+        speedup = base_p50 / tuned_p50 if tuned_p50 else float("inf")
+        print(f"{name:<34}{base_p50:>10.1f}ms{base_p95:>8.1f}ms{tuned_p50:>10.1f}ms{tuned_p95:>8.1f}ms{speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+測試電子發票證明聯 QR Code 內容解析（77 碼表頭、16 進位金額、右側 ** 接續品項）
+"""
+
+import base64
+import os
+import sys
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.taiwan_invoice import EINVOICE_QR_HEADER_LENGTH, parse_einvoice_qr
+
+# 字軌號碼 民國日期 隨機碼 銷售額(100) 總計額(105) 買方統編 賣方統編 加密驗證
+HEADER = "AB11223344" + "1130815" + "1234" + "00000064" + "00000069" + "00000000" + "04595257" + "ndxwe5eJr1hHDZx7hRaTqw=="
+# :營業人自行使用區:QR 內記載品項數:交易品項總數:編碼(1 UTF-8):品項...
+LEFT_QR = HEADER + ":**********:2:3:1:咖啡:1:50:便當:2:100"
+RIGHT_QR = "**三明治:1:800"
+
+
+def test_header_is_77_characters():
+    assert len(HEADER) == EINVOICE_QR_HEADER_LENGTH == 77
+
+
+def test_parse_header_fields():
+    data = parse_einvoice_qr([LEFT_QR, RIGHT_QR])
+    assert data["invoice_number"] == "AB11223344"
+    assert data["invoice_date"] == "2024-08-15"
+    assert data["net_amount"] == 100.0
+    assert data["total_amount"] == 105.0
+    assert data["tax_amount"] == 5.0
+    assert data["vendor_tax_id"] == "04595257"
+
+
+def test_right_qr_continues_items():
+    """右側 QR Code 的品項接在左側之後"""
+    data = parse_einvoice_qr([LEFT_QR, RIGHT_QR])
+    assert [item["description"] for item in data["items"]] == ["咖啡", "便當", "三明治"]
+    assert data["items"][1] == {"description": "便當", "quantity": 2.0, "unit_price": 100.0, "amount": 200.0}
+    assert data["items"][2]["amount"] == 800.0
+    assert data["category"] == "餐飲"
+
+
+def test_right_qr_with_leading_colon():
+    data = parse_einvoice_qr([LEFT_QR, "**:三明治:1:800"])
+    assert [item["description"] for item in data["items"]] == ["咖啡", "便當", "三明治"]
+
+
+def test_payload_order_does_not_matter():
+    assert parse_einvoice_qr([RIGHT_QR, LEFT_QR]) == parse_einvoice_qr([LEFT_QR, RIGHT_QR])
+
+
+def test_left_qr_only():
+    data = parse_einvoice_qr([LEFT_QR])
+    assert [item["description"] for item in data["items"]] == ["咖啡", "便當"]
+
+
+def test_base64_encoded_items():
+    items = base64.b64encode("咖啡:1:50:便當:2:100".encode("utf-8")).decode("ascii")
+    data = parse_einvoice_qr([HEADER + ":**********:2:2:2:" + items])
+    assert [item["description"] for item in data["items"]] == ["咖啡", "便當"]
+
+
+def test_invalid_seller_tax_id_is_dropped():
+    data = parse_einvoice_qr([LEFT_QR.replace("04595257", "12345678")])
+    assert data["vendor_tax_id"] is None
+
+
+def test_non_invoice_payloads():
+    assert parse_einvoice_qr([]) is None
+    assert parse_einvoice_qr(["https://example.com", RIGHT_QR]) is None
+    # 日期不存在（民國 113 年 2 月 30 日）
+    assert parse_einvoice_qr([LEFT_QR.replace("1130815", "1130230")]) is None
+
+
+if __name__ == "__main__":
+    for test in (
+        test_header_is_77_characters,
+        test_parse_header_fields,
+        test_right_qr_continues_items,
+        test_right_qr_with_leading_colon,
+        test_payload_order_does_not_matter,
+        test_left_qr_only,
+        test_base64_encoded_items,
+        test_invalid_seller_tax_id_is_dropped,
+        test_non_invoice_payloads
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
@@ -0,0 +1,200 @@
+"""
+測試發票圖片重複偵測（dHash 只作候選，內容雜湊確認；版面相同的不同收據不可視為重複）
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageDraw
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models.invoice import Base, Invoice
+from app.services.image_hash import ImageHashIndex, compute_content_hash, compute_dhash, same_invoice_fields
+
+
+def _draw_receipt(path: str, items, total: int):
+    """同一商家版面的收據：相同的表頭，不同的品項與總計"""
+    image = Image.new("RGB", (400, 700), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 20, 380, 120), fill="black")
+    draw.text((40, 50), "GOOD TASTE CAFE", fill="white")
+    draw.text((40, 140), "AB-12345678   2024-08-15", fill="black")
+    for i, (name, price) in enumerate(items):
+        draw.text((40, 200 + i * 30), f"{name:<20}{price:>6}", fill="black")
+    draw.line((20, 560, 380, 560), fill="black", width=2)
+    draw.text((40, 580), f"TOTAL {total:>20}", fill="black")
+    image.save(path, "JPEG", quality=90)
+
+
+def _make_index():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    return session_factory, ImageHashIndex(session_factory, max_distance=4)
+
+
+def _store(session_factory, path: str, **fields) -> int:
+    db = session_factory()
+    invoice = Invoice(
+        image_path=path, image_hash=compute_dhash(path), content_hash=compute_content_hash(path),
+        status="pending", **fields
+    )
+    db.add(invoice)
+    db.commit()
+    invoice_id = invoice.id
+    db.close()
+    return invoice_id
+
+
+def test_distinct_same_layout_receipts_are_not_exact_duplicates():
+    """版面相同的兩張收據 dHash 幾乎相同，但內容雜湊不同，只能是「相似」而不是重複"""
+    with tempfile.TemporaryDirectory() as tmp:
+        first = os.path.join(tmp, "first.jpg")
+        second = os.path.join(tmp, "second.jpg")
+        _draw_receipt(first, [("Latte", 120), ("Bagel", 80)], 200)
+        _draw_receipt(second, [("Espresso", 90), ("Muffin", 75), ("Tea", 60)], 225)
+
+        distance = (int(compute_dhash(first), 16) ^ int(compute_dhash(second), 16)).bit_count()
+        assert distance <= 4, f"dHash 距離 {distance}，此測試需要 dHash 無法分辨的兩張收據"
+        assert compute_content_hash(first) != compute_content_hash(second)
+
+        session_factory, index = _make_index()
+        stored_id = _store(
+            session_factory, first, invoice_number="AB12345678",
+            invoice_date=datetime(2024, 8, 15), total_amount=200.0
+        )
+
+        match = index.find_duplicate(compute_dhash(second), compute_content_hash(second))
+        assert match is not None and match.invoice_id == stored_id
+        assert not match.exact
+
+        # OCR 欄位不同（另一張發票號碼與金額）→ 不是疑似重複
+        db = session_factory()
+        existing = db.get(Invoice, stored_id)
+        assert not same_invoice_fields(
+            {"invoice_number": "AB87654321", "invoice_date": "2024-08-15", "total_amount": 225.0}, existing
+        )
+        # 同一張發票重新拍照：號碼相同，或日期與金額相同 → 疑似重複
+        assert same_invoice_fields({"invoice_number": "AB12345678"}, existing)
+        assert same_invoice_fields({"invoice_date": "2024-08-15", "total_amount": 200.0}, existing)
+        db.close()
+
+
+def test_identical_file_is_exact_duplicate():
+    with tempfile.TemporaryDirectory() as tmp:
+        original = os.path.join(tmp, "original.jpg")
+        copy = os.path.join(tmp, "copy.jpg")
+        _draw_receipt(original, [("Latte", 120)], 120)
+        shutil.copyfile(original, copy)
+
+        session_factory, index = _make_index()
+        stored_id = _store(session_factory, original)
+
+        match = index.find_duplicate(compute_dhash(copy), compute_content_hash(copy))
+        assert match == (stored_id, 0, True)
+
+
+def test_index_sees_new_invoices_and_removals():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "receipt.jpg")
+        _draw_receipt(path, [("Latte", 120)], 120)
+        image_hash, content_hash = compute_dhash(path), compute_content_hash(path)
+
+        session_factory, index = _make_index()
+        assert index.find_duplicate(image_hash, content_hash) is None
+
+        # 其他 worker 寫入的發票在下次查詢時載入
+        stored_id = _store(session_factory, path)
+        assert index.find_duplicate(image_hash, content_hash).invoice_id == stored_id
+
+        # 已刪除的發票不再視為重複
+        db = session_factory()
+        db.delete(db.get(Invoice, stored_id))
+        db.commit()
+        db.close()
+        assert index.find_duplicate(image_hash, content_hash) is None
+
+
+def test_backfill_computes_both_hashes():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "old.jpg")
+        _draw_receipt(path, [("Latte", 120)], 120)
+
+        session_factory, index = _make_index()
+        db = session_factory()
+        db.add(Invoice(image_path="/uploads/old.jpg", status="pending"))
+        db.commit()
+        db.close()
+
+        assert index.backfill(lambda image_path: os.path.join(tmp, os.path.basename(image_path))) == 1
+        match = index.find_duplicate(compute_dhash(path), compute_content_hash(path))
+        assert match is not None and match.exact
+        # 已補算的發票不再重算
+        assert index.backfill(lambda image_path: os.path.join(tmp, os.path.basename(image_path))) == 0
+
+
+def test_backfill_retries_missing_files():
+    """檔案不存在時不標記 UNHASHABLE，檔案出現後的下次補算會處理"""
+    with tempfile.TemporaryDirectory() as tmp:
+        session_factory, index = _make_index()
+        db = session_factory()
+        db.add(Invoice(image_path="/uploads/later.jpg", status="pending"))
+        db.commit()
+        db.close()
+
+        resolve = lambda image_path: os.path.join(tmp, os.path.basename(image_path))
+        assert index.backfill(resolve) == 0
+        db = session_factory()
+        assert db.query(Invoice).filter(Invoice.image_hash.is_(None), Invoice.content_hash.is_(None)).count() == 1
+        db.close()
+
+        _draw_receipt(os.path.join(tmp, "later.jpg"), [("Latte", 120)], 120)
+        assert index.backfill(resolve) == 1
+
+
+def test_backfill_stops_when_requested():
+    """關閉時設定停止旗標：已算好的先提交，其餘留待下次啟動"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "old.jpg")
+        _draw_receipt(path, [("Latte", 120)], 120)
+
+        session_factory, index = _make_index()
+        db = session_factory()
+        db.add_all([Invoice(image_path="/uploads/old.jpg", status="pending") for _ in range(3)])
+        db.commit()
+        db.close()
+
+        stop_event = threading.Event()
+
+        def resolve_then_stop(image_path):
+            stop_event.set()
+            return path
+
+        assert index.backfill(resolve_then_stop, stop_event=stop_event) == 1
+        db = session_factory()
+        assert db.query(Invoice).filter(Invoice.content_hash.is_(None)).count() == 2
+        db.close()
+        assert index.backfill(lambda image_path: path) == 2
+
+
+if __name__ == "__main__":
+    for test in (
+        test_distinct_same_layout_receipts_are_not_exact_duplicates,
+        test_identical_file_is_exact_duplicate,
+        test_index_sees_new_invoices_and_removals,
+        test_backfill_computes_both_hashes,
+        test_backfill_retries_missing_files,
+        test_backfill_stops_when_requested
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
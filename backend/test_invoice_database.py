@@ -0,0 +1,146 @@
+"""
+測試發票資料庫設定：記憶體網址判斷、非同步引擎、InvoiceSession 彙總事件與啟動遷移
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 匯入模組時不應建立或修改資料庫檔案
+_tmpdir = tempfile.mkdtemp(prefix="invoice_db_test_")
+_module_db_path = os.path.join(_tmpdir, "module.db")
+os.environ["INVOICE_DATABASE_URL"] = f"sqlite:///{_module_db_path}"
+
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.models.invoice import Base, Invoice, InvoiceAggregate
+from app.services.invoice_database import (
+    InvoiceSession, _is_memory_url, create_async_invoice_engine, create_invoice_engine, init_database
+)
+
+# 在其他測試呼叫 init_database 之前記錄
+_created_on_import = os.path.exists(_module_db_path)
+
+
+def test_import_has_no_database_side_effects():
+    """遷移在啟動事件中執行，匯入模組不會建立資料庫檔案"""
+    assert not _created_on_import
+
+
+def test_is_memory_url():
+    assert _is_memory_url("sqlite://")
+    assert _is_memory_url("sqlite:///:memory:")
+    assert _is_memory_url("sqlite:///file:invoices?mode=memory&cache=shared&uri=true")
+    assert not _is_memory_url("sqlite:///./database/invoices.db")
+    assert not _is_memory_url("sqlite:////tmp/invoices.db")
+    assert not _is_memory_url("postgresql://user@localhost/invoices")
+
+
+async def _async_memory_round_trip():
+    engine = create_async_invoice_engine("sqlite://")
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            # 連線建立時已套用 pragma
+            assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == 5000
+            assert (await conn.execute(text("PRAGMA foreign_keys"))).scalar() == 1
+
+        session_factory = async_sessionmaker(
+            engine, sync_session_class=InvoiceSession, autoflush=False, expire_on_commit=False
+        )
+        async with session_factory() as db:
+            db.add(Invoice(invoice_number="AB00000001", invoice_date=datetime(2024, 3, 1), vendor_name="書店",
+                           total_amount=210.0, tax_amount=10.0, category="辦公"))
+            await db.commit()
+
+        # 記憶體資料庫只有單一連線，另一個 Session 看得到同一份資料與彙總
+        async with session_factory() as db:
+            invoices = (await db.execute(select(Invoice))).scalars().all()
+            aggregates = {
+                (row.dimension, row.key): row.count
+                for row in (await db.execute(select(InvoiceAggregate))).scalars().all()
+            }
+        return len(invoices), aggregates
+    finally:
+        await engine.dispose()
+
+
+def test_async_engine_in_memory_url():
+    """記憶體網址不帶連線池參數也能建立，並在非同步 Session 中觸發彙總事件"""
+    count, aggregates = asyncio.run(_async_memory_round_trip())
+    assert count == 1
+    assert aggregates == {("category", "辦公"): 1, ("month", "2024-03"): 1, ("vendor", "書店"): 1}
+
+
+def test_aggregate_listeners_only_on_invoice_session():
+    """彙總事件只掛在 InvoiceSession；其他 Session 類別不受影響"""
+    engine = create_invoice_engine(f"sqlite:///{os.path.join(_tmpdir, 'listeners.db')}")
+    Base.metadata.create_all(bind=engine)
+
+    plain = sessionmaker(bind=engine)()
+    plain.add(Invoice(invoice_number="AB00000002", vendor_name="超市", total_amount=100.0, category="日用"))
+    plain.commit()
+    assert plain.query(InvoiceAggregate).count() == 0
+    plain.close()
+
+    db = sessionmaker(class_=InvoiceSession, bind=engine)()
+    db.add(Invoice(invoice_number="AB00000003", vendor_name="超市", total_amount=50.0, category="日用"))
+    db.commit()
+    row = db.query(InvoiceAggregate).filter_by(dimension="vendor", key="超市").one()
+    assert (row.count, row.total_amount) == (1, 50.0)
+    db.close()
+    engine.dispose()
+
+
+def test_init_database_migrates_existing_table():
+    """既有資料庫缺少新欄位時補上，並從既有發票建立彙總表"""
+    path = os.path.join(_tmpdir, "legacy.db")
+    legacy = create_engine(f"sqlite:///{path}")
+    with legacy.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE invoices (id INTEGER PRIMARY KEY, invoice_number VARCHAR(50), invoice_date DATETIME, "
+            "vendor_name VARCHAR(200), vendor_tax_id VARCHAR(20), total_amount FLOAT, tax_amount FLOAT, "
+            "net_amount FLOAT, category VARCHAR(50), status VARCHAR(20), image_path VARCHAR(500), "
+            "ocr_text TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME)"
+        ))
+        conn.execute(text(
+            "INSERT INTO invoices (invoice_number, invoice_date, vendor_name, total_amount, tax_amount, category) "
+            "VALUES ('AB00000004', '2024-02-10 00:00:00', '餐廳', 300, 14, '餐飲')"
+        ))
+    legacy.dispose()
+
+    engine = create_invoice_engine(f"sqlite:///{path}")
+    init_database(engine)
+    # 重複執行不出錯（每次啟動都會呼叫）
+    init_database(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("invoices")}
+    assert {"image_hash", "content_hash", "thumbnail_url", "preview_url"} <= columns
+    indexes = {index["name"] for index in inspect(engine).get_indexes("invoices")}
+    assert "ix_invoices_created_id" in indexes
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT dimension, key, count FROM invoice_aggregates ORDER BY dimension")).all()
+        assert [tuple(row) for row in rows] == [("category", "餐飲", 1), ("month", "2024-02", 1), ("vendor", "餐廳", 1)]
+        assert conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).first()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    tests = [
+        test_import_has_no_database_side_effects,
+        test_is_memory_url,
+        test_async_engine_in_memory_url,
+        test_aggregate_listeners_only_on_invoice_session,
+        test_init_database_migrates_existing_table
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
@@ -0,0 +1,151 @@
+"""
+測試發票列表的游標分頁、fields 欄位投影與參數驗證
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 測試使用暫存資料庫與上傳目錄，不動到專案中的 invoices.db
+_tmpdir = tempfile.mkdtemp(prefix="invoice_list_test_")
+os.environ["INVOICE_DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'invoices.db')}"
+_cwd = os.getcwd()
+os.chdir(_tmpdir)
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.models.invoice import Invoice
+from app.routes import invoice_manager
+from app.services.invoice_database import SessionLocal, engine, init_database
+
+os.chdir(_cwd)
+init_database(engine)
+
+app = FastAPI()
+app.include_router(invoice_manager.router)
+client = TestClient(app)
+
+# ORM 寫入的 created_at：同一秒建立的發票（created_at 相同）與含微秒的時間混在一起
+_CREATED_AT = [
+    datetime(2024, 5, 1, 9, 0, 0),
+    datetime(2024, 5, 1, 9, 0, 0),
+    datetime(2024, 5, 1, 9, 0, 0),
+    datetime(2024, 5, 1, 9, 0, 0, 500000),
+    datetime(2024, 5, 2, 10, 30, 0),
+    datetime(2024, 5, 2, 10, 30, 0),
+    datetime(2024, 4, 30, 23, 59, 59)
+]
+
+
+def _seed():
+    db = SessionLocal()
+    try:
+        db.query(Invoice).delete()
+        invoices = [
+            Invoice(
+                invoice_number=f"AB{i:08d}", invoice_date=created_at, vendor_name=f"商家{i}",
+                total_amount=100.0 + i, tax_amount=5.0, category="餐飲", ocr_text="x" * 100,
+                created_at=created_at
+            )
+            for i, created_at in enumerate(_CREATED_AT)
+        ]
+        # 不指定 created_at 的發票由 CURRENT_TIMESTAMP 產生（不含微秒的字串格式）
+        invoices += [
+            Invoice(invoice_number=f"CD{i:08d}", vendor_name=f"商家{i}", total_amount=50.0, category="交通",
+                    ocr_text="x" * 100)
+            for i in range(3)
+        ]
+        db.add_all(invoices)
+        db.commit()
+        for invoice in invoices:
+            db.refresh(invoice)
+        # 預期順序：created_at 由新到舊，相同時 id 由大到小
+        return [invoice.id for invoice in sorted(invoices, key=lambda inv: (inv.created_at, inv.id), reverse=True)]
+    finally:
+        db.close()
+
+
+def _walk(limit: int, **params) -> list:
+    """跟著 X-Next-Cursor 走完所有分頁，回傳每頁的結果"""
+    pages = []
+    cursor = None
+    while True:
+        query = dict(params, limit=limit)
+        if cursor:
+            query["cursor"] = cursor
+        response = client.get("/api/invoice/list", params=query)
+        assert response.status_code == 200, response.text
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_cursor_round_trip_with_tied_created_at():
+    """created_at 相同的發票跨頁時不重複、不遺漏，順序與 (created_at, id) 遞減一致"""
+    expected = _seed()
+    for limit in (1, 2, 3, len(expected)):
+        pages = _walk(limit)
+        ids = [item["id"] for page in pages for item in page]
+        assert ids == expected, f"limit={limit}: {ids} != {expected}"
+        assert all(len(page) <= limit for page in pages)
+
+
+def test_last_page_has_no_cursor():
+    """剛好取完時不回傳下一頁游標"""
+    expected = _seed()
+    response = client.get("/api/invoice/list", params={"limit": len(expected)})
+    assert len(response.json()) == len(expected)
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_fields_projection():
+    """fields 只回傳指定欄位，分頁游標照常運作"""
+    expected = _seed()
+    pages = _walk(2, fields="id,vendor_name,total_amount")
+    items = [item for page in pages for item in page]
+    assert [item["id"] for item in items] == expected
+    assert all(set(item) == {"id", "vendor_name", "total_amount"} for item in items)
+
+
+def test_default_list_omits_ocr_text():
+    """預設不載入 ocr_text，指定 fields 時才回傳"""
+    _seed()
+    items = client.get("/api/invoice/list").json()
+    assert all(item.get("ocr_text") is None for item in items)
+    items = client.get("/api/invoice/list", params={"fields": "id,ocr_text"}).json()
+    assert all(item["ocr_text"] == "x" * 100 for item in items)
+
+
+def test_invalid_cursor_returns_400():
+    _seed()
+    for cursor in ("not-a-cursor", "bm90LWEtZGF0ZXwx", "MjAyNC0wNS0wMSAwOTowMDowMHxhYmM"):
+        response = client.get("/api/invoice/list", params={"cursor": cursor})
+        assert response.status_code == 400, (cursor, response.status_code)
+
+
+def test_unknown_field_returns_400():
+    _seed()
+    response = client.get("/api/invoice/list", params={"fields": "id,password"})
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+
+
+if __name__ == "__main__":
+    tests = [
+        test_cursor_round_trip_with_tied_created_at,
+        test_last_page_has_no_cursor,
+        test_fields_projection,
+        test_default_list_omits_ocr_text,
+        test_invalid_cursor_returns_400,
+        test_unknown_field_returns_400
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
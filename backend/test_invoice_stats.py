@@ -0,0 +1,139 @@
+"""
+測試發票彙總表的增量維護（before_flush 增量與完整重建一致）
+"""
+
+import os
+import sys
+from datetime import datetime
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.models.invoice import Base, Invoice, InvoiceAggregate
+from app.services.invoice_stats import get_summary, get_timeseries, rebuild_aggregates, register_aggregate_listeners
+
+
+class _StatsTestSession(Session):
+    """只在測試中掛上彙總事件的 Session 類別"""
+
+
+register_aggregate_listeners(_StatsTestSession)
+
+
+def _make_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(class_=_StatsTestSession, bind=engine)()
+
+
+def _aggregates(db) -> dict:
+    """目前的彙總列（忽略數量已歸零的鍵）"""
+    return {
+        (row.dimension, row.key): (row.count, round(row.total_amount, 2), round(row.tax_amount, 2))
+        for row in db.query(InvoiceAggregate).all()
+        if row.count
+    }
+
+
+def _assert_matches_rebuild(engine, db):
+    """增量維護的結果必須與從發票表完整重建的結果相同"""
+    incremental = _aggregates(db)
+    with engine.begin() as conn:
+        rebuild_aggregates(conn)
+    db.expire_all()
+    rebuilt = _aggregates(db)
+    assert incremental == rebuilt, f"增量 {incremental} != 重建 {rebuilt}"
+
+
+def test_insert_updates_aggregates():
+    """新增發票時，類別、月份、商家三個維度都要加上"""
+    engine, db = _make_session()
+    db.add_all([
+        Invoice(invoice_number="AB00000001", invoice_date=datetime(2024, 1, 15), vendor_name="咖啡店",
+                total_amount=105.0, tax_amount=5.0, category="餐飲"),
+        Invoice(invoice_number="AB00000002", invoice_date=datetime(2024, 1, 20), vendor_name="加油站",
+                total_amount=1050.0, tax_amount=50.0, category="交通")
+    ])
+    db.commit()
+
+    aggregates = _aggregates(db)
+    assert aggregates[("category", "餐飲")] == (1, 105.0, 5.0)
+    assert aggregates[("month", "2024-01")] == (2, 1155.0, 55.0)
+    assert aggregates[("vendor", "加油站")] == (1, 1050.0, 50.0)
+    assert get_summary(db)["total_invoices"] == 2
+    _assert_matches_rebuild(engine, db)
+
+
+def test_update_moves_invoice_between_category_and_month():
+    """修改類別與日期時，要從舊的類別/月份扣掉、加到新的類別/月份"""
+    engine, db = _make_session()
+    invoice = Invoice(invoice_number="AB00000003", invoice_date=datetime(2024, 1, 31), vendor_name="文具店",
+                      total_amount=200.0, tax_amount=10.0, category="其他")
+    db.add(invoice)
+    db.commit()
+
+    invoice.category = "辦公用品"
+    invoice.invoice_date = datetime(2024, 2, 1)
+    invoice.total_amount = 300.0
+    db.commit()
+
+    aggregates = _aggregates(db)
+    assert ("category", "其他") not in aggregates
+    assert ("month", "2024-01") not in aggregates
+    assert aggregates[("category", "辦公用品")] == (1, 300.0, 10.0)
+    assert aggregates[("month", "2024-02")] == (1, 300.0, 10.0)
+    assert [point["period"] for point in get_timeseries(db, bucket="month")] == ["2024-02"]
+    _assert_matches_rebuild(engine, db)
+
+
+def test_update_in_new_session_uses_committed_values():
+    """在另一個 Session 修改（舊值尚未載入）時，仍要扣掉資料庫中的舊值"""
+    engine, db = _make_session()
+    db.add(Invoice(invoice_number="AB00000004", invoice_date=datetime(2024, 3, 5), vendor_name="飯店",
+                   total_amount=3000.0, tax_amount=150.0, category="住宿"))
+    db.commit()
+    db.close()
+
+    db = sessionmaker(class_=_StatsTestSession, bind=engine)()
+    invoice = db.query(Invoice).one()
+    invoice.category = "交通"
+    db.commit()
+
+    aggregates = _aggregates(db)
+    assert ("category", "住宿") not in aggregates
+    assert aggregates[("category", "交通")] == (1, 3000.0, 150.0)
+    _assert_matches_rebuild(engine, db)
+
+
+def test_delete_removes_from_aggregates():
+    """刪除發票時扣回所有維度"""
+    engine, db = _make_session()
+    keep = Invoice(invoice_number="AB00000005", invoice_date=datetime(2024, 4, 1), vendor_name="超商",
+                   total_amount=50.0, tax_amount=2.0, category="餐飲")
+    remove = Invoice(invoice_number="AB00000006", invoice_date=datetime(2024, 4, 2), vendor_name="超商",
+                     total_amount=80.0, tax_amount=4.0, category="餐飲")
+    db.add_all([keep, remove])
+    db.commit()
+
+    db.delete(remove)
+    db.commit()
+
+    aggregates = _aggregates(db)
+    assert aggregates[("vendor", "超商")] == (1, 50.0, 2.0)
+    assert aggregates[("month", "2024-04")] == (1, 50.0, 2.0)
+    _assert_matches_rebuild(engine, db)
+
+
+if __name__ == "__main__":
+    for test in (
+        test_insert_updates_aggregates,
+        test_update_moves_invoice_between_category_and_month,
+        test_update_in_new_session_uses_committed_values,
+        test_delete_removes_from_aggregates
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
@@ -0,0 +1,170 @@
+"""
+測試 journal + 防抖快照存儲（重放、防抖、寫入快照時不阻塞其他寫入）
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import metadata_store
+from app.services.metadata_store import JournaledJSONStore
+
+
+def _read_snapshot(path: Path) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_journal_replay_after_crash():
+    """未寫入快照就結束程序，重新載入時由 journal 還原所有變更"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "docs.json"
+        store = JournaledJSONStore(path, debounce_seconds=60)
+        store.load()
+        store.set("a", {"name": "A"})
+        store.set("b", {"name": "B"})
+        store.delete("a")
+        store.set("c", [1, 2, 3])
+        # 模擬崩潰：計時器尚未觸發，快照不存在
+        store._timer.cancel()
+        assert not path.exists()
+
+        with open(store.journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "set", "key": "half')  # 寫到一半的最後一行
+
+        restored = JournaledJSONStore(path, debounce_seconds=60).load()
+        assert restored == {"b": {"name": "B"}, "c": [1, 2, 3]}
+
+
+def test_replace_and_replay_is_idempotent():
+    """快照已寫入但 .flushing 尚未刪除時崩潰，重放一次結果不變"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "docs.json"
+        store = JournaledJSONStore(path, debounce_seconds=60)
+        store.load()
+        store.set("old", 1)
+        store.replace({"x": 1, "y": 2})
+        store.set("x", 3)
+        store.flush()
+        assert _read_snapshot(path) == {"x": 3, "y": 2}
+
+        # 重新製造「快照已含變更、.flushing 還在」的狀態
+        with open(store.flushing_path, 'w', encoding='utf-8') as f:
+            f.write('{"op": "replace", "value": {"x": 1, "y": 2}}\n{"op": "set", "key": "x", "value": 3}\n')
+        store.set("z", 4)
+        store._timer.cancel()
+
+        assert JournaledJSONStore(path, debounce_seconds=60).load() == {"x": 3, "y": 2, "z": 4}
+
+
+def test_debounce_writes_snapshot_once():
+    """連續變更只在防抖時間後寫入一次快照，並清除 journal"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "docs.json"
+        store = JournaledJSONStore(path, debounce_seconds=0.2)
+        store.load()
+
+        writes = []
+        original = metadata_store.write_json_atomic
+
+        def counting_write(target, data, indent=None):
+            writes.append(dict(data))
+            original(target, data, indent=indent)
+
+        metadata_store.write_json_atomic = counting_write
+        try:
+            for i in range(20):
+                store.set(f"k{i}", i)
+            assert not path.exists()
+            time.sleep(0.6)
+        finally:
+            metadata_store.write_json_atomic = original
+
+        assert len(writes) == 1
+        assert _read_snapshot(path) == {f"k{i}": i for i in range(20)}
+        assert not store.journal_path.exists() or store.journal_path.stat().st_size == 0
+        assert not store.flushing_path.exists()
+
+
+def test_flush_does_not_block_writers():
+    """寫入快照（含 fsync）期間，其他執行緒的 set 不需等待磁碟 I/O"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "docs.json"
+        store = JournaledJSONStore(path, debounce_seconds=60)
+        store.load()
+        store.set("before", 1)
+
+        writing = threading.Event()
+        original = metadata_store.write_json_atomic
+
+        def slow_write(target, data, indent=None):
+            writing.set()
+            time.sleep(0.5)
+            original(target, data, indent=indent)
+
+        metadata_store.write_json_atomic = slow_write
+        try:
+            flusher = threading.Thread(target=store.flush)
+            flusher.start()
+            writing.wait(2)
+            started = time.perf_counter()
+            store.set("during", 2)
+            elapsed = time.perf_counter() - started
+            flusher.join()
+        finally:
+            metadata_store.write_json_atomic = original
+        store._timer.cancel()
+
+        assert elapsed < 0.2, f"set 等待了 {elapsed:.2f}s"
+        # 快照只包含開始寫入前的內容，寫入期間的變更留在新的 journal
+        assert _read_snapshot(path) == {"before": 1}
+        assert JournaledJSONStore(path, debounce_seconds=60).load() == {"before": 1, "during": 2}
+
+
+def test_failed_flush_keeps_changes():
+    """快照寫入失敗時保留 .flushing，之後的寫入或重放都不遺失變更"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "docs.json"
+        store = JournaledJSONStore(path, debounce_seconds=60)
+        store.load()
+        store.set("a", 1)
+
+        original = metadata_store.write_json_atomic
+
+        def failing_write(target, data, indent=None):
+            raise OSError("disk full")
+
+        metadata_store.write_json_atomic = failing_write
+        try:
+            store.flush()
+        finally:
+            metadata_store.write_json_atomic = original
+        assert store.flushing_path.exists()
+
+        store.set("b", 2)
+        store._timer.cancel()
+        assert JournaledJSONStore(path, debounce_seconds=60).load() == {"a": 1, "b": 2}
+
+        store.flush()
+        assert _read_snapshot(path) == {"a": 1, "b": 2}
+        assert not store.flushing_path.exists()
+
+
+if __name__ == "__main__":
+    for test in (
+        test_journal_replay_after_crash,
+        test_replace_and_replay_is_idempotent,
+        test_debounce_writes_snapshot_once,
+        test_flush_does_not_block_writers,
+        test_failed_flush_keeps_changes
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
@@ -0,0 +1,148 @@
+"""
+測試會話範圍檢索索引（精確搜尋、MMR 與 Chroma 一致，文檔重新索引後的快取失效）
+"""
+
+import os
+import sys
+
+import numpy as np
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.session_index import SessionIndexCache
+
+try:
+    import chromadb
+except ImportError:  # Chroma 為 RAG 的依賴，未安裝時只跑不需要它的測試
+    chromadb = None
+
+# 固定的 2 維向量：a0 與 a1 幾乎重複，b0 方向不同
+CHUNKS = {
+    "doc-a": [("a0", [1.0, 0.0]), ("a1", [0.99, 0.01]), ("a2", [0.0, 1.0])],
+    "doc-b": [("b0", [0.7, 0.7]), ("b1", [-1.0, 0.0])]
+}
+QUERY = [1.0, 0.0]
+
+
+class FakeCollection:
+    """只實作 SessionIndexCache 用到的 Chroma collection.get，並記錄呼叫次數"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.get_calls = 0
+
+    def get(self, where, include):
+        self.get_calls += 1
+        doc_id = where["doc_id"]["$eq"]
+        rows = self.chunks.get(doc_id, [])
+        # Chroma 不保證順序，反轉以確認索引依 chunk_index 排序
+        indexed = list(enumerate(rows))[::-1]
+        return {
+            "embeddings": np.asarray([vector for _, (_, vector) in indexed], dtype=np.float32),
+            "documents": [text for _, (text, _) in indexed],
+            "metadatas": [{"doc_id": doc_id, "chunk_index": i} for i, _ in indexed]
+        }
+
+
+def _texts(documents):
+    return [doc.page_content for doc in documents]
+
+
+def test_exact_search_orders_by_squared_l2():
+    collection = FakeCollection(CHUNKS)
+    index = SessionIndexCache(lambda: collection).get(["doc-a", "doc-b"])
+    assert len(index) == 5
+
+    results = index.similarity_search_with_score_by_vector(QUERY, k=3)
+    assert _texts(doc for doc, _ in results) == ["a0", "a1", "b0"]
+    assert results[0][1] == 0.0
+    assert abs(results[1][1] - 0.0002) < 1e-6
+    assert abs(results[2][1] - 0.58) < 1e-6
+    # k 大於文檔數時回傳全部
+    assert len(index.similarity_search_by_vector(QUERY, k=10)) == 5
+
+
+def test_session_only_contains_its_documents():
+    collection = FakeCollection(CHUNKS)
+    index = SessionIndexCache(lambda: collection).get(["doc-b"])
+    assert _texts(index.similarity_search_by_vector(QUERY, k=5)) == ["b0", "b1"]
+    assert SessionIndexCache(lambda: collection).get(["missing"]).similarity_search_by_vector(QUERY) == []
+
+
+def test_mmr_skips_near_duplicates():
+    """MMR 選出第一個最相關片段後，應跳過幾乎重複的 a1"""
+    collection = FakeCollection(CHUNKS)
+    index = SessionIndexCache(lambda: collection).get(["doc-a", "doc-b"])
+    assert _texts(index.similarity_search_by_vector(QUERY, k=2)) == ["a0", "a1"]
+    # 候選為最近的 a0、a1、b0；a1 與 a0 的冗餘度遠高於 b0
+    assert _texts(index.max_marginal_relevance_search_by_vector(QUERY, k=2, fetch_k=3, lambda_mult=0.25)) == ["a0", "b0"]
+    # lambda_mult = 1 時只看相關性，與精確搜尋相同
+    assert _texts(index.max_marginal_relevance_search_by_vector(QUERY, k=2, fetch_k=3, lambda_mult=1.0)) == ["a0", "a1"]
+
+
+def test_cache_reuses_documents_and_invalidates_on_reindex():
+    collection = FakeCollection({doc_id: list(rows) for doc_id, rows in CHUNKS.items()})
+    cache = SessionIndexCache(lambda: collection)
+
+    first = cache.get(["doc-a", "doc-b"])
+    assert collection.get_calls == 2
+    # 相同集合（順序不同）直接使用快取
+    assert cache.get(["doc-b", "doc-a"]) is first
+    # 新的會話組合只重用已載入的文檔向量
+    only_b = cache.get(["doc-b"])
+    assert collection.get_calls == 2
+
+    # doc-a 重新索引：內容改變，未失效前仍是舊結果
+    collection.chunks["doc-a"] = [("new-a0", [1.0, 0.0])]
+    assert cache.get(["doc-a", "doc-b"]) is first
+    cache.invalidate("doc-a")
+
+    refreshed = cache.get(["doc-a", "doc-b"])
+    assert refreshed is not first
+    assert _texts(refreshed.similarity_search_by_vector(QUERY, k=1)) == ["new-a0"]
+    assert len(refreshed) == 3
+    # 只重新讀取 doc-a；不含 doc-a 的會話索引保留
+    assert collection.get_calls == 3
+    assert cache.get(["doc-b"]) is only_b
+
+    cache.invalidate()
+    cache.get(["doc-b"])
+    assert collection.get_calls == 4
+
+
+def test_matches_chroma_query():
+    """與 Chroma（預設平方 L2 距離）的查詢結果與距離一致"""
+    if chromadb is None:
+        print("⚠️ chromadb 未安裝，略過")
+        return
+    client = chromadb.EphemeralClient()
+    chroma = client.create_collection("session_index_test", embedding_function=None)
+    for doc_id, rows in CHUNKS.items():
+        chroma.add(
+            ids=[text for text, _ in rows],
+            embeddings=[vector for _, vector in rows],
+            documents=[text for text, _ in rows],
+            metadatas=[{"doc_id": doc_id, "chunk_index": i} for i in range(len(rows))]
+        )
+    try:
+        index = SessionIndexCache(lambda: chroma).get(list(CHUNKS))
+        expected = chroma.query(query_embeddings=[QUERY], n_results=4, include=["documents", "distances"])
+        results = index.similarity_search_with_score_by_vector(QUERY, k=4)
+        assert _texts(doc for doc, _ in results) == expected["documents"][0]
+        assert np.allclose([score for _, score in results], expected["distances"][0], atol=1e-5)
+    finally:
+        client.delete_collection("session_index_test")
+
+
+if __name__ == "__main__":
+    for test in (
+        test_exact_search_orders_by_squared_l2,
+        test_session_only_contains_its_documents,
+        test_mmr_skips_near_duplicates,
+        test_cache_reuses_documents_and_invalidates_on_reindex,
+        test_matches_chroma_query
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
@@ -0,0 +1,107 @@
+"""
+測試統一發票 OCR 文字的規則擷取（統編檢查碼、日期、金額勾稽）
+"""
+
+import os
+import sys
+
+# 添加項目根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.taiwan_invoice import _parse_date, extract_fields, is_valid_tax_id
+
+SAMPLE_RECEIPT = """好味道餐飲有限公司
+電子發票證明聯
+113年08月15日
+AB-12345678
+賣方 04595257
+銷售額: 100
+稅額: 5
+總計: NT$105
+"""
+
+
+def test_valid_tax_ids():
+    """一般統編的加權和可被 5 整除"""
+    assert is_valid_tax_id("04595257")
+    assert is_valid_tax_id("22099131")
+
+
+def test_tax_id_with_seventh_digit_seven():
+    """第七碼為 7 時，加權和加 1 可被 5 整除也算有效"""
+    for tax_id in ("79343270", "02240178", "37741579"):
+        assert tax_id[6] == "7"
+        assert is_valid_tax_id(tax_id), tax_id
+
+
+def test_invalid_tax_ids():
+    assert not is_valid_tax_id("12345678")
+    assert not is_valid_tax_id("1234567")
+    assert not is_valid_tax_id("0459525A")
+    assert not is_valid_tax_id("")
+    assert not is_valid_tax_id(None)
+
+
+def test_roc_and_western_dates():
+    """民國年加 1911；西元年原樣保留；不存在的日期略過"""
+    assert _parse_date("113年8月15日") == "2024-08-15"
+    assert _parse_date("113/08/15") == "2024-08-15"
+    assert _parse_date("2024/08/15") == "2024-08-15"
+    assert _parse_date("2024-8-5") == "2024-08-05"
+    # 西元日期中的「024/08/15」不可被當成民國年
+    assert _parse_date("日期 2024.08.15 113年1月1日") == "2024-08-15"
+    assert _parse_date("113年2月30日") is None
+    assert _parse_date("沒有日期") is None
+
+
+def test_extract_fields_from_receipt():
+    data, confidence = extract_fields(SAMPLE_RECEIPT)
+    assert data["invoice_number"] == "AB12345678"
+    assert data["invoice_date"] == "2024-08-15"
+    assert data["vendor_name"] == "好味道餐飲有限公司"
+    assert data["vendor_tax_id"] == "04595257"
+    assert data["total_amount"] == 105.0
+    assert data["tax_amount"] == 5.0
+    assert data["net_amount"] == 100.0
+    assert data["category"] == "餐飲"
+    # 四個關鍵欄位齊全且金額勾稽相符
+    assert confidence == 1.0
+
+
+def test_extract_fields_penalizes_conflicting_amounts():
+    """未稅 + 稅額 與總計不符時降低信心分數"""
+    _, consistent = extract_fields(SAMPLE_RECEIPT)
+    data, conflicting = extract_fields(SAMPLE_RECEIPT.replace("總計: NT$105", "總計: NT$185"))
+    assert data["total_amount"] == 185.0
+    assert conflicting < consistent
+    assert conflicting == 0.7
+
+
+def test_extract_fields_ignores_invalid_tax_id():
+    data, confidence = extract_fields(SAMPLE_RECEIPT.replace("04595257", "12345678"))
+    assert data["vendor_tax_id"] is None
+    # 少了統編的權重 0.2，金額勾稽相符仍加 0.1
+    assert confidence == 0.9
+
+
+def test_extract_fields_without_tax_derives_net_amount():
+    data, _ = extract_fields("總計 $1,050")
+    assert data["total_amount"] == 1050.0
+    assert data["tax_amount"] == 0.0
+    assert data["net_amount"] == 1050.0
+
+
+if __name__ == "__main__":
+    for test in (
+        test_valid_tax_ids,
+        test_tax_id_with_seventh_digit_seven,
+        test_invalid_tax_ids,
+        test_roc_and_western_dates,
+        test_extract_fields_from_receipt,
+        test_extract_fields_penalizes_conflicting_amounts,
+        test_extract_fields_ignores_invalid_tax_id,
+        test_extract_fields_without_tax_derives_net_amount
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n測試完成!")
@@ -14,6 +14,8 @@ interface Invoice {
   status: string
   created_at: string
   image_path?: string
+  preview_url?: string
+  thumbnail_url?: string
 }
 
 export default function InvoiceList() {
@@ -201,12 +203,21 @@ export default function InvoiceList() {
                   {/* 發票縮圖區域 */}
                   <div className="flex items-start justify-between mb-4">
                     <div className="flex items-center gap-3">
-                      <div className={`w-12 h-12 ${getCategoryColor(invoice.category || '其他')} rounded-lg flex items-center justify-center border border-slate-200`}>
-                        {(() => {
-                          const IconComponent = getCategoryIcon(invoice.category || '其他')
-                          return <IconComponent className="w-5 h-5" />
-                        })()}
-                      </div>
+                      {invoice.thumbnail_url ? (
+                        <img
+                          src={`http://localhost:8000${invoice.thumbnail_url}`}
+                          alt={invoice.vendor_name || '發票縮圖'}
+                          loading="lazy"
+                          className="w-12 h-12 object-cover rounded-lg border border-slate-200"
+                        />
+                      ) : (
+                        <div className={`w-12 h-12 ${getCategoryColor(invoice.category || '其他')} rounded-lg flex items-center justify-center border border-slate-200`}>
+                          {(() => {
+                            const IconComponent = getCategoryIcon(invoice.category || '其他')
+                            return <IconComponent className="w-5 h-5" />
+                          })()}
+                        </div>
+                      )}
                       <div>
                         <h3 className="font-semibold text-gray-900 text-lg leading-tight">
                           {invoice.vendor_name || '未知商家'}
@@ -316,7 +327,7 @@ export default function InvoiceList() {
               <div className="p-4 max-h-[calc(90vh-120px)] overflow-auto">
                 {selectedInvoice.image_path ? (
                   <img
-                    src={`http://localhost:8000${selectedInvoice.image_path}`}
+                    src={`http://localhost:8000${selectedInvoice.preview_url || selectedInvoice.image_path}`}
                     alt="發票圖片"
                     className="max-w-full h-auto rounded-lg shadow-sm"
                     onError={(e) => {